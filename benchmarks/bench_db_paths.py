@@ -0,0 +1,108 @@
+# Copyright 2018 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Benchmarks the construction of Realtime Database references.
+
+Compares ``db.Reference``, which builds child references from the parsed segments of their
+parent and memoizes parsed paths, with the implementation it replaced, which joined the parent
+and child paths and parsed the result again. Both build chains of the form
+``Reference(path).child(x).child(y)``, once with a small set of child paths that are used over
+and over, and once with a distinct child path in every chain.
+
+Run from the root of the repository::
+
+    python -m benchmarks.bench_db_paths [--chains N] [--repeat N]
+"""
+
+from __future__ import print_function
+
+import argparse
+import timeit
+
+import six
+
+from firebase_admin import db
+
+
+_INVALID_PATH_CHARACTERS = '[].?#$'
+
+
+def _legacy_parse_path(path):
+    if not isinstance(path, six.string_types):
+        raise ValueError('Invalid path: "{0}". Path must be a string.'.format(path))
+    if any(ch in path for ch in _INVALID_PATH_CHARACTERS):
+        raise ValueError(
+            'Invalid path: "{0}". Path contains illegal characters.'.format(path))
+    return [seg for seg in path.split('/') if seg]
+
+
+def _legacy_validate_child_path(path):
+    if not path or not isinstance(path, six.string_types):
+        raise ValueError(
+            'Invalid path argument: "{0}". Path must be a non-empty string.'.format(path))
+    if path.startswith('/'):
+        raise ValueError(
+            'Invalid path argument: "{0}". Child path must not start with "/"'.format(path))
+
+
+class _LegacyReference(object):
+    """The path handling of db.Reference before child references reused parsed segments."""
+
+    def __init__(self, **kwargs):
+        self._client = kwargs.get('client')
+        if 'segments' in kwargs:
+            self._segments = kwargs.get('segments')
+        else:
+            self._segments = _legacy_parse_path(kwargs.get('path'))
+        self._pathurl = '/' + '/'.join(self._segments)
+
+    @property
+    def path(self):
+        return self._pathurl
+
+    def child(self, path):
+        _legacy_validate_child_path(path)
+        full_path = self._pathurl + '/' + path
+        return _LegacyReference(client=self._client, path=full_path)
+
+
+def _build_chains(cls, chains, distinct):
+    for i in range(chains):
+        key = 'post{0}'.format(i if distinct else i % 100)
+        cls(path='/users/alice').child('posts').child(key)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--chains', type=int, default=200000, help='number of chains to build')
+    parser.add_argument('--repeat', type=int, default=3, help='number of timed runs')
+    args = parser.parse_args()
+
+    assert _LegacyReference(path='/users/alice').child('posts').child('p1/comments').path == \
+        db.Reference(path='/users/alice').child('posts').child('p1/comments').path
+
+    print('Building {0} reference chains (best of {1} runs):'.format(args.chains, args.repeat))
+    for distinct, label in [(False, 'repeated child paths'), (True, 'distinct child paths')]:
+        print('  {0}:'.format(label))
+        results = {}
+        for name, cls in [('reparse', _LegacyReference), ('segments', db.Reference)]:
+            timer = timeit.Timer(
+                lambda cls=cls: _build_chains(cls, args.chains, distinct))
+            results[name] = min(timer.repeat(repeat=args.repeat, number=1))
+            print('    {0:<12} {1:8.3f} s'.format(name, results[name]))
+        print('    speedup      {0:8.1f}x'.format(results['reparse'] / results['segments']))
+
+
+if __name__ == '__main__':
+    main()
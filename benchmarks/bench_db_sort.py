@@ -0,0 +1,150 @@
+# Copyright 2018 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Benchmarks the client-side sorting of Realtime Database query results.
+
+Compares ``_db_utils.Sorter``, which sorts children by precomputed tuple keys, with the sorter it
+replaced, which wrapped every child in an object and compared those objects pairwise. Both sort
+the same randomly generated children, ordered by a child value as in ``order_by_child()``.
+
+Run from the root of the repository::
+
+    python -m benchmarks.bench_db_sort [--children N] [--repeat N]
+"""
+
+from __future__ import print_function
+
+import argparse
+import collections
+import random
+import timeit
+
+import six
+
+from firebase_admin import _db_utils
+
+
+class _LegacySorter(object):
+    """The sorter used by the db module before tuple sort keys."""
+
+    def __init__(self, results, order_by):
+        entries = [_LegacySortEntry(k, v, order_by) for k, v in results.items()]
+        self.sort_entries = sorted(entries)
+
+    def get(self):
+        return collections.OrderedDict([(e.key, e.value) for e in self.sort_entries])
+
+
+class _LegacySortEntry(object):
+    """A wrapper that sorts children by comparing their index types, indices and keys."""
+
+    _type_none = 0
+    _type_bool_false = 1
+    _type_bool_true = 2
+    _type_numeric = 3
+    _type_string = 4
+    _type_object = 5
+
+    def __init__(self, key, value, order_by):
+        self.key = key
+        self.value = value
+        if order_by == '$key' or order_by == '$priority':
+            self.index = key
+        elif order_by == '$value':
+            self.index = value
+        else:
+            self.index = _LegacySortEntry._extract_child(value, order_by)
+        self.index_type = _LegacySortEntry._get_index_type(self.index)
+
+    @classmethod
+    def _get_index_type(cls, index):
+        if index is None:
+            return cls._type_none
+        elif isinstance(index, bool) and not index:
+            return cls._type_bool_false
+        elif isinstance(index, bool) and index:
+            return cls._type_bool_true
+        elif isinstance(index, (int, float)):
+            return cls._type_numeric
+        elif isinstance(index, six.string_types):
+            return cls._type_string
+        else:
+            return cls._type_object
+
+    @classmethod
+    def _extract_child(cls, value, path):
+        current = value
+        for segment in path.split('/'):
+            if isinstance(current, dict):
+                current = current.get(segment)
+            else:
+                return None
+        return current
+
+    def _compare(self, other):
+        self_key, other_key = self.index_type, other.index_type
+        if self_key == other_key:
+            if self_key in (self._type_numeric, self._type_string) and self.index != other.index:
+                self_key, other_key = self.index, other.index
+            else:
+                self_key, other_key = self.key, other.key
+
+        if self_key < other_key:
+            return -1
+        elif self_key > other_key:
+            return 1
+        else:
+            return 0
+
+    def __lt__(self, other):
+        return self._compare(other) < 0
+
+
+def _make_children(count):
+    """Generates children whose score is usually a number, and sometimes missing or a string."""
+    rand = random.Random(0)
+    children = {}
+    for i in range(count):
+        child = {'name': 'user{0}'.format(i)}
+        roll = rand.random()
+        if roll < 0.8:
+            child['score'] = rand.randint(0, count // 10)
+        elif roll < 0.9:
+            child['score'] = 'level{0}'.format(rand.randint(0, 100))
+        children['key{0}'.format(i)] = child
+    return children
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--children', type=int, default=200000, help='number of children')
+    parser.add_argument('--repeat', type=int, default=3, help='number of timed runs')
+    args = parser.parse_args()
+
+    children = _make_children(args.children)
+    assert list(_LegacySorter(children, 'score').get()) == \
+        list(_db_utils.Sorter(children, 'score').get())
+
+    print('Sorting {0} children by a child value (best of {1} runs):'.format(
+        args.children, args.repeat))
+    results = {}
+    for name, cls in [('sort entries', _LegacySorter), ('tuple keys', _db_utils.Sorter)]:
+        timer = timeit.Timer(lambda cls=cls: cls(children, 'score').get())
+        results[name] = min(timer.repeat(repeat=args.repeat, number=1))
+        print('  {0:<14} {1:8.3f} s'.format(name, results[name]))
+    print('  speedup        {0:8.1f}x'.format(results['sort entries'] / results['tuple keys']))
+
+
+if __name__ == '__main__':
+    main()
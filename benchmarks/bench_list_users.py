@@ -0,0 +1,144 @@
+# Copyright 2018 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Benchmarks the traversal of the user records returned by ``auth.list_users()``.
+
+Compares ``ListUsersPage``, which creates the records of a page once and reuses them, with the
+implementation it replaced, whose ``users`` property created new records on every access, and
+whose iterator accessed that property twice for every record it returned. Both serve the same
+pages from an in-memory download function, and are timed iterating over all the pages with
+``iterate_all()``, and reading every record of a page through ``page.users[i]``.
+
+Run from the root of the repository::
+
+    python -m benchmarks.bench_list_users [--pages N] [--page-size N] [--repeat N]
+"""
+
+from __future__ import print_function
+
+import argparse
+import timeit
+
+from firebase_admin import _user_mgt
+
+
+class _LegacyListUsersPage(object):
+    """The ListUsersPage used before page records were created once."""
+
+    def __init__(self, download, page_token, max_results):
+        self._download = download
+        self._max_results = max_results
+        self._current = download(page_token, max_results)
+
+    @property
+    def users(self):
+        return [_user_mgt.ExportedUserRecord(user) for user in self._current.get('users', [])]
+
+    @property
+    def next_page_token(self):
+        return self._current.get('nextPageToken', '')
+
+    @property
+    def has_next_page(self):
+        return bool(self.next_page_token)
+
+    def get_next_page(self):
+        if self.has_next_page:
+            return _LegacyListUsersPage(self._download, self.next_page_token, self._max_results)
+        return None
+
+    def iterate_all(self):
+        return _LegacyUserIterator(self)
+
+
+class _LegacyUserIterator(object):
+    """The user iterator used before page records were created once."""
+
+    def __init__(self, current_page):
+        self._current_page = current_page
+        self._index = 0
+
+    def next(self):
+        if self._index == len(self._current_page.users):
+            if self._current_page.has_next_page:
+                self._current_page = self._current_page.get_next_page()
+                self._index = 0
+        if self._index < len(self._current_page.users):
+            result = self._current_page.users[self._index]
+            self._index += 1
+            return result
+        raise StopIteration
+
+    def __next__(self):
+        return self.next()
+
+    def __iter__(self):
+        return self
+
+
+def _make_download(pages, page_size):
+    users = [{'localId': 'user{0}'.format(i), 'email': 'user{0}@example.com'.format(i)}
+             for i in range(page_size)]
+
+    def download(page_token, max_results):
+        del max_results
+        index = int(page_token) if page_token else 0
+        next_token = str(index + 1) if index + 1 < pages else ''
+        return {'users': users, 'nextPageToken': next_token}
+    return download
+
+
+def _iterate_all(cls, download, page_size):
+    for user in cls(download, None, page_size).iterate_all():
+        user.uid # pylint: disable=pointless-statement
+
+
+def _access_records(cls, download, page_size):
+    page = cls(download, None, page_size)
+    for i in range(len(page.users)):
+        page.users[i].uid # pylint: disable=pointless-statement
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--pages', type=int, default=2, help='number of pages to iterate over')
+    parser.add_argument('--page-size', type=int, default=500, help='number of users per page')
+    parser.add_argument('--repeat', type=int, default=3, help='number of timed runs')
+    args = parser.parse_args()
+
+    sample = _make_download(3, 10)
+    legacy = [user.uid for user in _LegacyListUsersPage(sample, None, 10).iterate_all()]
+    current = [user.uid for user in _user_mgt.ListUsersPage(sample, None, 10).iterate_all()]
+    assert legacy == current and len(current) == 30
+
+    download = _make_download(args.pages, args.page_size)
+
+    print('Reading {0} pages of {1} users (best of {2} runs):'.format(
+        args.pages, args.page_size, args.repeat))
+    benchmarks = [
+        ('iterate_all()', lambda cls: _iterate_all(cls, download, args.page_size)),
+        ('page.users[i] (one page)', lambda cls: _access_records(cls, download, args.page_size)),
+    ]
+    for label, func in benchmarks:
+        print('  {0}:'.format(label))
+        results = {}
+        for name, cls in [('rebuild', _LegacyListUsersPage), ('reuse', _user_mgt.ListUsersPage)]:
+            timer = timeit.Timer(lambda cls=cls, func=func: func(cls))
+            results[name] = min(timer.repeat(repeat=args.repeat, number=1))
+            print('    {0:<12} {1:8.3f} s'.format(name, results[name]))
+        print('    speedup      {0:8.1f}x'.format(results['rebuild'] / results['reuse']))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,142 @@
+# Copyright 2018 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Benchmarks the parsing of Realtime Database event streams by the SSE client.
+
+Compares ``_sseclient.SSEClient``, which reads the stream in chunks of bytes, with the parser it
+replaced, which read and buffered the stream one character at a time. Both parse the same stream
+of ``put`` events, served from memory through a mock HTTP adapter.
+
+Run from the root of the repository::
+
+    python -m benchmarks.bench_sseclient [--events N] [--event-bytes N] [--repeat N]
+"""
+
+from __future__ import print_function
+
+import argparse
+import json
+import re
+import timeit
+
+from requests import adapters
+from requests import models
+import requests
+import six
+
+from firebase_admin import _sseclient
+
+
+_URL = 'https://test.firebaseio.com'
+_END_OF_FIELD = re.compile(r'\r\n\r\n|\r\r|\n\n')
+
+
+class _StreamAdapter(adapters.HTTPAdapter):
+    """Serves the same event stream in response to every request."""
+
+    def __init__(self, payload):
+        adapters.HTTPAdapter.__init__(self)
+        self._payload = payload
+
+    def send(self, request, **kwargs):
+        resp = models.Response()
+        resp.url = request.url
+        resp.status_code = 200
+        resp.raw = six.BytesIO(self._payload)
+        resp.encoding = 'utf-8'
+        return resp
+
+
+class _LegacyEventBuffer(object):
+    """The per-character event buffer used by the SSE client before chunked parsing."""
+
+    def __init__(self):
+        self._buffer = []
+        self._tail = ''
+
+    def append(self, char):
+        self._buffer.append(char)
+        self._tail += char
+        self._tail = self._tail[-4:]
+
+    @property
+    def is_end_of_field(self):
+        last_two_chars = self._tail[-2:]
+        return last_two_chars == '\n\n' or last_two_chars == '\r\r' or self._tail == '\r\n\r\n'
+
+    @property
+    def buffer_string(self):
+        return ''.join(self._buffer)
+
+
+def _legacy_parse(session, count):
+    """Parses count events the way the SSE client did before chunked parsing."""
+    resp = session.get(_URL, stream=True)
+    resp_iterator = resp.iter_content(decode_unicode=True)
+    buf = u''
+    events = []
+    while len(events) < count:
+        if not re.search(_END_OF_FIELD, buf):
+            temp_buffer = _LegacyEventBuffer()
+            while not temp_buffer.is_end_of_field:
+                temp_buffer.append(next(resp_iterator))
+            buf = temp_buffer.buffer_string
+        split = re.split(_END_OF_FIELD, buf)
+        buf = '\n\n'.join(split[1:])
+        events.append(_sseclient.Event.parse(split[0]))
+    resp.close()
+    return events
+
+
+def _chunked_parse(session, count):
+    client = _sseclient.SSEClient(_URL, session)
+    events = [next(client) for _ in range(count)]
+    client.close()
+    return events
+
+
+def _make_payload(events, event_bytes):
+    value = 'x' * event_bytes
+    lines = []
+    for i in range(events):
+        data = json.dumps({'path': '/items/{0}'.format(i), 'data': value})
+        lines.append('event: put\ndata: {0}\n\n'.format(data))
+    return ''.join(lines).encode('utf-8')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--events', type=int, default=10, help='number of events in the stream')
+    parser.add_argument('--event-bytes', type=int, default=128 * 1024,
+                        help='approximate size of each event in bytes')
+    parser.add_argument('--repeat', type=int, default=3, help='number of timed runs')
+    args = parser.parse_args()
+
+    session = requests.Session()
+    session.mount(_URL, _StreamAdapter(_make_payload(args.events, args.event_bytes)))
+    assert [event.data for event in _legacy_parse(session, args.events)] == \
+        [event.data for event in _chunked_parse(session, args.events)]
+
+    print('Parsing {0} events of {1} bytes (best of {2} runs):'.format(
+        args.events, args.event_bytes, args.repeat))
+    results = {}
+    for name, func in [('per-character', _legacy_parse), ('chunked', _chunked_parse)]:
+        timer = timeit.Timer(lambda func=func: func(session, args.events))
+        results[name] = min(timer.repeat(repeat=args.repeat, number=1))
+        print('  {0:<14} {1:8.3f} s'.format(name, results[name]))
+    print('  speedup        {0:8.1f}x'.format(results['per-character'] / results['chunked']))
+
+
+if __name__ == '__main__':
+    main()
@@ -15,6 +15,7 @@
 """Firebase auth utils."""
 
 import json
+import numbers
 import re
 
 import six
@@ -154,6 +155,14 @@ def validate_int(value, label, low=None, high=None):
             raise ValueError('{0} must not be larger than {1}.'.format(label, high))
         return val_int
 
+def validate_rate(value, label):
+    """Validates that the given value is a positive number of operations per second."""
+    if isinstance(value, bool) or not isinstance(value, numbers.Number):
+        raise ValueError('Invalid type for {0}: {1}.'.format(label, value))
+    if not value > 0 or value == float('inf'):
+        raise ValueError('{0} must be a positive finite number.'.format(label))
+    return value
+
 def validate_custom_claims(custom_claims, required=False):
     """Validates the specified custom claims.
 
@@ -0,0 +1,127 @@
+# Copyright 2018 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Internal utilities for running blocking calls concurrently.
+
+This module provides a minimal subset of the concurrent.futures API, which is not available in
+Python 2.7.
+"""
+
+import collections
+import sys
+import threading
+import time
+
+import six
+
+
+class Future(object):
+    """The result of an operation that completes asynchronously (e.g. on a background thread)."""
+
+    def __init__(self):
+        self._done = threading.Event()
+        self._result = None
+        self._exc_info = None
+
+    def done(self):
+        return self._done.is_set()
+
+    def result(self):
+        """Waits for the call to complete, and returns its result.
+
+        Raises:
+          Exception: The exception raised by the call, if any.
+        """
+        self._done.wait()
+        if self._exc_info:
+            six.reraise(*self._exc_info)
+        return self._result
+
+    def exception(self):
+        """Waits for the call to complete, and returns the exception it raised, or None."""
+        self._done.wait()
+        return self._exc_info[1] if self._exc_info else None
+
+    def set_result(self, result):
+        self._result = result
+        self._done.set()
+
+    def set_exception_info(self, exc_info):
+        """Marks the call as failed, with the given (type, value, traceback) tuple."""
+        self._exc_info = exc_info
+        self._done.set()
+
+    def _run(self, func, args, kwargs):
+        try:
+            result = func(*args, **kwargs)
+        except Exception: # pylint: disable=broad-except
+            self.set_exception_info(sys.exc_info())
+        else:
+            self.set_result(result)
+
+
+def run_in_background(func, *args, **kwargs):
+    """Starts executing the given function on a new daemon thread.
+
+    Returns:
+      Future: A Future representing the result of the call.
+    """
+    future = Future()
+    thread = threading.Thread(
+        target=future._run, args=(func, args, kwargs)) # pylint: disable=protected-access
+    thread.daemon = True
+    thread.start()
+    return future
+
+
+def map_ordered(func, iterable, concurrency):
+    """Calls the given function on each element of an iterable, using multiple threads.
+
+    At most ``concurrency`` calls are in progress at any given time, and the iterable is consumed
+    lazily as calls complete.
+
+    Returns:
+      generator: A generator that yields the results of the calls in the order of the input
+      elements. Raises the exception of a failed call when its result is reached.
+    """
+    pending = collections.deque()
+    for item in iterable:
+        if len(pending) >= concurrency:
+            yield pending.popleft().result()
+        pending.append(run_in_background(func, item))
+    while pending:
+        yield pending.popleft().result()
+
+
+class RateLimiter(object):
+    """Spaces out calls made from any number of threads to at most ``rate`` calls per second.
+
+    Each call to ``acquire()`` reserves the next free slot, and sleeps until that slot begins.
+    Slots are ``1 / rate`` seconds apart, and are not accumulated while the limiter is idle.
+    """
+
+    def __init__(self, rate, clock=None, sleep=None):
+        self._interval = 1.0 / rate
+        self._clock = clock or time.time
+        self._sleep = sleep or time.sleep
+        self._next = None
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        with self._lock:
+            now = self._clock()
+            start = now if self._next is None else max(now, self._next)
+            self._next = start + self._interval
+        if start > now:
+            self._sleep(start - now)
@@ -0,0 +1,253 @@
+# Copyright 2017 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+"""Batching of small writes to the Firebase Realtime Database."""
+
+import collections
+import json
+import sys
+import threading
+
+import six
+
+from firebase_admin import _concurrency
+from firebase_admin import _db_client
+from firebase_admin import _db_utils
+from firebase_admin import _utils
+
+
+_WRITE_BATCHER_MAX_WRITES = 1000
+_WRITE_BATCHER_FLUSH_INTERVAL_SECONDS = 1.0
+
+
+class WriteBatcher(object):
+    """Coalesces many small writes into a few multi-location updates.
+
+    Writes made via ``set()`` and ``update()`` are buffered in memory, and sent to the database
+    as a single multi-location update (as in ``Reference.update()``) at the root of the
+    database. Multiple writes to the same path are merged, with the latest one taking effect.
+    A buffered batch is sent when it reaches ``max_writes`` paths or ``max_payload_bytes`` bytes,
+    when ``flush_interval`` seconds have passed since its first write, or when ``flush()`` is
+    called. Batches are sent in the order they were created, so writes always take effect in
+    the order they were made.
+
+    Each write returns a future, which completes when the batch containing the write has been
+    sent. Its ``result()`` method returns None if the batch was written successfully, and raises
+    the error encountered (usually an ``ApiCallError``) otherwise.
+    """
+
+    def __init__(self, app=None, url=None, max_writes=_WRITE_BATCHER_MAX_WRITES,
+                 max_payload_bytes=_db_client.BULK_LOAD_MAX_PAYLOAD_BYTES,
+                 flush_interval=_WRITE_BATCHER_FLUSH_INTERVAL_SECONDS):
+        """Creates a new WriteBatcher for the specified database.
+
+        Args:
+          app: An App instance (optional).
+          url: Base URL of the Firebase Database instance (optional). When specified, takes
+              precedence over the the ``databaseURL`` option set at app initialization.
+          max_writes: Maximum number of paths written by a single batch (optional).
+          max_payload_bytes: Maximum size of the JSON payload of a single batch (optional).
+          flush_interval: Maximum number of seconds a write is buffered before it is sent, or
+              None to only send batches when they are full or explicitly flushed (optional).
+
+        Raises:
+          ValueError: If any of the arguments are invalid.
+        """
+        for name, arg in (('Max writes', max_writes), ('Max payload bytes', max_payload_bytes)):
+            if not isinstance(arg, six.integer_types) or isinstance(arg, bool) or arg < 1:
+                raise ValueError('{0} must be a positive integer.'.format(name))
+        if flush_interval is not None and (
+                not isinstance(flush_interval, (six.integer_types, float)) or
+                isinstance(flush_interval, bool) or flush_interval <= 0):
+            raise ValueError('Flush interval must be a positive number or None.')
+        service = _utils.get_app_service(app, _db_client.DB_ATTRIBUTE, _db_client.DatabaseService)
+        self._client = service.get_client(url)
+        self._max_writes = max_writes
+        self._max_payload_bytes = max_payload_bytes
+        self._flush_interval = flush_interval
+        self._lock = threading.Lock()
+        # Held while a batch is being sent, so that batches are sent one at a time, in order.
+        self._flush_lock = threading.Lock()
+        self._batch = _WriteBatch()
+        self._closed = False
+
+    def set(self, path, value):
+        """Sets the data at the given path to the given value.
+
+        Args:
+          path: Path to a node in the database, other than the root.
+          value: JSON-serializable value to be set at the given path. Must not be None.
+
+        Returns:
+          object: A future that completes when the write has been sent.
+
+        Raises:
+          ValueError: If the path or the value is invalid, or if the batcher has been closed.
+          TypeError: If the value is not JSON-serializable.
+        """
+        if value is None:
+            raise ValueError('Value must not be None.')
+        return self._add([(self._get_write_path(path), value)])
+
+    def update(self, path, value):
+        """Updates the specified child keys of the given path to the provided values.
+
+        Args:
+          path: Path to a node in the database.
+          value: A dictionary containing the child keys to update, and their new values.
+
+        Returns:
+          object: A future that completes when the write has been sent.
+
+        Raises:
+          ValueError: If the path or the value is invalid, or if the batcher has been closed.
+          TypeError: If the value is not JSON-serializable.
+        """
+        if not value or not isinstance(value, dict):
+            raise ValueError('Value argument must be a non-empty dictionary.')
+        if None in value.keys():
+            raise ValueError('Dictionary must not contain None keys.')
+        segments = _db_utils.parse_path(path)
+        writes = []
+        for key, child in value.items():
+            child_path = '/'.join(segments + _db_utils.parse_path(key))
+            if not child_path:
+                raise ValueError('Invalid update key: "{0}".'.format(key))
+            writes.append((child_path, child))
+        if _WriteBatch.has_conflicts(child_path for child_path, _ in writes):
+            raise ValueError('Update keys must not overlap with each other.')
+        return self._add(writes)
+
+    def flush(self):
+        """Sends all buffered writes to the database, and waits for them to complete.
+
+        Failures are reported via the futures returned for the individual writes.
+        """
+        with self._flush_lock:
+            with self._lock:
+                batch, self._batch = self._batch, _WriteBatch()
+            self._send(batch)
+
+    def close(self):
+        """Sends all buffered writes, and stops accepting new writes."""
+        with self._lock:
+            self._closed = True
+        self.flush()
+
+    @classmethod
+    def _get_write_path(cls, path):
+        segments = _db_utils.parse_path(path)
+        if not segments:
+            raise ValueError('Invalid path: "{0}". Cannot write to the database root in a '
+                             'batch.'.format(path))
+        return '/'.join(segments)
+
+    def _add(self, writes):
+        entries = [(path, '{0}:{1}'.format(
+            json.dumps(path), json.dumps(value, separators=(',', ':')))) for path, value in writes]
+        future = _concurrency.Future()
+        while True:
+            with self._lock:
+                if self._closed:
+                    raise ValueError('Cannot write to a closed WriteBatcher.')
+                batch = self._batch
+                # A write to a path nested within another buffered path cannot be expressed in
+                # the same multi-location update. Such writes go into the next batch.
+                added = batch.add(entries, future)
+                if added:
+                    full = len(batch.entries) >= self._max_writes or \
+                        batch.size >= self._max_payload_bytes
+                    start_timer = len(batch.futures) == 1 and not full and \
+                        self._flush_interval is not None
+            if added:
+                break
+            self.flush()
+
+        if full:
+            self.flush()
+        elif start_timer:
+            timer = threading.Timer(self._flush_interval, self._flush_batch, args=(batch,))
+            timer.daemon = True
+            timer.start()
+        return future
+
+    def _flush_batch(self, batch):
+        with self._flush_lock:
+            with self._lock:
+                if self._batch is not batch:
+                    return
+                self._batch = _WriteBatch()
+            self._send(batch)
+
+    def _send(self, batch):
+        if not batch.entries:
+            return
+        try:
+            entries = list(batch.entries.values())
+            self._client.patch_entries('/.json', entries)
+        except Exception: # pylint: disable=broad-except
+            # Resolve the futures even on unexpected errors, so that callers never wait forever.
+            exc_info = sys.exc_info()
+            for future in batch.futures:
+                future.set_exception_info(exc_info)
+        else:
+            for future in batch.futures:
+                future.set_result(None)
+
+
+class _WriteBatch(object):
+    """A set of buffered writes that can be sent as a single multi-location update."""
+
+    def __init__(self):
+        self.entries = collections.OrderedDict()
+        self.futures = []
+        self.size = 2
+        # Proper ancestors of all the paths in the batch, used to detect overlapping writes.
+        self._ancestors = set()
+
+    def add(self, entries, future):
+        """Adds the given (path, serialized entry) pairs to the batch, unless any of the paths
+        overlap with a different path already in the batch.
+
+        Returns:
+          bool: True if the entries were added, False otherwise.
+        """
+        for path, _ in entries:
+            if path in self.entries:
+                continue
+            if path in self._ancestors or any(
+                    ancestor in self.entries for ancestor in _get_ancestor_paths(path)):
+                return False
+        for path, entry in entries:
+            previous = self.entries.pop(path, None)
+            if previous is not None:
+                self.size -= len(previous) + 1
+            self.entries[path] = entry
+            self.size += len(entry) + 1
+            self._ancestors.update(_get_ancestor_paths(path))
+        self.futures.append(future)
+        return True
+
+    @classmethod
+    def has_conflicts(cls, paths):
+        batch = cls()
+        return not all(batch.add([(path, '')], None) for path in paths)
+
+
+def _get_ancestor_paths(path):
+    index = path.find('/')
+    while index != -1:
+        yield path[:index]
+        index = path.find('/', index + 1)
@@ -0,0 +1,125 @@
+# Copyright 2017 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+"""Bulk reads and writes of large Firebase Realtime Database locations."""
+
+import json
+import threading
+
+import requests
+
+from firebase_admin import _concurrency
+from firebase_admin import _db_utils
+
+
+# Nodes estimated to be larger than this are read one child at a time by get_large().
+_LARGE_READ_MAX_BYTES = 64 * 1024 * 1024
+_LARGE_READ_ERROR = 'exceeds the maximum size'
+
+
+def parse_ndjson_record(line):
+    try:
+        record = json.loads(line)
+        return record['path'], record['value']
+    except (ValueError, KeyError, TypeError):
+        raise ValueError('Invalid NDJSON record: "{0}". Each line must be a JSON object with '
+                         '"path" and "value" fields.'.format(line.strip()))
+
+def bulk_load_batches(records, max_payload_bytes):
+    """Packs (path, value) records into serialized multi-location update payloads.
+
+    Yields (entries, record_count) tuples, where entries is a list of serialized "path":value
+    pairs that can be joined into a JSON object.
+    """
+    entries = []
+    size = 2
+    count = 0
+    for record in records:
+        try:
+            path, value = record
+        except (ValueError, TypeError):
+            raise ValueError('Invalid record: "{0}". Record must be a (path, value) '
+                             'tuple.'.format(record))
+        segments = _db_utils.parse_path(path)
+        if not segments:
+            raise ValueError('Invalid record path: "{0}". Path must not be empty.'.format(path))
+        count += 1
+        for entry in _serialize_entries('/'.join(segments), value, max_payload_bytes):
+            if entries and size + len(entry) + 1 > max_payload_bytes:
+                yield entries, count - 1
+                entries, size, count = [], 2, 1
+            entries.append(entry)
+            size += len(entry) + 1
+    if entries:
+        yield entries, count
+
+def _serialize_entries(path, value, max_payload_bytes):
+    # JSON is serialized with ASCII escapes, so the length of the string equals its size in bytes.
+    entry = '{0}:{1}'.format(json.dumps(path), json.dumps(value, separators=(',', ':')))
+    if len(entry) + 2 <= max_payload_bytes or not isinstance(value, dict) or not value:
+        yield entry
+        return
+    # Writing the children separately merges them into the existing value at the path. Clearing
+    # the path first is not an option, since the updates are sent concurrently.
+    for key, child in value.items():
+        for child_entry in _serialize_entries(
+                '{0}/{1}'.format(path, key), child, max_payload_bytes):
+            yield child_entry
+
+
+def _is_too_large(error):
+    detail = error.detail
+    if isinstance(detail, requests.exceptions.Timeout):
+        return True
+    response = getattr(detail, 'response', None)
+    return response is not None and response.status_code == 400 and \
+        _LARGE_READ_ERROR in str(error)
+
+
+class LargeReader(object):
+    """Reads large database locations by splitting them up into their child nodes.
+
+    Child nodes are read on separate threads, and each level of the tree is read with up to
+    ``concurrency`` threads. A semaphore shared by all threads limits the number of requests in
+    progress at any given time, so that nested splits do not overload the connection pool.
+    """
+
+    def __init__(self, concurrency):
+        self._concurrency = concurrency
+        self._semaphore = threading.Semaphore(concurrency)
+
+    def read(self, ref, size_hint):
+        if size_hint is None or size_hint <= _LARGE_READ_MAX_BYTES:
+            try:
+                return self._get(ref)
+            except _db_utils.ApiCallError as error:
+                if not _is_too_large(error):
+                    raise
+
+        shallow = self._get(ref, shallow=True)
+        if not isinstance(shallow, dict):
+            # Shallow reads return primitive values as is.
+            return shallow
+        keys = list(shallow)
+        child_hint = size_hint // len(keys) if size_hint is not None and keys else None
+        values = _concurrency.map_ordered(
+            lambda key: self.read(ref.child(key), child_hint), keys, self._concurrency)
+        # Children deleted since the shallow read are left out.
+        result = {key: value for key, value in zip(keys, values) if value is not None}
+        return _db_utils.to_json_array(result) if result else None
+
+    def _get(self, ref, shallow=False):
+        with self._semaphore:
+            return ref.get(shallow=shallow)
@@ -0,0 +1,471 @@
+# Copyright 2017 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+"""HTTP client and per-app service of the Firebase Realtime Database module."""
+
+import collections
+import json
+import sys
+import threading
+import time
+
+from google.auth import credentials as google_credentials
+import requests
+import six
+from six.moves import urllib
+
+import firebase_admin
+from firebase_admin import _db_listeners
+from firebase_admin import _db_utils
+from firebase_admin import _http_client
+
+
+DB_ATTRIBUTE = '_database'
+USER_AGENT = 'Firebase/HTTP/{0}/{1}.{2}/AdminPython'.format(
+    firebase_admin.__version__, sys.version_info.major, sys.version_info.minor)
+_LISTENER_QUEUE_SIZE = 1000
+_LISTENER_OVERFLOW_POLICIES = ('block', 'drop_oldest', 'coalesce')
+# Well under the 256 MB limit the REST API imposes on the size of a single write request.
+BULK_LOAD_MAX_PAYLOAD_BYTES = 10 * 1024 * 1024
+_BULK_LOAD_MAX_RETRIES = 3
+_BULK_LOAD_RETRY_DELAY_SECONDS = 1.0
+_RETRYABLE_STATUS_CODES = (429, 500, 502, 503, 504)
+# Hosts that may serve the database over plain HTTP, e.g. a db_emulator.Emulator.
+EMULATOR_HOSTS = ('localhost', '127.0.0.1', '::1')
+# The REST API does not accept read timeouts longer than 15 minutes.
+_MAX_SERVER_TIMEOUT_SECONDS = 15 * 60
+_WRITE_SIZE_LIMITS = ('tiny', 'small', 'medium', 'large', 'unlimited')
+
+
+def _is_retryable(error):
+    detail = error.detail
+    if isinstance(detail, (requests.exceptions.ConnectionError, requests.exceptions.Timeout)):
+        return True
+    response = getattr(detail, 'response', None)
+    return response is not None and response.status_code in _RETRYABLE_STATUS_CODES
+
+
+def validate_server_timeout(server_timeout):
+    if server_timeout is not None and (
+            not _db_utils.is_number(server_timeout) or server_timeout <= 0 or
+            server_timeout > _MAX_SERVER_TIMEOUT_SECONDS):
+        raise ValueError('Server timeout must be a positive number of seconds, no greater than '
+                         '{0}.'.format(_MAX_SERVER_TIMEOUT_SECONDS))
+
+def validate_write_size_limit(write_size_limit):
+    if write_size_limit is not None and write_size_limit not in _WRITE_SIZE_LIMITS:
+        raise ValueError('Write size limit must be one of {0}.'.format(
+            ', '.join(_WRITE_SIZE_LIMITS)))
+
+def add_server_params(method, params, server_timeout, write_size_limit):
+    """Appends the server-side limit that applies to the given HTTP method to a query string.
+
+    Reads are subject to the ``timeout`` parameter, and writes to the ``writeSizeLimit``
+    parameter.
+    """
+    if method == 'get':
+        if server_timeout is None:
+            return params
+        param = 'timeout={0}ms'.format(max(int(round(server_timeout * 1000)), 1))
+    else:
+        if write_size_limit is None:
+            return params
+        param = 'writeSizeLimit={0}'.format(write_size_limit)
+    return '{0}&{1}'.format(params, param) if params else param
+
+
+class _ReadCache(object):
+    """A size-bounded LRU cache of database values, revalidated with ETags.
+
+    Entries are keyed by the database URL and the path of the value, and are accounted for by the
+    size of the JSON response they were decoded from. Writes made through a client invalidate
+    the entries of all the paths they may affect.
+    """
+
+    _Entry = collections.namedtuple('_Entry', ['value', 'etag', 'size', 'timestamp'])
+
+    def __init__(self, max_bytes, max_age):
+        self._max_bytes = max_bytes
+        self._max_age = max_age
+        self._entries = collections.OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+
+    @property
+    def size(self):
+        return self._size
+
+    def get(self, client, url, server_timeout=None):
+        """Returns the value and the ETag at the given URL, from the cache if possible.
+
+        Values are copied out of the cache, so that callers can modify them without affecting
+        later reads.
+        """
+        key = (client.base_url, url)
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is not None:
+                # Re-insert the entry to mark it as the most recently used.
+                self._entries[key] = entry
+        if entry is not None and time.time() - entry.timestamp < self._max_age:
+            return _db_utils.copy_json(entry.value), entry.etag
+
+        headers = {'X-Firebase-ETag': 'true'}
+        if entry is not None:
+            headers['if-none-match'] = entry.etag
+        resp = client.request('get', url, headers=headers, server_timeout=server_timeout)
+        if entry is not None and resp.status_code == 304:
+            entry = entry._replace(timestamp=time.time())
+        else:
+            entry = self._Entry(resp.json(), resp.headers.get('ETag'), len(resp.content),
+                                time.time())
+        if entry.etag is None:
+            return entry.value, entry.etag
+        self._put(key, entry)
+        return _db_utils.copy_json(entry.value), entry.etag
+
+    def invalidate(self, base_url, url):
+        """Removes the entries that may be affected by a write to the given URL."""
+        path = self._get_path(url)
+        with self._lock:
+            for key in list(self._entries):
+                if key[0] != base_url:
+                    continue
+                other = self._get_path(key[1])
+                if not path or not other or other == path or other.startswith(path + '/') or \
+                        path.startswith(other + '/'):
+                    self._remove(key)
+
+    def _put(self, key, entry):
+        with self._lock:
+            self._remove(key)
+            if entry.size > self._max_bytes:
+                return
+            self._entries[key] = entry
+            self._size += entry.size
+            while self._size > self._max_bytes:
+                self._remove(next(iter(self._entries)))
+
+    def _remove(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self._size -= entry.size
+
+    @classmethod
+    def _get_path(cls, url):
+        if url.endswith('.json'):
+            url = url[:-len('.json')]
+        return url.strip('/')
+
+
+class DatabaseService(object):
+    """Service that maintains a collection of database clients."""
+
+    _DEFAULT_AUTH_OVERRIDE = '_admin_'
+
+    def __init__(self, app):
+        self._credential = app.credential.get_credential()
+        db_url = app.options.get('databaseURL')
+        if db_url:
+            self._db_url = DatabaseService._validate_url(db_url)
+        else:
+            self._db_url = None
+        auth_override = DatabaseService._get_auth_override(app)
+        if auth_override != self._DEFAULT_AUTH_OVERRIDE and auth_override != {}:
+            encoded = json.dumps(auth_override, separators=(',', ':'))
+            self._auth_override = 'auth_variable_override={0}'.format(encoded)
+        else:
+            self._auth_override = None
+        self._timeout = app.options.get('httpTimeout')
+        self._listener_threads = DatabaseService._get_listener_threads(app)
+        self._dispatch_options = DatabaseService._get_dispatch_options(app, self._listener_threads)
+        self._listener_dispatcher = None
+        self._listener_managers = {}
+        self._read_cache = DatabaseService._get_read_cache(app)
+        self._server_timeout, self._write_size_limit = DatabaseService._get_server_limits(app)
+        self._clients = {}
+
+    def get_client(self, base_url=None):
+        if base_url is None:
+            base_url = self._db_url
+        if isinstance(base_url, six.string_types) and base_url in self._clients:
+            # Already validated and normalized.
+            return self._clients[base_url]
+        base_url = DatabaseService._validate_url(base_url)
+        if base_url not in self._clients:
+            client = Client(
+                self._get_credential(base_url), base_url, self._auth_override, self._timeout)
+            if self._dispatch_options:
+                if self._listener_dispatcher is None:
+                    threads, queue_size, overflow = self._dispatch_options
+                    self._listener_dispatcher = _db_listeners.DispatchExecutor(
+                        threads, 'ListenerDispatch', max_queue_size=queue_size, overflow=overflow)
+                client.listener_dispatcher = self._listener_dispatcher
+            if self._listener_threads:
+                # Emulators and production databases are authorized with different credentials,
+                # so listeners on each share a separate manager.
+                scheme = urllib.parse.urlparse(base_url).scheme
+                if scheme not in self._listener_managers:
+                    self._listener_managers[scheme] = _db_listeners.ListenerManager(
+                        client.credential, self._listener_dispatcher)
+                client.listener_manager = self._listener_managers[scheme]
+            client.read_cache = self._read_cache
+            client.server_timeout = self._server_timeout
+            client.write_size_limit = self._write_size_limit
+            self._clients[base_url] = client
+        return self._clients[base_url]
+
+    def _get_credential(self, base_url):
+        """Returns the credential to authorize requests to the database at the given URL with."""
+        if base_url.startswith('http://'):
+            # Emulators do not check credentials. Avoid fetching OAuth2 tokens, so that they can be
+            # used without network access.
+            return _EmulatorCredential()
+        return self._credential
+
+    @classmethod
+    def _validate_url(cls, url):
+        """Parses and validates a given database URL."""
+        if not url or not isinstance(url, six.string_types):
+            raise ValueError(
+                'Invalid database URL: "{0}". Database URL must be a non-empty '
+                'URL string.'.format(url))
+        parsed = urllib.parse.urlparse(url)
+        if parsed.scheme == 'http' and parsed.hostname in EMULATOR_HOSTS:
+            return 'http://{0}'.format(parsed.netloc)
+        if parsed.scheme != 'https':
+            raise ValueError(
+                'Invalid database URL: "{0}". Database URL must be an HTTPS URL.'.format(url))
+        elif not parsed.netloc.endswith('.firebaseio.com'):
+            raise ValueError(
+                'Invalid database URL: "{0}". Database URL must be a valid URL to a '
+                'Firebase Realtime Database instance.'.format(url))
+        return 'https://{0}'.format(parsed.netloc)
+
+    @classmethod
+    def _get_auth_override(cls, app):
+        auth_override = app.options.get('databaseAuthVariableOverride', cls._DEFAULT_AUTH_OVERRIDE)
+        if auth_override == cls._DEFAULT_AUTH_OVERRIDE or auth_override is None:
+            return auth_override
+        if not isinstance(auth_override, dict):
+            raise ValueError('Invalid databaseAuthVariableOverride option: "{0}". Override '
+                             'value must be a dict or None.'.format(auth_override))
+        else:
+            return auth_override
+
+    @classmethod
+    def _get_listener_threads(cls, app):
+        threads = app.options.get('databaseListenerThreads')
+        if threads is None:
+            return None
+        if not isinstance(threads, six.integer_types) or isinstance(threads, bool) or threads < 1:
+            raise ValueError('Invalid databaseListenerThreads option: "{0}". Value must be a '
+                             'positive integer.'.format(threads))
+        if _db_listeners.selectors is None:
+            raise ValueError('The databaseListenerThreads option requires Python 3.4 or higher.')
+        return threads
+
+    @classmethod
+    def _get_dispatch_options(cls, app, listener_threads):
+        """Returns the (threads, queue size, overflow policy) to dispatch listener callbacks with.
+
+        Returns None if callbacks should be executed on the threads that read the event streams.
+        """
+        threads = app.options.get('databaseListenerDispatchThreads', listener_threads)
+        queue_size = app.options.get('databaseListenerQueueSize')
+        overflow = app.options.get('databaseListenerOverflow')
+        if threads is None:
+            if queue_size is not None or overflow is not None:
+                raise ValueError('The databaseListenerQueueSize and databaseListenerOverflow '
+                                 'options require the databaseListenerDispatchThreads option to '
+                                 'be set.')
+            return None
+        if not isinstance(threads, six.integer_types) or isinstance(threads, bool) or threads < 1:
+            raise ValueError('Invalid databaseListenerDispatchThreads option: "{0}". Value must be '
+                             'a positive integer.'.format(threads))
+        if queue_size is None:
+            queue_size = _LISTENER_QUEUE_SIZE
+        elif not isinstance(queue_size, six.integer_types) or isinstance(queue_size, bool) or \
+                queue_size < 1:
+            raise ValueError('Invalid databaseListenerQueueSize option: "{0}". Value must be a '
+                             'positive integer.'.format(queue_size))
+        if overflow is None:
+            overflow = 'block'
+        elif overflow not in _LISTENER_OVERFLOW_POLICIES:
+            raise ValueError('Invalid databaseListenerOverflow option: "{0}". Value must be one '
+                             'of {1}.'.format(overflow, ', '.join(_LISTENER_OVERFLOW_POLICIES)))
+        return threads, queue_size, overflow
+
+    def get_listener_stats(self):
+        if self._listener_dispatcher is None:
+            return None
+        return self._listener_dispatcher.stats()
+
+    @classmethod
+    def _get_read_cache(cls, app):
+        max_bytes = app.options.get('databaseCacheMaxBytes')
+        max_age = app.options.get('databaseCacheMaxAge')
+        if max_bytes is None:
+            if max_age is not None:
+                raise ValueError('The databaseCacheMaxAge option requires the '
+                                 'databaseCacheMaxBytes option to be set.')
+            return None
+        if not isinstance(max_bytes, six.integer_types) or isinstance(max_bytes, bool) or \
+                max_bytes < 1:
+            raise ValueError('Invalid databaseCacheMaxBytes option: "{0}". Value must be a '
+                             'positive integer.'.format(max_bytes))
+        if max_age is None:
+            max_age = 0
+        elif not isinstance(max_age, (six.integer_types, float)) or \
+                isinstance(max_age, bool) or max_age < 0:
+            raise ValueError('Invalid databaseCacheMaxAge option: "{0}". Value must be a '
+                             'non-negative number.'.format(max_age))
+        return _ReadCache(max_bytes, max_age)
+
+    @classmethod
+    def _get_server_limits(cls, app):
+        server_timeout = app.options.get('databaseServerTimeout')
+        if server_timeout is not None and (
+                not _db_utils.is_number(server_timeout) or server_timeout <= 0 or
+                server_timeout > _MAX_SERVER_TIMEOUT_SECONDS):
+            raise ValueError('Invalid databaseServerTimeout option: "{0}". Value must be a '
+                             'positive number no greater than {1}.'.format(
+                                 server_timeout, _MAX_SERVER_TIMEOUT_SECONDS))
+        write_size_limit = app.options.get('databaseWriteSizeLimit')
+        if write_size_limit is not None and write_size_limit not in _WRITE_SIZE_LIMITS:
+            raise ValueError('Invalid databaseWriteSizeLimit option: "{0}". Value must be one '
+                             'of {1}.'.format(write_size_limit, ', '.join(_WRITE_SIZE_LIMITS)))
+        return server_timeout, write_size_limit
+
+    def close(self):
+        for value in self._clients.values():
+            value.close()
+        self._clients = {}
+        for manager in self._listener_managers.values():
+            manager.close()
+        self._listener_managers = {}
+        if self._listener_dispatcher is not None:
+            self._listener_dispatcher.shutdown()
+            self._listener_dispatcher = None
+
+
+class _EmulatorCredential(google_credentials.Credentials):
+    """A credential that never expires, used to make requests to database emulators."""
+
+    def __init__(self):
+        google_credentials.Credentials.__init__(self)
+        self.token = 'owner'
+
+    def refresh(self, request):
+        pass
+
+
+class Client(_http_client.JsonHttpClient):
+    """HTTP client used to make REST calls.
+
+    Client maintains an HTTP session, and handles authenticating HTTP requests along with
+    marshalling and unmarshalling of JSON data.
+    """
+
+    def __init__(self, credential, base_url, auth_override, timeout):
+        """Creates a new Client from the given parameters.
+
+        This exists primarily to enable testing. For regular use, obtain Client instances by
+        calling the from_app() class method.
+
+        Args:
+          credential: A Google credential that can be used to authenticate requests.
+          base_url: A URL prefix to be added to all outgoing requests. This is typically the
+              Firebase Realtime Database URL.
+          auth_override: The encoded auth_variable_override query parameter to be included in
+              outgoing requests.
+          timeout: HTTP request timeout in seconds. If not set connections will never
+              timeout, which is the default behavior of the underlying requests library.
+        """
+        _http_client.JsonHttpClient.__init__(
+            self, credential=credential, base_url=base_url, headers={'User-Agent': USER_AGENT})
+        self.credential = credential
+        self.auth_override = auth_override
+        self.timeout = timeout
+        self.listener_manager = None
+        self.listener_dispatcher = None
+        self.read_cache = None
+        self.server_timeout = None
+        self.write_size_limit = None
+
+    def request(self, method, url, **kwargs):
+        """Makes an HTTP call using the Python requests library.
+
+        Extends the request() method of the parent JsonHttpClient class. Handles auth overrides,
+        server-side limits and low-level exceptions.
+
+        Args:
+          method: HTTP method name as a string (e.g. get, post).
+          url: URL path of the remote endpoint. This will be appended to the server's base URL.
+          kwargs: An additional set of keyword arguments to be passed into requests API
+              (e.g. json, params). The ``server_timeout`` and ``write_size_limit`` arguments
+              override the defaults of the client for this request.
+
+        Returns:
+          Response: An HTTP response object.
+
+        Raises:
+          ApiCallError: If an error occurs while making the HTTP call.
+        """
+        server_timeout = kwargs.pop('server_timeout', None)
+        if server_timeout is None:
+            server_timeout = self.server_timeout
+        write_size_limit = kwargs.pop('write_size_limit', None)
+        if write_size_limit is None:
+            write_size_limit = self.write_size_limit
+        params = add_server_params(
+            method, kwargs.get('params'), server_timeout, write_size_limit)
+        if params:
+            kwargs['params'] = params
+        if self.auth_override:
+            params = kwargs.get('params')
+            if params:
+                params += '&{0}'.format(self.auth_override)
+            else:
+                params = self.auth_override
+            kwargs['params'] = params
+        if self.timeout:
+            kwargs['timeout'] = self.timeout
+        try:
+            return super(Client, self).request(method, url, **kwargs)
+        except requests.exceptions.RequestException as error:
+            raise _db_utils.ApiCallError(_db_utils.extract_error_message(error), error)
+        finally:
+            if self.read_cache is not None and method != 'get':
+                self.read_cache.invalidate(self.base_url, url)
+
+    def patch_entries(self, url, entries):
+        """Sends a multi-location update made up of serialized "path":value pairs.
+
+        The update is retried a few times if it fails due to a network error or a transient
+        server error.
+        """
+        body = '{{{0}}}'.format(','.join(entries))
+        retries = 0
+        while True:
+            try:
+                self.request('patch', url, data=body, params='print=silent',
+                             headers={'Content-Type': 'application/json'})
+                return
+            except _db_utils.ApiCallError as error:
+                if retries >= _BULK_LOAD_MAX_RETRIES or not _is_retryable(error):
+                    raise
+            time.sleep(_BULK_LOAD_RETRY_DELAY_SECONDS * (2 ** retries))
+            retries += 1
@@ -0,0 +1,650 @@
+# Copyright 2017 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+"""Realtime listener support for the Firebase Realtime Database module.
+
+This covers the events delivered to listener callbacks, the pools of worker threads that execute
+the callbacks, and the multiplexing of event streams onto a shared I/O thread.
+"""
+
+import collections
+import heapq
+import itertools
+import json
+import re
+import socket
+import threading
+import time
+import traceback
+
+import requests
+import six
+
+try:
+    import selectors # pylint: disable=import-error
+except ImportError:
+    # Python 2.7 does not have the selectors module. Listeners can not be multiplexed there.
+    selectors = None
+
+from firebase_admin import _db_utils
+from firebase_admin import _sseclient
+
+
+_LISTENER_CONNECT_THREADS = 4
+_JSON_DECODER = json.JSONDecoder()
+_EVENT_PATH_PREFIX = re.compile(r'\s*\{\s*"path"\s*:\s*')
+_EVENT_DATA_PREFIX = re.compile(r'\s*,\s*"data"\s*:\s*')
+_EVENT_SUFFIX = re.compile(r'\s*\}\s*$')
+
+
+class Event(object):
+    """Represents a realtime update event received from the database.
+
+    Only the ``path`` of the event is decoded when the event is received. The ``data`` payload,
+    which may be large, is decoded the first time it is accessed. Callbacks that forward events
+    elsewhere without inspecting them can use ``raw_data`` to avoid decoding the payload at all.
+    """
+
+    def __init__(self, sse_event):
+        self._sse_event = sse_event
+        self._parsed = None
+        self._data_start = None
+        payload = sse_event.data
+        # The server always sends events of the form {"path": <path>, "data": <data>}. Decode the
+        # path, and note where the data starts. Fall back to decoding the whole payload if the
+        # event is formatted in any other way.
+        match = _EVENT_PATH_PREFIX.match(payload)
+        if match:
+            try:
+                path, end = _JSON_DECODER.raw_decode(payload, match.end())
+            except ValueError:
+                path, end = None, None
+            data_match = _EVENT_DATA_PREFIX.match(payload, end) if end else None
+            if data_match and isinstance(path, six.string_types):
+                self._path = path
+                self._data_start = data_match.end()
+                return
+        self._parsed = json.loads(payload)
+        self._path = self._parsed['path']
+
+    @property
+    def data(self):
+        """Parsed JSON data of this event."""
+        if self._parsed is None:
+            payload = self._sse_event.data
+            data, end = _JSON_DECODER.raw_decode(payload, self._data_start)
+            if _EVENT_SUFFIX.match(payload, end):
+                self._parsed = {'path': self._path, 'data': data}
+            else:
+                self._parsed = json.loads(payload)
+                self._data_start = None
+        return self._parsed['data']
+
+    @property
+    def raw_data(self):
+        """UTF-8 encoded JSON data of this event, as received from the server (bytes)."""
+        if self._data_start is None:
+            return json.dumps(self._parsed['data']).encode('utf-8')
+        # Data is the last member of the events sent by the server.
+        payload = self._sse_event.data
+        end = payload.rindex('}')
+        return payload[self._data_start:end].rstrip().encode('utf-8')
+
+    @property
+    def path(self):
+        """Path of the database reference that triggered this event."""
+        return self._path
+
+    @property
+    def event_type(self):
+        """Event type string (put, patch)."""
+        return self._sse_event.event_type
+
+
+class ResyncFilter(object):
+    """Wraps a listener callback, and reduces repeated snapshots to the changes they contain.
+
+    The server sends a ``put`` event with the full snapshot of the watched location whenever the
+    listener (re)connects. The filter keeps a digest of the last known value of each child of the
+    location, computed from the first snapshot and kept up to date by the subsequent events. Each
+    later snapshot is compared with these digests, and delivered as a single ``patch`` event that
+    sets the children that have changed, and removes the children that no longer exist. If
+    nothing has changed, no event is delivered.
+
+    Children modified by an event that does not carry their full value (e.g. a ``put`` to a
+    nested path) are marked as unknown, and always reported by the next snapshot.
+    """
+
+    def __init__(self, callback):
+        self._callback = callback
+        self._synced = False
+        # Digests of the children if the value is a dict (None for unknown children), or None.
+        self._children = None
+        # Digest of the value if it is not a dict, or None if unknown.
+        self._digest = None
+
+    def __call__(self, event):
+        if event.event_type not in ('put', 'patch') or not self._synced:
+            if event.event_type == 'put' and event.path == '/':
+                self._set_snapshot(event.data)
+            self._callback(event)
+        elif event.event_type == 'put' and event.path == '/':
+            self._on_snapshot(event)
+        else:
+            self._on_update(event)
+            self._callback(event)
+
+    def _set_snapshot(self, data):
+        self._synced = True
+        if isinstance(data, dict):
+            self._children = {key: _db_utils.json_digest(value) for key, value in data.items()}
+            self._digest = None
+        else:
+            self._children = None
+            self._digest = _db_utils.json_digest(data)
+
+    def _on_snapshot(self, event):
+        data = event.data
+        children = self._children
+        if not isinstance(data, dict) or children is None:
+            digest = self._digest
+            self._set_snapshot(data)
+            if digest is None or digest != self._digest:
+                self._callback(event)
+            return
+
+        self._set_snapshot(data)
+        changes = {key: data[key] for key, digest in self._children.items()
+                   if children.get(key) != digest}
+        for key in children:
+            if key not in data:
+                changes[key] = None
+        if changes:
+            payload = json.dumps({'path': '/', 'data': changes}, separators=(',', ':'))
+            self._callback(Event(_sseclient.Event(data=payload, event_type='patch')))
+
+    def _on_update(self, event):
+        if self._children is None:
+            # The value may have become a dict, which is no longer described by the digest.
+            self._digest = None
+            return
+        segments = _db_utils.parse_path(event.path)
+        if event.event_type == 'put':
+            self._update_child(segments, event.data)
+        else:
+            for key, value in event.data.items():
+                self._update_child(segments + _db_utils.parse_path(key), value)
+
+    def _update_child(self, segments, value):
+        key = segments[0]
+        if len(segments) > 1:
+            self._children[key] = None
+        elif value is None:
+            self._children.pop(key, None)
+        else:
+            self._children[key] = _db_utils.json_digest(value)
+
+
+class ListenerRegistration(object):
+    """Represents the addition of an event listener to a database reference."""
+
+    def __init__(self, callback, sse, dispatcher=None):
+        """Initializes a new listener with given parameters.
+
+        This is an internal API. Use the ``db.Reference.listen()`` method to start a
+        new listener.
+
+        Args:
+          callback: The callback function to fire in case of event.
+          sse: A transport session to make requests with.
+          dispatcher: A DispatchExecutor to run the callback on (optional). If not specified, the
+              callback is executed on the thread that reads the event stream.
+        """
+        self._callback = callback
+        self._sse = sse
+        self._dispatcher = dispatcher
+        self.closed = False
+        self._thread = threading.Thread(target=self._start_listen)
+        self._thread.start()
+
+    def _start_listen(self):
+        # iterate the sse client's generator
+        for sse_event in self._sse:
+            # only inject data events
+            if sse_event:
+                if self._dispatcher is None:
+                    self._callback(Event(sse_event))
+                else:
+                    self._dispatcher.submit_event(self, self.dispatch, sse_event)
+
+    def dispatch(self, sse_event):
+        if self.closed:
+            return
+        try:
+            self._callback(Event(sse_event))
+        except Exception:
+            # Same outcome as an exception on the listener thread: the listener stops. The thread
+            # is not joined here, since it may be waiting for room in this worker's queue.
+            self.closed = True
+            self._sse.close()
+            raise
+
+    def close(self):
+        """Stops the event listener represented by this registration
+
+        This closes the SSE HTTP connection, and joins the background thread.
+        """
+        self.closed = True
+        self._sse.close()
+        self._thread.join()
+
+
+class _ManagedListenerRegistration(ListenerRegistration):
+    """A ListenerRegistration whose event stream is served by a shared ListenerManager."""
+
+    def __init__(self, callback, stream, manager):
+        # pylint: disable=super-init-not-called
+        self._callback = callback
+        self._sse = stream
+        self._manager = manager
+        self.stream = stream
+        self.closed = False
+        self.registered = False
+        # The thread that reads the stream, if it is not multiplexed onto the I/O thread.
+        self.thread = None
+
+    def dispatch(self, sse_event):
+        if self.closed:
+            return
+        try:
+            self._callback(Event(sse_event))
+        except Exception:
+            # Same outcome as an exception on a dedicated listener thread: the listener stops.
+            self.close()
+            raise
+
+    def close(self):
+        """Stops the event listener represented by this registration
+
+        This closes the SSE HTTP connection. The callback is not invoked again after this method
+        returns, unless it is already running.
+        """
+        if not self.closed:
+            self.closed = True
+            self._manager.remove(self)
+
+
+class ListenerStats(object):
+    """Statistics about the realtime listener callbacks dispatched to a pool of worker threads.
+
+    Each worker thread has its own bounded queue of pending events. The counters are cumulative
+    since the database service of the app was initialized.
+
+    Attributes:
+      queue_depth: Number of events currently waiting in the queues of all worker threads.
+      max_queue_depth: Highest number of events that have waited in the queue of a single worker
+          thread at any one time.
+      queue_capacity: Maximum number of events the queue of each worker thread can hold.
+      dispatched: Number of events delivered to callbacks.
+      dropped: Number of events discarded by the ``drop_oldest`` overflow policy.
+      coalesced: Number of events discarded by the ``coalesce`` overflow policy.
+    """
+
+    def __init__(self):
+        self.queue_depth = 0
+        self.max_queue_depth = 0
+        self.queue_capacity = 0
+        self.dispatched = 0
+        self.dropped = 0
+        self.coalesced = 0
+
+
+class DispatchExecutor(object):
+    """A fixed-size pool of daemon threads that executes tasks submitted with a routing key.
+
+    All tasks submitted with the same key are executed by the same thread, in submission order.
+    When max_queue_size is set, the task queue of each thread is bounded, and the overflow policy
+    determines what happens when a task is submitted to a full queue:
+
+    - ``block``: The submitter waits until the queue has room for the task.
+    - ``drop_oldest``: The oldest task in the queue is discarded.
+    - ``coalesce``: Tasks for events superseded by the new event are discarded. A ``put`` event
+      supersedes the queued events of the same listener that target the same path. If there are
+      no such events, the submitter waits as with ``block``.
+    """
+
+    def __init__(self, num_threads, name, max_queue_size=0, overflow='block'):
+        self._queues = [_DispatchQueue(max_queue_size) for _ in range(num_threads)]
+        self._max_queue_size = max_queue_size
+        self._overflow = overflow
+        self._threads = []
+        for index, task_queue in enumerate(self._queues):
+            thread = threading.Thread(
+                target=self._run, args=(task_queue,), name='{0}-{1}'.format(name, index))
+            thread.daemon = True
+            thread.start()
+            self._threads.append(thread)
+
+    def submit(self, key, func, *args):
+        self._put(key, (key, None, func, args), False)
+
+    def submit_event(self, key, func, sse_event):
+        """Submits a task that processes the given SSE event, applying the coalesce policy."""
+        path = None
+        if self._overflow == 'coalesce':
+            try:
+                path = Event(sse_event).path
+            except (ValueError, KeyError, TypeError):
+                pass
+        supersedes = path is not None and sse_event.event_type == 'put'
+        self._put(key, (key, path, func, (sse_event,)), supersedes)
+
+    def stats(self):
+        """Returns a ListenerStats instance describing the current state of the task queues."""
+        stats = ListenerStats()
+        stats.queue_capacity = self._max_queue_size
+        for task_queue in self._queues:
+            with task_queue.lock:
+                stats.queue_depth += len(task_queue.tasks)
+                stats.max_queue_depth = max(stats.max_queue_depth, task_queue.max_depth)
+                stats.dispatched += task_queue.dispatched
+                stats.dropped += task_queue.dropped
+                stats.coalesced += task_queue.coalesced
+        return stats
+
+    def shutdown(self):
+        for task_queue in self._queues:
+            with task_queue.lock:
+                task_queue.tasks.append(None)
+                task_queue.not_empty.notify()
+
+    def _put(self, key, task, supersedes):
+        task_queue = self._queues[hash(key) % len(self._queues)]
+        with task_queue.lock:
+            if task_queue.is_full() and self._overflow == 'drop_oldest':
+                task_queue.tasks.popleft()
+                task_queue.dropped += 1
+            elif task_queue.is_full() and supersedes:
+                task_queue.coalesce(key, task[1])
+            while task_queue.is_full():
+                task_queue.not_full.wait()
+            task_queue.tasks.append(task)
+            task_queue.max_depth = max(task_queue.max_depth, len(task_queue.tasks))
+            task_queue.not_empty.notify()
+
+    @classmethod
+    def _run(cls, task_queue):
+        while True:
+            with task_queue.lock:
+                while not task_queue.tasks:
+                    task_queue.not_empty.wait()
+                task = task_queue.tasks.popleft()
+                task_queue.not_full.notify()
+            if task is None:
+                return
+            _, _, func, args = task
+            try:
+                func(*args)
+            except Exception: # pylint: disable=broad-except
+                traceback.print_exc()
+            with task_queue.lock:
+                task_queue.dispatched += 1
+
+
+class _DispatchQueue(object):
+    """The task queue of a single DispatchExecutor thread, along with its statistics."""
+
+    def __init__(self, max_size):
+        self.tasks = collections.deque()
+        self.max_size = max_size
+        self.lock = threading.Lock()
+        self.not_empty = threading.Condition(self.lock)
+        self.not_full = threading.Condition(self.lock)
+        self.max_depth = 0
+        self.dispatched = 0
+        self.dropped = 0
+        self.coalesced = 0
+
+    def is_full(self):
+        return self.max_size > 0 and len(self.tasks) >= self.max_size
+
+    def coalesce(self, key, path):
+        """Discards the queued tasks submitted with the given key and event path."""
+        remaining = collections.deque(
+            task for task in self.tasks if task is None or task[0] is not key or task[1] != path)
+        self.coalesced += len(self.tasks) - len(remaining)
+        self.tasks = remaining
+
+
+class ListenerManager(object):
+    """Multiplexes all the realtime listeners of a database service onto a shared I/O thread.
+
+    Event streams are opened through a single authorized session, and read by one thread that
+    waits on all their sockets with a selector. Reconnects are performed by a small fixed pool of
+    threads, and callbacks are executed by a fixed pool of dispatch threads. Hence the number of
+    threads remains constant regardless of the number of active listeners. The I/O thread only
+    runs while there are active listeners.
+
+    Streams whose sockets cannot be read directly (see ``SSEStream``) are instead read by a
+    dedicated thread each, as in ``ListenerRegistration``. Their callbacks are still executed by
+    the dispatch threads.
+    """
+
+    def __init__(self, credential, dispatcher):
+        self._session = _sseclient.KeepAuthSession(credential)
+        self._selector = selectors.DefaultSelector()
+        self._wakeup_recv, self._wakeup_send = socket.socketpair()
+        self._wakeup_recv.setblocking(False)
+        self._selector.register(self._wakeup_recv, selectors.EVENT_READ)
+        self._dispatcher = dispatcher
+        self._connector = DispatchExecutor(_LISTENER_CONNECT_THREADS, 'ListenerConnect')
+        self._lock = threading.Lock()
+        self._listeners = set()
+        self._additions = []
+        self._removals = []
+        self._reconnects = []
+        self._sequence = itertools.count()
+        self._io_thread = None
+        self._closed = False
+
+    @property
+    def listener_count(self):
+        with self._lock:
+            return len(self._listeners)
+
+    def listen(self, url, callback):
+        """Opens a new event stream on the given URL, and starts delivering events to callback.
+
+        Raises:
+          ApiCallError: If an error occurs while starting the initial HTTP connection.
+        """
+        stream = _sseclient.SSEStream(url, self._session)
+        client = None
+        try:
+            try:
+                stream.connect()
+            except _sseclient.UnsupportedStreamError:
+                client = _sseclient.SSEClient(url, self._session)
+        except requests.exceptions.RequestException as error:
+            raise _db_utils.ApiCallError(_db_utils.extract_error_message(error), error)
+        registration = _ManagedListenerRegistration(callback, stream, self)
+        with self._lock:
+            if self._closed:
+                (client or stream).close()
+                raise ValueError('Cannot add listeners to a closed database service.')
+            self._listeners.add(registration)
+            if client is not None:
+                self._start_thread(registration, client)
+                return registration
+            self._additions.append(registration)
+            if self._io_thread is None:
+                self._io_thread = threading.Thread(target=self._run, name='ListenerIO')
+                self._io_thread.start()
+        self._wakeup()
+        return registration
+
+    def remove(self, registration):
+        with self._lock:
+            self._listeners.discard(registration)
+            if registration.thread is None:
+                self._removals.append(registration)
+        if registration.thread is None:
+            self._wakeup()
+        else:
+            registration.stream.close()
+
+    def close(self):
+        threads = []
+        with self._lock:
+            self._closed = True
+            for registration in self._listeners:
+                registration.closed = True
+                if registration.thread is None:
+                    self._removals.append(registration)
+                else:
+                    registration.stream.close()
+                    threads.append(registration.thread)
+            self._listeners.clear()
+            io_thread = self._io_thread
+        self._wakeup()
+        for thread in threads + [io_thread]:
+            if thread is not None and thread is not threading.current_thread():
+                thread.join()
+        self._connector.shutdown()
+        self._selector.close()
+        self._wakeup_recv.close()
+        self._wakeup_send.close()
+        self._session.close()
+
+    def _wakeup(self):
+        try:
+            self._wakeup_send.send(b'\0')
+        except socket.error:
+            # The wakeup buffer is full, which means the I/O thread is already due to wake up.
+            pass
+
+    def _run(self):
+        while True:
+            with self._lock:
+                additions, self._additions = self._additions, []
+                removals, self._removals = self._removals, []
+            for registration in removals:
+                self._detach(registration)
+            for registration in additions:
+                if registration.closed:
+                    registration.stream.close()
+                else:
+                    self._selector.register(registration.stream, selectors.EVENT_READ, registration)
+                    registration.registered = True
+                    self._read(registration)
+
+            with self._lock:
+                if not (self._listeners or self._additions or self._removals):
+                    self._reconnects = []
+                    self._io_thread = None
+                    return
+                timeout = None
+                if self._reconnects:
+                    timeout = max(0, self._reconnects[0][0] - time.time())
+
+            for key, _ in self._selector.select(timeout):
+                if key.data is None:
+                    self._drain_wakeup()
+                else:
+                    self._read(key.data)
+            self._start_due_reconnects()
+
+    def _read(self, registration):
+        stream = registration.stream
+        try:
+            events = stream.read_events()
+        except (socket.error, ValueError):
+            events = []
+            stream.needs_reconnect = True
+        for sse_event in events:
+            self._dispatcher.submit_event(registration, registration.dispatch, sse_event)
+        if stream.needs_reconnect:
+            self._detach(registration)
+            if not registration.closed:
+                self._schedule_reconnect(registration, stream.retry / 1000.0)
+
+    def _detach(self, registration):
+        if registration.registered:
+            self._selector.unregister(registration.stream)
+            registration.registered = False
+        registration.stream.close()
+
+    def _drain_wakeup(self):
+        try:
+            while self._wakeup_recv.recv(1024):
+                pass
+        except socket.error:
+            pass
+
+    def _schedule_reconnect(self, registration, delay):
+        with self._lock:
+            heapq.heappush(
+                self._reconnects, (time.time() + delay, next(self._sequence), registration))
+        self._wakeup()
+
+    def _start_due_reconnects(self):
+        now = time.time()
+        due = []
+        with self._lock:
+            while self._reconnects and self._reconnects[0][0] <= now:
+                due.append(heapq.heappop(self._reconnects)[2])
+        for registration in due:
+            if not registration.closed:
+                self._connector.submit(registration, self._reconnect, registration)
+
+    def _reconnect(self, registration):
+        stream = registration.stream
+        if registration.closed:
+            return
+        client = None
+        try:
+            try:
+                stream.connect()
+            except _sseclient.UnsupportedStreamError:
+                client = _sseclient.SSEClient(stream.url, self._session)
+        except requests.exceptions.RequestException:
+            self._schedule_reconnect(registration, stream.retry / 1000.0)
+            return
+        with self._lock:
+            if self._closed or registration.closed:
+                (client or stream).close()
+                return
+            if client is not None:
+                self._start_thread(registration, client)
+                return
+            self._additions.append(registration)
+        self._wakeup()
+
+    def _start_thread(self, registration, client):
+        """Starts reading the events of a listener from the given SSEClient on a new thread.
+
+        Must be called with the lock held.
+        """
+        registration.stream = client
+        registration.thread = threading.Thread(
+            target=self._read_client, args=(registration,), name='ListenerStream')
+        registration.thread.start()
+
+    def _read_client(self, registration):
+        for sse_event in registration.stream:
+            if registration.closed:
+                return
+            if sse_event:
+                self._dispatcher.submit_event(registration, registration.dispatch, sse_event)
@@ -0,0 +1,204 @@
+# Copyright 2017 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+"""In-memory mirrors of Firebase Realtime Database locations."""
+
+import threading
+import time
+
+from firebase_admin import _db_query
+from firebase_admin import _db_utils
+
+
+class Mirror(object):
+    """A read-only view of a database location, backed by an in-memory copy of the data.
+
+    Use ``db.Reference.mirror()`` to obtain an instance of Mirror. Mirrors of child locations,
+    obtained via ``child()``, share the same underlying listener and in-memory data.
+    """
+
+    def __init__(self, store, segments):
+        self._store = store
+        self._segments = segments
+
+    @property
+    def key(self):
+        if self._segments:
+            return self._segments[-1]
+        return self._store.ref.key
+
+    @property
+    def path(self):
+        root = self._store.ref.path
+        if not self._segments:
+            return root
+        return root.rstrip('/') + '/' + '/'.join(self._segments)
+
+    @property
+    def synced(self):
+        """Whether the initial snapshot of the data has been received from the server."""
+        return self._store.synced.is_set()
+
+    @property
+    def last_sync_time(self):
+        """Time (in seconds since the epoch) of the last full snapshot received, or None.
+
+        The server sends a full snapshot when the listener is started, and every time the listener
+        reconnects after a network error or a credential refresh.
+        """
+        return self._store.last_sync_time
+
+    @property
+    def last_update_time(self):
+        """Time (in seconds since the epoch) of the last update received from the server, or None.
+        """
+        return self._store.last_update_time
+
+    def memory_usage(self):
+        """Returns the approximate number of bytes used by the in-memory copy of this location.
+
+        This traverses the in-memory data, and hence is linear in the size of the data.
+        """
+        return self._store.memory_usage(self._segments)
+
+    def wait_for_sync(self, timeout=None):
+        """Waits until the initial snapshot of the data has been received from the server.
+
+        Args:
+          timeout: Maximum number of seconds to wait (optional). Waits indefinitely by default.
+
+        Returns:
+          bool: True if the mirror is in sync, False if the wait timed out.
+        """
+        return self._store.synced.wait(timeout)
+
+    def child(self, path):
+        """Returns a Mirror of the specified child node.
+
+        Args:
+          path: Path to the child node.
+
+        Returns:
+          Mirror: A Mirror representing the specified child node.
+
+        Raises:
+          ValueError: If the child path is not a string, not well-formed or begins with '/'.
+        """
+        _db_utils.validate_child_path(path)
+        return Mirror(self._store, self._segments + _db_utils.parse_path(path))
+
+    def get(self):
+        """Returns the value at this location from memory.
+
+        Blocks until the initial snapshot of the data has been received from the server.
+
+        Returns:
+          object: The decoded JSON value of this location. The caller owns the returned value, and
+          may modify it without affecting the mirror.
+        """
+        self._store.synced.wait()
+        return self._store.get(self._segments)
+
+    def order_by_child(self, path):
+        """Returns a Query that orders the in-memory data by child values.
+
+        Args:
+          path: Path to a valid child of the current location.
+
+        Returns:
+          Query: A Query instance that is executed against the in-memory data.
+
+        Raises:
+          ValueError: If the child path is not a string, not well-formed or None.
+        """
+        if path in _db_utils.RESERVED_FILTERS:
+            raise ValueError('Illegal child path: {0}'.format(path))
+        return _MirrorQuery(self, path)
+
+    def order_by_key(self):
+        """Returns a Query that orders the in-memory data by key."""
+        return _MirrorQuery(self, '$key')
+
+    def order_by_value(self):
+        """Returns a Query that orders the in-memory data by value."""
+        return _MirrorQuery(self, '$value')
+
+    def close(self):
+        """Stops the listener that keeps this mirror (and all its child mirrors) up to date."""
+        self._store.close()
+
+
+class _MirrorQuery(_db_query.Query):
+    """A Query that is evaluated locally against the data of a Mirror.
+
+    Filters and limits are applied following the same ordering rules used by the server.
+    """
+
+    def __init__(self, mirror, order_by):
+        _db_query.Query.__init__(self, order_by=order_by, client=None, pathurl=mirror.path)
+        self._mirror = mirror
+
+    def get(self, server_timeout=None):
+        # Served from memory, so there is no server to time out.
+        del server_timeout
+        return _db_utils.evaluate_query(self._mirror.get(), self._order_by, self._params)
+
+    def stream(self, server_timeout=None):
+        del server_timeout
+        result = self.get()
+        if not isinstance(result, dict):
+            return iter([])
+        return iter(list(result.items()))
+
+
+class MirrorStore(object):
+    """The in-memory data and the listener shared by a Mirror and all its child Mirrors."""
+
+    def __init__(self, ref):
+        self.ref = ref
+        self.synced = threading.Event()
+        self.last_sync_time = None
+        self.last_update_time = None
+        self._root = None
+        self._lock = threading.Lock()
+        self._registration = ref.listen(self._on_event)
+
+    def get(self, segments):
+        with self._lock:
+            return _db_utils.denormalize_json(_db_utils.get_json_child(self._root, segments))
+
+    def memory_usage(self, segments):
+        with self._lock:
+            return _db_utils.json_size(_db_utils.get_json_child(self._root, segments))
+
+    def close(self):
+        self._registration.close()
+
+    def _on_event(self, event):
+        segments = _db_utils.parse_path(event.path)
+        with self._lock:
+            if event.event_type == 'put':
+                self._root = _db_utils.set_json_child(self._root, segments, event.data)
+                if not segments:
+                    self.last_sync_time = time.time()
+            elif event.event_type == 'patch':
+                for key, value in event.data.items():
+                    self._root = _db_utils.set_json_child(
+                        self._root, segments + _db_utils.parse_path(key), value)
+            else:
+                return
+            self.last_update_time = time.time()
+        if not segments and event.event_type == 'put':
+            self.synced.set()
@@ -0,0 +1,236 @@
+# Copyright 2017 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+"""Query support for the Firebase Realtime Database module."""
+
+import json
+
+import requests
+import six
+
+from firebase_admin import _db_client
+from firebase_admin import _db_utils
+
+
+_STREAM_CHUNK_SIZE = 64 * 1024
+
+
+class Query(object):
+    """Represents a complex query that can be executed on a Reference.
+
+    Complex queries can consist of up to 2 components: a required ordering constraint, and an
+    optional filtering constraint. At the server, data is first sorted according to the given
+    ordering constraint (e.g. order by child). Then the filtering constraint (e.g. limit, range)
+    is applied on the sorted data to produce the final result. Despite the ordering constraint,
+    the final result is returned by the server as an unordered collection. Therefore the Query
+    interface performs another round of sorting at the client-side before returning the results
+    to the caller. This client-side sorted results are returned to the user as a Python
+    OrderedDict.
+    """
+
+    def __init__(self, **kwargs):
+        order_by = kwargs.pop('order_by')
+        if not order_by or not isinstance(order_by, six.string_types):
+            raise ValueError('order_by field must be a non-empty string')
+        if order_by not in _db_utils.RESERVED_FILTERS:
+            if order_by.startswith('/'):
+                raise ValueError('Invalid path argument: "{0}". Child path must not start '
+                                 'with "/"'.format(order_by))
+            segments = _db_utils.parse_path(order_by)
+            order_by = '/'.join(segments)
+        self._client = kwargs.pop('client')
+        self._pathurl = kwargs.pop('pathurl')
+        self._order_by = order_by
+        self._params = {'orderBy' : json.dumps(order_by)}
+        if kwargs:
+            raise ValueError('Unexpected keyword arguments: {0}'.format(kwargs))
+
+    def limit_to_first(self, limit):
+        """Creates a query with limit, and anchors it to the start of the window.
+
+        Args:
+          limit: The maximum number of child nodes to return.
+
+        Returns:
+          Query: The updated Query instance.
+
+        Raises:
+          ValueError: If the value is not an integer, or set_limit_last() was called previously.
+        """
+        if not isinstance(limit, int) or limit < 0:
+            raise ValueError('Limit must be a non-negative integer.')
+        if 'limitToLast' in self._params:
+            raise ValueError('Cannot set both first and last limits.')
+        self._params['limitToFirst'] = limit
+        return self
+
+    def limit_to_last(self, limit):
+        """Creates a query with limit, and anchors it to the end of the window.
+
+        Args:
+          limit: The maximum number of child nodes to return.
+
+        Returns:
+          Query: The updated Query instance.
+
+        Raises:
+          ValueError: If the value is not an integer, or set_limit_first() was called previously.
+        """
+        if not isinstance(limit, int) or limit < 0:
+            raise ValueError('Limit must be a non-negative integer.')
+        if 'limitToFirst' in self._params:
+            raise ValueError('Cannot set both first and last limits.')
+        self._params['limitToLast'] = limit
+        return self
+
+    def start_at(self, start):
+        """Sets the lower bound for a range query.
+
+        The Query will only return child nodes with a value greater than or equal to the specified
+        value.
+
+        Args:
+          start: JSON-serializable value to start at, inclusive.
+
+        Returns:
+          Query: The updated Query instance.
+
+        Raises:
+          ValueError: If the value is ``None``.
+        """
+        if start is None:
+            raise ValueError('Start value must not be None.')
+        self._params['startAt'] = json.dumps(start)
+        return self
+
+    def end_at(self, end):
+        """Sets the upper bound for a range query.
+
+        The Query will only return child nodes with a value less than or equal to the specified
+        value.
+
+        Args:
+          end: JSON-serializable value to end at, inclusive.
+
+        Returns:
+          Query: The updated Query instance.
+
+        Raises:
+          ValueError: If the value is ``None``.
+        """
+        if end is None:
+            raise ValueError('End value must not be None.')
+        self._params['endAt'] = json.dumps(end)
+        return self
+
+    def equal_to(self, value):
+        """Sets an equals constraint on the Query.
+
+        The Query will only return child nodes whose value is equal to the specified value.
+
+        Args:
+          value: JSON-serializable value to query for.
+
+        Returns:
+          Query: The updated Query instance.
+
+        Raises:
+          ValueError: If the value is ``None``.
+        """
+        if value is None:
+            raise ValueError('Equal to value must not be None.')
+        self._params['equalTo'] = json.dumps(value)
+        return self
+
+    def stream(self, server_timeout=None):
+        """Executes this Query and streams the results in query order.
+
+        The response is parsed incrementally, instead of being read into memory in full before it
+        is decoded, and the decoded results are yielded and released one at a time. This limits
+        the peak memory usage to roughly the size of the decoded results, which helps with
+        queries that return very large results.
+
+        Args:
+          server_timeout: Maximum number of seconds the server may spend on the query, up to 900
+              (optional). Defaults to the ``databaseServerTimeout`` option of the app.
+
+        Returns:
+          generator: A generator that yields a ``(key, value)`` tuple for each result.
+
+        Raises:
+          ValueError: If the server timeout is invalid.
+          ApiCallError: If an error occurs while communicating with the remote database server,
+              or while iterating over the results.
+        """
+        _db_client.validate_server_timeout(server_timeout)
+        children = stream_children(self._client, self._pathurl, self._querystr, server_timeout)
+        if self._order_by == '$priority':
+            return children
+        return _db_utils.sort_children(children, self._order_by)
+
+    @property
+    def _querystr(self):
+        params = []
+        for key in sorted(self._params):
+            params.append('{0}={1}'.format(key, self._params[key]))
+        return '&'.join(params)
+
+    def get(self, server_timeout=None):
+        """Executes this Query and returns the results.
+
+        The results will be returned as a sorted list or an OrderedDict.
+
+        Args:
+          server_timeout: Maximum number of seconds the server may spend on the query, up to 900
+              (optional). Queries that take longer fail with an error. Defaults to the
+              ``databaseServerTimeout`` option of the app.
+
+        Returns:
+          object: Decoded JSON result of the Query.
+
+        Raises:
+          ValueError: If the server timeout is invalid.
+          ApiCallError: If an error occurs while communicating with the remote database server.
+        """
+        _db_client.validate_server_timeout(server_timeout)
+        result = self._client.body(
+            'get', self._pathurl, params=self._querystr, server_timeout=server_timeout)
+        if isinstance(result, (dict, list)) and self._order_by != '$priority':
+            return _db_utils.Sorter(result, self._order_by).get()
+        return result
+
+
+def stream_children(client, url, params, server_timeout):
+    """Reads the children of a database location with a streaming request."""
+    resp = None
+    try:
+        resp = client.request(
+            'get', url, params=params, server_timeout=server_timeout, stream=True)
+        chunks = resp.iter_content(chunk_size=_STREAM_CHUNK_SIZE)
+        children = _db_utils.iter_json_children(chunks)
+        while True:
+            try:
+                item = next(children)
+            except StopIteration:
+                return
+            except ValueError as error:
+                raise _db_utils.ApiCallError(
+                    'Failed to parse the response from the database: {0}'.format(error), error)
+            yield item
+    except requests.exceptions.RequestException as error:
+        raise _db_utils.ApiCallError(_db_utils.extract_error_message(error), error)
+    finally:
+        if resp is not None:
+            resp.close()
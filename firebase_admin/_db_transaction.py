@@ -0,0 +1,84 @@
+# Copyright 2017 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+"""Transaction support shared by the Firebase Realtime Database modules."""
+
+import random
+import time
+
+import six
+
+from firebase_admin import _db_utils
+
+
+MAX_RETRIES = 25
+INITIAL_BACKOFF_SECONDS = 0.01
+MAX_BACKOFF_SECONDS = 1.0
+
+
+class TransactionError(Exception):
+    """Represents an Exception encountered while performing a transaction."""
+
+    def __init__(self, message):
+        Exception.__init__(self, message)
+
+
+class TransactionStats(object):
+    """Statistics about a single call to ``Reference.transaction()``.
+
+    Attributes:
+      attempts: Number of times the new value was sent to the server.
+      conflicts: Number of attempts rejected due to concurrent modifications by other clients.
+      backoff_time: Total time spent waiting between attempts, in seconds.
+      elapsed_time: Total time spent on the transaction, in seconds.
+    """
+
+    def __init__(self):
+        self.attempts = 0
+        self.conflicts = 0
+        self.backoff_time = 0.0
+        self.elapsed_time = 0.0
+
+
+def validate_args(transaction_update, max_retries, initial_backoff, max_backoff, timeout, stats):
+    """Validates the arguments of a transaction, and returns the TransactionStats to populate."""
+    if not callable(transaction_update):
+        raise ValueError('transaction_update must be a function.')
+    if not isinstance(max_retries, six.integer_types) or isinstance(max_retries, bool) or \
+            max_retries < 1:
+        raise ValueError('max_retries must be a positive integer.')
+    for name, arg in (('initial_backoff', initial_backoff), ('max_backoff', max_backoff)):
+        if not _db_utils.is_number(arg) or arg < 0:
+            raise ValueError('{0} must be a non-negative number.'.format(name))
+    if timeout is not None and (not _db_utils.is_number(timeout) or timeout <= 0):
+        raise ValueError('timeout must be a positive number or None.')
+    if stats is None:
+        return TransactionStats()
+    if not isinstance(stats, TransactionStats):
+        raise ValueError('stats must be a db.TransactionStats instance.')
+    return stats
+
+def get_retry_delay(stats, start, backoff, max_retries, max_backoff, timeout):
+    """Returns the random delay before retrying a transaction after a conflict.
+
+    Raises:
+      TransactionError: If the transaction must be aborted instead of retried.
+    """
+    if stats.attempts >= max_retries:
+        raise TransactionError('Transaction aborted after failed retries.')
+    delay = random.uniform(0, min(backoff, max_backoff))
+    if timeout is not None and time.time() + delay - start >= timeout:
+        raise TransactionError('Transaction aborted after exceeding the timeout.')
+    return delay
@@ -0,0 +1,573 @@
+# Copyright 2017 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+"""Internal utilities shared by the Firebase Realtime Database modules.
+
+This covers the parsing of database paths, the client-side ordering of query results, and the
+manipulation of decoded JSON values.
+"""
+
+import codecs
+import collections
+import hashlib
+import json
+import re
+import sys
+
+import six
+
+try:
+    from functools import lru_cache
+except ImportError:
+    # Python 2.7 does not provide an LRU cache. Paths are parsed on every call instead.
+    lru_cache = None
+
+
+_INVALID_PATH_CHARACTERS = '[].?#$'
+_INVALID_PATH_PATTERN = re.compile('[{0}]'.format(re.escape(_INVALID_PATH_CHARACTERS)))
+RESERVED_FILTERS = ('$key', '$value', '$priority')
+_PATH_CACHE_SIZE = 10000
+_ARRAY_INDEX_PATTERN = re.compile(r'^(0|[1-9][0-9]*)$')
+_JSON_DECODER = json.JSONDecoder()
+_JSON_WHITESPACE = re.compile(r'[ \t\n\r]*')
+_NUMBER_CHARS = '0123456789.eE+-'
+# States of JsonChildParser.
+(_PARSE_START, _PARSE_OBJECT_FIRST, _PARSE_KEY, _PARSE_COLON, _PARSE_OBJECT_VALUE,
+ _PARSE_OBJECT_SEP, _PARSE_ARRAY_FIRST, _PARSE_ARRAY_VALUE, _PARSE_ARRAY_SEP, _PARSE_PRIMITIVE,
+ _PARSE_END, _PARSE_DONE) = range(12)
+_VALUE_STATES = (_PARSE_KEY, _PARSE_OBJECT_VALUE, _PARSE_ARRAY_VALUE, _PARSE_PRIMITIVE)
+# Maps the states that expect a separator to the accepted characters, and the states they lead to.
+_PARSE_SEPARATORS = {
+    _PARSE_COLON: (':', (_PARSE_OBJECT_VALUE,)),
+    _PARSE_OBJECT_SEP: (',}', (_PARSE_KEY, _PARSE_END)),
+    _PARSE_ARRAY_SEP: (',]', (_PARSE_ARRAY_VALUE, _PARSE_END)),
+}
+# Returned by JsonChildParser when a value has not been received in full yet.
+_INCOMPLETE = object()
+
+
+def is_number(value):
+    return isinstance(value, (six.integer_types, float)) and not isinstance(value, bool)
+
+
+def parse_path(path):
+    """Parses a path string into a tuple of segments.
+
+    On Python 3, results are memoized in an LRU cache of up to ``_PATH_CACHE_SIZE`` paths, so that
+    frequently used paths are only split and validated once. Segments are interned, so that
+    references to the same locations share their segment strings.
+    """
+    if not isinstance(path, six.string_types):
+        raise ValueError('Invalid path: "{0}". Path must be a string.'.format(path))
+    return _split_path(path)
+
+def _memoize_paths(func):
+    if lru_cache is None:
+        return func
+    return lru_cache(maxsize=_PATH_CACHE_SIZE)(func)
+
+@_memoize_paths
+def _split_path(path):
+    if _INVALID_PATH_PATTERN.search(path):
+        raise ValueError('Invalid path: "{0}". Path contains illegal characters.'.format(path))
+    return tuple([_intern(seg) for seg in path.split('/') if seg])
+
+def _intern(segment):
+    try:
+        return six.moves.intern(segment)
+    except TypeError:
+        # Unicode strings cannot be interned in Python 2.
+        return segment
+
+def validate_child_path(path):
+    if not path or not isinstance(path, six.string_types):
+        raise ValueError(
+            'Invalid path argument: "{0}". Path must be a non-empty string.'.format(path))
+    if path.startswith('/'):
+        raise ValueError(
+            'Invalid path argument: "{0}". Child path must not start with "/"'.format(path))
+
+
+def sort_children(children, order_by):
+    """Sorts a stream of (key, value) items in query order, and yields them one at a time."""
+    # Only the decoded items are kept, along with their sort keys. Sort them in reverse, so that
+    # each item can be released as it is popped off the end of the list.
+    sort_key = Sorter._get_sort_key_func(order_by) # pylint: disable=protected-access
+    items = [(sort_key(item), item) for item in children]
+    items.sort(key=lambda entry: entry[0], reverse=True)
+    while items:
+        yield items.pop()[1]
+
+
+def json_digest(value):
+    encoded = json.dumps(value, sort_keys=True, separators=(',', ':'))
+    return hashlib.sha1(encoded.encode('utf-8')).digest()
+
+
+class ApiCallError(Exception):
+    """Represents an Exception encountered while invoking the Firebase database server API."""
+
+    def __init__(self, message, error):
+        Exception.__init__(self, message)
+        self.detail = error
+
+
+def extract_error_message(error):
+    """Extracts an error message from an exception.
+
+    If the server has not sent any response, simply converts the exception into a string.
+    If the server has sent a JSON response with an 'error' field, which is the typical
+    behavior of the Realtime Database REST API, parses the response to retrieve the error
+    message. If the server has sent a non-JSON response, returns the full response
+    as the error message.
+
+    Args:
+      error: An exception raised by the requests library.
+
+    Returns:
+      str: A string error message extracted from the exception.
+    """
+    if error.response is None:
+        return str(error)
+    try:
+        data = error.response.json()
+        if isinstance(data, dict):
+            return '{0}\nReason: {1}'.format(error, data.get('error', 'unknown'))
+    except ValueError:
+        pass
+    return '{0}\nReason: {1}'.format(error, error.response.content.decode())
+
+
+def to_json_array(value):
+    """Converts a dict into a list, if the server would have returned it as a JSON array.
+
+    The server returns a node as an array when all of its keys are integers, and more than half
+    of the keys between 0 and the largest key have values.
+    """
+    indices = []
+    for key in value:
+        if not _ARRAY_INDEX_PATTERN.match(key):
+            return value
+        indices.append(int(key))
+    size = max(indices) + 1
+    if len(indices) * 2 <= size:
+        return value
+    result = [None] * size
+    for key, child in value.items():
+        result[int(key)] = child
+    return result
+
+
+class JsonChildParser(object):
+    """Incrementally parses a JSON object or array received as a sequence of byte chunks.
+
+    The members of the top-level object (or the elements of a top-level array) are decoded one
+    at a time, as soon as they have been received in full. Only the undecoded part of the input
+    that has been received so far is buffered. Chunks are pushed into the parser with ``feed()``,
+    so that it can be driven by blocking and asynchronous readers alike. Nothing is returned for
+    an input that is empty, null or a primitive value.
+    """
+
+    def __init__(self):
+        self._decoder = codecs.getincrementaldecoder('utf-8')()
+        self._buffer = ''
+        self._pos = 0
+        self._received = []
+        self._received_size = 0
+        self._eof = False
+        self._state = _PARSE_START
+        self._key = None
+        self._index = 0
+        self._attempted = -1
+        self._error = None
+
+    def feed(self, chunk):
+        """Adds a chunk of the input, and returns the (key, value) tuples it completes.
+
+        Raises:
+          ValueError: If the input received so far is not valid JSON.
+        """
+        self._receive(self._decoder.decode(chunk))
+        return self._parse()
+
+    def close(self):
+        """Marks the end of the input, and returns the remaining (key, value) tuples.
+
+        Raises:
+          ValueError: If the input is not valid JSON.
+        """
+        self._receive(self._decoder.decode(b'', True))
+        self._eof = True
+        return self._parse()
+
+    def _receive(self, text):
+        if text:
+            self._received.append(text)
+            self._received_size += len(text)
+
+    def _parse(self):
+        if self._error is not None:
+            raise self._error
+        children = []
+        try:
+            while self._state != _PARSE_DONE:
+                if self._state in _VALUE_STATES:
+                    advanced = self._parse_value(children)
+                else:
+                    advanced = self._parse_structure()
+                if not advanced:
+                    break
+        except ValueError as error:
+            if self._eof or not children:
+                raise
+            # Hand out the children that precede the error first, and raise it on the next call.
+            self._error = error
+        return children
+
+    def _parse_value(self, children):
+        """Decodes the next key or value. Returns False if more input is needed."""
+        value = self._decode()
+        if value is _INCOMPLETE:
+            return False
+        if self._state == _PARSE_KEY:
+            if not isinstance(value, six.string_types):
+                raise ValueError('Expected an object key at position {0}.'.format(self._pos))
+            self._key = value
+            self._state = _PARSE_COLON
+        elif self._state == _PARSE_OBJECT_VALUE:
+            children.append((self._key, value))
+            self._state = _PARSE_OBJECT_SEP
+        elif self._state == _PARSE_ARRAY_VALUE:
+            if value is not None:
+                children.append((str(self._index), value))
+            self._index += 1
+            self._state = _PARSE_ARRAY_SEP
+        else:
+            self._state = _PARSE_END
+        return True
+
+    def _parse_structure(self):
+        """Consumes the next brace, bracket or separator. Returns False if more input is needed."""
+        char = self._peek()
+        if char is None:
+            if not self._eof:
+                return False
+            if self._state not in (_PARSE_START, _PARSE_END):
+                raise ValueError('Unexpected end of input at position {0}.'.format(self._pos))
+            self._state = _PARSE_DONE
+            return True
+
+        state = self._state
+        if state == _PARSE_START:
+            if char in '{[':
+                self._pos += 1
+                self._state = _PARSE_OBJECT_FIRST if char == '{' else _PARSE_ARRAY_FIRST
+            else:
+                self._state = _PARSE_PRIMITIVE
+        elif state in (_PARSE_OBJECT_FIRST, _PARSE_ARRAY_FIRST):
+            if char == ('}' if state == _PARSE_OBJECT_FIRST else ']'):
+                self._pos += 1
+                self._state = _PARSE_END
+            else:
+                self._state = _PARSE_KEY if state == _PARSE_OBJECT_FIRST else _PARSE_ARRAY_VALUE
+        elif state == _PARSE_END:
+            raise ValueError('Extra data at position {0}.'.format(self._pos))
+        else:
+            expected, next_states = _PARSE_SEPARATORS[state]
+            if char not in expected:
+                raise ValueError(
+                    'Expected one of "{0}" at position {1}.'.format(expected, self._pos))
+            self._pos += 1
+            self._state = next_states[expected.index(char)]
+        return True
+
+    def _peek(self):
+        """Skips whitespace, and returns the next character, or None if none was received yet."""
+        while True:
+            self._pos = _JSON_WHITESPACE.match(self._buffer, self._pos).end()
+            if self._pos < len(self._buffer):
+                return self._buffer[self._pos]
+            if not self._received:
+                return None
+            self._join()
+
+    def _decode(self):
+        """Decodes the next JSON value, or returns _INCOMPLETE if more input is needed."""
+        if self._peek() is None:
+            if self._eof:
+                raise ValueError('Unexpected end of input at position {0}.'.format(self._pos))
+            return _INCOMPLETE
+        # Retry a failed decode only once the available input has doubled, so that a value
+        # spanning many chunks is not parsed over and over again.
+        available = len(self._buffer) - self._pos + self._received_size
+        if not self._eof and available < 2 * self._attempted:
+            return _INCOMPLETE
+        self._join()
+        try:
+            value, end = _JSON_DECODER.raw_decode(self._buffer, self._pos)
+        except ValueError:
+            if self._eof:
+                raise
+            self._attempted = available
+            return _INCOMPLETE
+        # A number that ends where the input received so far ends, or right before a character
+        # that could continue it, may have been cut off at a chunk boundary.
+        if not self._eof and is_number(value) and (
+                end == len(self._buffer) or self._buffer[end] in _NUMBER_CHARS):
+            # Numbers are short, so retry as soon as the next chunk arrives.
+            self._attempted = 0
+            return _INCOMPLETE
+        self._pos = end
+        self._attempted = -1
+        return value
+
+    def _join(self):
+        self._buffer = self._buffer[self._pos:] + ''.join(self._received)
+        self._pos = 0
+        self._received = []
+        self._received_size = 0
+
+
+def iter_json_children(chunks):
+    """Parses a JSON object or array from an iterable of byte chunks, and yields its children.
+
+    Yields a (key, value) tuple for each member of the top-level object, or each element of the
+    top-level array. Yields nothing if the input is empty, null or a primitive value.
+
+    Raises:
+      ValueError: If the input is not valid JSON.
+    """
+    parser = JsonChildParser()
+    for chunk in chunks:
+        for child in parser.feed(chunk):
+            yield child
+    for child in parser.close():
+        yield child
+
+
+class Sorter(object):
+    """Helper class for sorting query results.
+
+    Each child is sorted by a key of the form (index type, index value, child key), which is
+    computed exactly once per child. Comparing these keys as tuples yields the ordering described
+    at https://firebase.google.com/docs/database/rest/retrieve-data#section-rest-ordered-data:
+    children are first ordered by the type of their index. Numeric and string indices are then
+    compared directly. All remaining ties are broken by comparing the keys.
+    """
+
+    def __init__(self, results, order_by):
+        if isinstance(results, dict):
+            self.dict_input = True
+            items = results.items()
+        elif isinstance(results, list):
+            self.dict_input = False
+            items = enumerate(results)
+        else:
+            raise ValueError('Sorting not supported for "{0}" object.'.format(type(results)))
+        self.sort_key = Sorter._get_sort_key_func(order_by)
+        self.sorted_items = sorted(items, key=self.sort_key)
+
+    def get(self):
+        if self.dict_input:
+            return collections.OrderedDict(self.sorted_items)
+        else:
+            return [value for _, value in self.sorted_items]
+
+    @classmethod
+    def _get_sort_key_func(cls, order_by):
+        """Returns a function that computes the sort key of a (key, value) item."""
+        if order_by == '$key' or order_by == '$priority':
+            def sort_key(item):
+                key = item[0]
+                rank, index = _get_index_key(key)
+                return rank, index, key
+        elif order_by == '$value':
+            def sort_key(item):
+                rank, index = _get_index_key(item[1])
+                return rank, index, item[0]
+        else:
+            segments = order_by.split('/')
+            def sort_key(item):
+                current = item[1]
+                for segment in segments:
+                    if isinstance(current, dict):
+                        current = current.get(segment)
+                    else:
+                        current = None
+                        break
+                rank, index = _get_index_key(current)
+                return rank, index, item[0]
+        return sort_key
+
+
+_INDEX_TYPE_NONE = 0
+_INDEX_TYPE_BOOL_FALSE = 1
+_INDEX_TYPE_BOOL_TRUE = 2
+_INDEX_TYPE_NUMERIC = 3
+_INDEX_TYPE_STRING = 4
+_INDEX_TYPE_OBJECT = 5
+
+_NUMERIC_TYPES = six.integer_types + (float,)
+
+_INT32_KEY_PATTERN = re.compile(r'^(0|-?[1-9][0-9]{0,9})$')
+_MIN_INT32 = -2 ** 31
+_MAX_INT32 = 2 ** 31 - 1
+
+
+def evaluate_query(value, order_by, params):
+    """Applies the ordering, filtering and limit constraints of a query to a JSON value.
+
+    Follows the same ordering rules as the server. The params are in the form kept by ``Query``,
+    i.e. bounds are JSON strings and limits are integers.
+
+    Returns:
+      object: An OrderedDict of the matching children in query order, or the value itself if it
+      has no children.
+    """
+    if isinstance(value, list):
+        value = {str(idx): val for idx, val in enumerate(value) if val is not None}
+    if not isinstance(value, dict):
+        return value
+
+    def get_bound(name):
+        if name in params:
+            return _get_index_key(json.loads(params[name]))
+        return None
+
+    start = get_bound('startAt')
+    end = get_bound('endAt')
+    if 'equalTo' in params:
+        start = end = get_bound('equalTo')
+    sorter = Sorter(value, order_by)
+    # The first two elements of a sort key represent the index. Comparing them with a bound
+    # compares the index according to the Firebase ordering rules, without the key as a
+    # tie breaker.
+    items = [
+        item for item in sorter.sorted_items
+        if (start is None or sorter.sort_key(item)[:2] >= start) and
+        (end is None or sorter.sort_key(item)[:2] <= end)
+    ]
+    if 'limitToFirst' in params:
+        items = items[:params['limitToFirst']]
+    elif 'limitToLast' in params:
+        limit = params['limitToLast']
+        items = items[len(items) - limit:] if limit else []
+    return collections.OrderedDict(items)
+
+def _get_index_key(index):
+    """Returns a (type rank, comparable value) pair for the given index value.
+
+    Only numeric and string indices are compared by value. For all other types the comparable
+    value is a constant, so that indices of the same type compare as equal.
+    """
+    if index is None:
+        return _INDEX_TYPE_NONE, 0
+    elif index is False:
+        return _INDEX_TYPE_BOOL_FALSE, 0
+    elif index is True:
+        return _INDEX_TYPE_BOOL_TRUE, 0
+    elif isinstance(index, _NUMERIC_TYPES):
+        return _INDEX_TYPE_NUMERIC, index
+    elif isinstance(index, six.string_types):
+        return _INDEX_TYPE_STRING, index
+    else:
+        return _INDEX_TYPE_OBJECT, 0
+
+
+def get_key_order(key):
+    """Returns a sort key that orders child keys the same way as the server.
+
+    Keys that can be parsed as 32-bit integers come first, in ascending numeric order. They are
+    followed by all other keys in lexicographic order.
+    """
+    if _INT32_KEY_PATTERN.match(key):
+        value = int(key)
+        if _MIN_INT32 <= value <= _MAX_INT32:
+            return 0, value, key
+    return 1, 0, key
+
+
+def get_json_child(value, segments):
+    for segment in segments:
+        if isinstance(value, dict):
+            value = value.get(segment)
+        elif isinstance(value, list) and segment.isdigit() and int(segment) < len(value):
+            value = value[int(segment)]
+        else:
+            return None
+    return value
+
+
+def set_json_child(value, segments, new_value):
+    """Sets a nested value in a decoded JSON tree, and returns the updated tree.
+
+    Follows the server semantics: setting a value to None deletes it, and nodes left without any
+    children are removed.
+    """
+    if not segments:
+        return _prune_json(new_value)
+    if isinstance(value, list):
+        value = {str(idx): val for idx, val in enumerate(value) if val is not None}
+    elif not isinstance(value, dict):
+        value = {}
+    key = segments[0]
+    child = set_json_child(value.get(key), segments[1:], new_value)
+    if child is None:
+        value.pop(key, None)
+    else:
+        value[key] = child
+    return value or None
+
+
+def _prune_json(value):
+    if isinstance(value, dict):
+        value = {key: _prune_json(val) for key, val in value.items()}
+        return {key: val for key, val in value.items() if val is not None} or None
+    if isinstance(value, list):
+        value = [_prune_json(val) for val in value]
+        return value if any(val is not None for val in value) else None
+    return value
+
+
+def copy_json(value):
+    if isinstance(value, dict):
+        return {key: copy_json(val) for key, val in value.items()}
+    if isinstance(value, list):
+        return [copy_json(val) for val in value]
+    return value
+
+
+def denormalize_json(value):
+    """Copies a decoded JSON tree, converting nodes back into arrays where the server would.
+
+    Updates below an array turn it into a dict keyed by the indices, as the server does not
+    store arrays either.
+    """
+    if isinstance(value, dict):
+        return to_json_array({key: denormalize_json(val) for key, val in value.items()})
+    if isinstance(value, list):
+        return [denormalize_json(val) for val in value]
+    return value
+
+
+def json_size(value):
+    size = sys.getsizeof(value)
+    if isinstance(value, dict):
+        for key, val in value.items():
+            size += sys.getsizeof(key) + json_size(val)
+    elif isinstance(value, list):
+        for val in value:
+            size += json_size(val)
+    return size
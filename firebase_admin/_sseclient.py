@@ -17,17 +17,26 @@
 Based on a similar implementation from Pyrebase.
 """
 
+import errno
 import re
+import socket
+import ssl
 import time
 import warnings
 
 from google.auth import transport
 import requests
+from requests.packages import urllib3 # pylint: disable=import-error
+from six.moves import http_client
 
 
 # Technically, we should support streams that mix line endings.  This regex,
 # however, assumes that a system will provide consistent line endings.
-end_of_field = re.compile(r'\r\n\r\n|\r\r|\n\n')
+end_of_field = re.compile(br'\r\n\r\n|\r\r|\n\n')
+
+# Upper bound on the number of bytes read from the connection at a time. Reads return whatever
+# has arrived, and never wait for this many bytes to accumulate (see _iter_available()).
+_READ_CHUNK_SIZE = 64 * 1024
 
 
 class KeepAuthSession(transport.requests.AuthorizedSession):
@@ -41,52 +50,55 @@ class KeepAuthSession(transport.requests.AuthorizedSession):
 
 
 class _EventBuffer(object):
-    """A helper class for buffering and parsing raw SSE data."""
+    """A helper class for buffering raw SSE bytes and splitting them into events.
 
-    def __init__(self):
-        self._buffer = []
-        self._tail = ''
+    Incoming chunks are appended to a single byte array. Each lookup for an event boundary only
+    scans the bytes that have not been scanned before (plus enough overlap to catch a separator
+    split across two chunks), and only complete events are decoded into strings.
+    """
 
-    def append(self, char):
-        self._buffer.append(char)
-        self._tail += char
-        self._tail = self._tail[-4:]
+    # The longest event separator (\r\n\r\n) is 4 bytes long.
+    _OVERLAP = 3
 
-    def truncate(self):
-        head, sep, _ = self.buffer_string.rpartition('\n')
-        rem = head + sep
-        self._buffer = list(rem)
-        self._tail = rem[-4:]
+    def __init__(self):
+        self._buffer = bytearray()
+        self._scan_pos = 0
 
-    @property
-    def is_end_of_field(self):
-        last_two_chars = self._tail[-2:]
-        return last_two_chars == '\n\n' or last_two_chars == '\r\r' or self._tail == '\r\n\r\n'
+    def append(self, chunk):
+        self._buffer.extend(chunk)
 
-    @property
-    def buffer_string(self):
-        return ''.join(self._buffer)
+    def clear(self):
+        del self._buffer[:]
+        self._scan_pos = 0
 
+    def next_event(self):
+        """Removes the next complete event from the buffer and returns it as a string.
 
-class SSEClient(object):
-    """SSE client implementation."""
+        Returns:
+          str: The raw text of the next event, or None if the buffer does not contain a complete
+          event yet.
+        """
+        match = end_of_field.search(self._buffer, self._scan_pos)
+        if match is None:
+            self._scan_pos = max(0, len(self._buffer) - self._OVERLAP)
+            return None
+        raw = bytes(self._buffer[:match.start()])
+        del self._buffer[:match.end()]
+        self._scan_pos = 0
+        # The SSE spec mandates UTF-8, with decoding errors replaced rather than raised.
+        return raw.decode('utf-8', 'replace')
 
-    def __init__(self, url, session, retry=3000, **kwargs):
-        """Initializes the SSEClient.
 
-        Args:
-          url: The remote url to connect to.
-          session: The requests session.
-          retry: The retry interval in milliseconds (optional).
-          **kwargs: Extra kwargs that will be sent to ``requests.get()`` (optional).
-        """
+class _SSEBase(object):
+    """State and event handling shared by the blocking and the non-blocking SSE clients."""
+
+    def __init__(self, url, session, retry, kwargs):
         self.url = url
         self.session = session
         self.retry = retry
         self.requests_kwargs = kwargs
-        self.should_connect = True
         self.last_id = None
-        self.buf = u'' # Keep data here as it streams in
+        self._event_buffer = _EventBuffer() # Keep data here as it streams in
 
         headers = self.requests_kwargs.get('headers', {})
         # The SSE spec requires making requests with Cache-Control: no-cache
@@ -94,6 +106,50 @@ class SSEClient(object):
         # The 'Accept' header is not required, but explicit > implicit
         headers['Accept'] = 'text/event-stream'
         self.requests_kwargs['headers'] = headers
+
+    def _open(self):
+        if self.last_id:
+            self.requests_kwargs['headers']['Last-Event-ID'] = self.last_id
+        return self.session.get(self.url, stream=True, **self.requests_kwargs)
+
+    def _accept(self, event):
+        """Updates the stream state from the given event, and checks if it carries any data.
+
+        Returns:
+          bool: True if the event should be delivered to the consumer, False otherwise.
+        """
+        if event.data == 'null':
+            return False
+
+        # If the server requests a specific retry delay, we need to honor it.
+        if event.retry:
+            self.retry = event.retry
+
+        # last_id should only be set if included in the message.  It's not
+        # forgotten if a message omits it.
+        if event.event_id:
+            self.last_id = event.event_id
+        return True
+
+    @classmethod
+    def _is_credential_expired(cls, event):
+        return event.data == 'credential is no longer valid'
+
+
+class SSEClient(_SSEBase):
+    """SSE client implementation."""
+
+    def __init__(self, url, session, retry=3000, **kwargs):
+        """Initializes the SSEClient.
+
+        Args:
+          url: The remote url to connect to.
+          session: The requests session.
+          retry: The retry interval in milliseconds (optional).
+          **kwargs: Extra kwargs that will be sent to ``requests.get()`` (optional).
+        """
+        super(SSEClient, self).__init__(url, session, retry, kwargs)
+        self.should_connect = True
         self._connect()
 
     def close(self):
@@ -105,10 +161,8 @@ class SSEClient(object):
     def _connect(self):
         """Connects to the server using requests."""
         if self.should_connect:
-            if self.last_id:
-                self.requests_kwargs['headers']['Last-Event-ID'] = self.last_id
-            self.resp = self.session.get(self.url, stream=True, **self.requests_kwargs)
-            self.resp_iterator = self.resp.iter_content(decode_unicode=True)
+            self.resp = self._open()
+            self.resp_iterator = _iter_available(self.resp)
             self.resp.raise_for_status()
         else:
             raise StopIteration()
@@ -117,46 +171,268 @@ class SSEClient(object):
         return self
 
     def __next__(self):
-        if not re.search(end_of_field, self.buf):
-            temp_buffer = _EventBuffer()
-            while not temp_buffer.is_end_of_field:
-                try:
-                    nextchar = next(self.resp_iterator)
-                    temp_buffer.append(nextchar)
-                except (StopIteration, requests.RequestException):
-                    time.sleep(self.retry / 1000.0)
-                    self._connect()
-                    # The SSE spec only supports resuming from a whole message, so
-                    # if we have half a message we should throw it out.
-                    temp_buffer.truncate()
-                    continue
-            self.buf = temp_buffer.buffer_string
-
-        split = re.split(end_of_field, self.buf)
-        head = split[0]
-        self.buf = '\n\n'.join(split[1:])
-        event = Event.parse(head)
-
-        if event.data == 'credential is no longer valid':
+        raw = self._event_buffer.next_event()
+        while raw is None:
+            try:
+                chunk = next(self.resp_iterator)
+            except (StopIteration, requests.RequestException):
+                time.sleep(self.retry / 1000.0)
+                self._connect()
+                # The SSE spec only supports resuming from a whole message, so
+                # if we have half a message we should throw it out.
+                self._event_buffer.clear()
+                continue
+            except Exception: # pylint: disable=broad-except
+                if self.should_connect:
+                    raise
+                # close() was called from another thread, and closed the response while this
+                # thread was reading from it.
+                raise StopIteration()
+            self._event_buffer.append(chunk)
+            raw = self._event_buffer.next_event()
+
+        event = Event.parse(raw)
+        if self._is_credential_expired(event):
             self._connect()
+            self._event_buffer.clear()
             return None
-        elif event.data == 'null':
-            return None
-
-        # If the server requests a specific retry delay, we need to honor it.
-        if event.retry:
-            self.retry = event.retry
-
-        # last_id should only be set if included in the message.  It's not
-        # forgotten if a message omits it.
-        if event.event_id:
-            self.last_id = event.event_id
-        return event
+        return event if self._accept(event) else None
 
     def next(self):
         return self.__next__()
 
 
+def _iter_available(resp):
+    """Returns an iterator over the body of a streaming response, which yields data as it arrives.
+
+    Bodies sent with chunked transfer encoding, like the event streams of the database, are read
+    one HTTP chunk at a time. Other bodies are read with ``read1()``, which returns the bytes
+    that are available instead of waiting for ``_READ_CHUNK_SIZE`` bytes to arrive. Where
+    ``read1()`` is not available (Python 2, or content-encoded bodies before urllib3 2.0), the
+    body is read a byte at a time.
+    """
+    raw = resp.raw
+    if not isinstance(raw, urllib3.response.HTTPResponse) or raw.chunked:
+        return resp.iter_content(chunk_size=_READ_CHUNK_SIZE)
+    fp = raw._fp # pylint: disable=protected-access
+    if hasattr(raw, 'read1'):
+        # urllib3 2.0 and higher.
+        read1 = lambda: raw.read1(_READ_CHUNK_SIZE, decode_content=True)
+    elif hasattr(fp, 'read1') and not resp.headers.get('Content-Encoding'):
+        read1 = lambda: fp.read1(_READ_CHUNK_SIZE)
+    else:
+        return resp.iter_content(chunk_size=1)
+    return _iter_read1(read1)
+
+
+def _iter_read1(read1):
+    while True:
+        try:
+            chunk = read1()
+        except (socket.error, http_client.HTTPException, urllib3.exceptions.HTTPError) as error:
+            raise requests.exceptions.ConnectionError(error)
+        if not chunk:
+            return
+        yield chunk
+
+
+class UnsupportedStreamError(Exception):
+    """Raised when an event stream cannot be read with an ``SSEStream``."""
+
+
+class SSEStream(_SSEBase):
+    """A non-blocking SSE connection, which can be multiplexed with other streams on one thread.
+
+    Connections are established through the requests session, so that authentication, redirects
+    and proxies are handled exactly as in ``SSEClient``. Once the response headers have been
+    received, the underlying socket is switched to non-blocking mode, and the caller is expected
+    to call ``read_events()`` whenever the socket becomes readable (e.g. by registering the stream
+    with a selector). This requires access to the socket of a persistent connection, which is not
+    available if the server closes the connection after the response (``Connection: close``), or
+    if the HTTP libraries do not expose it. ``connect()`` raises ``UnsupportedStreamError`` in that
+    case, and the caller should fall back to reading the stream with an ``SSEClient`` instead.
+    Requires Python 3.
+    """
+
+    def __init__(self, url, session, retry=3000, **kwargs):
+        """Initializes the SSEStream. Call ``connect()`` to open the connection.
+
+        Args:
+          url: The remote url to connect to.
+          session: The requests session.
+          retry: The retry interval in milliseconds (optional).
+          **kwargs: Extra kwargs that will be sent to ``requests.get()`` (optional).
+        """
+        super(SSEStream, self).__init__(url, session, retry, kwargs)
+        # The socket is read directly, so the response body must not be content-encoded.
+        self.requests_kwargs['headers']['Accept-Encoding'] = 'identity'
+        self.resp = None
+        self.needs_reconnect = False
+        self._sock = None
+        self._decoder = None
+        self._pending = []
+
+    def connect(self):
+        """Opens a new connection to the server, closing the previous one if any.
+
+        Raises:
+          RequestException: If an error occurs while making the HTTP request.
+          UnsupportedStreamError: If the socket of the connection cannot be read directly.
+        """
+        self.close()
+        resp = self._open()
+        resp.raise_for_status()
+        try:
+            sock, fp = self._get_socket(resp)
+            sock.setblocking(False)
+            # The HTTP library may have received some of the body along with the headers.
+            buffered = self._read_buffered(fp)
+        except:
+            resp.close()
+            raise
+
+        self.resp = resp
+        self.needs_reconnect = False
+        self._sock = sock
+        self._decoder = _ChunkedDecoder() if resp.raw.chunked else None
+        self._event_buffer.clear()
+        self._pending = self._feed(buffered)
+
+    def fileno(self):
+        return self._sock.fileno()
+
+    def close(self):
+        """Closes the current connection, if any."""
+        if self.resp is not None:
+            self.resp.close()
+            self.resp = None
+            self._sock = None
+
+    def read_events(self):
+        """Reads all the data currently available on the connection.
+
+        Never blocks. Should be called once right after connecting, since some data may have
+        been received along with the response headers, and then whenever the socket becomes
+        readable. If the server has closed the connection, or revoked the credential used to open
+        it, sets ``needs_reconnect`` to True.
+
+        Returns:
+          list: The complete events received so far, excluding keep-alive messages.
+
+        Raises:
+          socket.error: If a low-level error occurs while reading from the connection.
+        """
+        events = []
+        raws, self._pending = self._pending, []
+        raws.extend(self._feed(self._recv_available()))
+        for raw in raws:
+            event = Event.parse(raw)
+            if self._is_credential_expired(event):
+                self.needs_reconnect = True
+                break
+            if self._accept(event):
+                events.append(event)
+        return events
+
+    def _feed(self, data):
+        if self._decoder is not None:
+            data = self._decoder.feed(data)
+            if self._decoder.done:
+                self.needs_reconnect = True
+        self._event_buffer.append(data)
+        raws = []
+        raw = self._event_buffer.next_event()
+        while raw is not None:
+            raws.append(raw)
+            raw = self._event_buffer.next_event()
+        return raws
+
+    def _recv_available(self):
+        chunks = []
+        while True:
+            try:
+                chunk = self._sock.recv(_READ_CHUNK_SIZE)
+            except (ssl.SSLWantReadError, ssl.SSLWantWriteError):
+                break
+            except socket.error as error:
+                if error.errno in (errno.EAGAIN, errno.EWOULDBLOCK):
+                    break
+                raise
+            if not chunk:
+                self.needs_reconnect = True
+                break
+            chunks.append(chunk)
+        return b''.join(chunks)
+
+    @classmethod
+    def _get_socket(cls, resp):
+        """Returns the socket of the given response, and the file object that reads from it.
+
+        The socket is obtained from the connection of the urllib3 response, which releases it when
+        the server sends a "Connection: close" header. The file object of the underlying
+        http.client response may hold some of the body, which was received along with the headers.
+        """
+        sock = getattr(getattr(resp.raw, 'connection', None), 'sock', None)
+        fp = getattr(getattr(resp.raw, '_fp', None), 'fp', None)
+        if sock is None or fp is None:
+            raise UnsupportedStreamError(
+                'The connection to {0} cannot be read without blocking.'.format(resp.url))
+        return sock, fp
+
+    @classmethod
+    def _read_buffered(cls, fp):
+        read1 = getattr(fp, 'read1', None)
+        if read1 is None:
+            return b''
+        # With the socket in non-blocking mode, read1() returns the bytes already buffered, or
+        # whatever a single non-blocking read from the socket yields.
+        try:
+            return read1(_READ_CHUNK_SIZE) or b''
+        except (ssl.SSLWantReadError, ssl.SSLWantWriteError):
+            return b''
+
+
+class _ChunkedDecoder(object):
+    """Incrementally decodes an HTTP/1.1 response body sent with chunked transfer encoding."""
+
+    def __init__(self):
+        self._buffer = bytearray()
+        # None while expecting a chunk size line, otherwise the number of data bytes left in the
+        # current chunk. Zero indicates that the CRLF terminating the chunk is expected next.
+        self._chunk_left = None
+        self.done = False
+
+    def feed(self, data):
+        """Consumes the given raw bytes, and returns the decoded body bytes available so far."""
+        self._buffer.extend(data)
+        output = bytearray()
+        while not self.done:
+            if self._chunk_left is None:
+                index = self._buffer.find(b'\r\n')
+                if index < 0:
+                    break
+                size_line = bytes(self._buffer[:index]).split(b';', 1)[0].strip()
+                del self._buffer[:index + 2]
+                size = int(size_line, 16)
+                if size == 0:
+                    self.done = True
+                else:
+                    self._chunk_left = size
+            elif self._chunk_left > 0:
+                if not self._buffer:
+                    break
+                count = min(self._chunk_left, len(self._buffer))
+                output.extend(self._buffer[:count])
+                del self._buffer[:count]
+                self._chunk_left -= count
+            else:
+                if len(self._buffer) < 2:
+                    break
+                del self._buffer[:2]
+                self._chunk_left = None
+        return bytes(output)
+
+
 class Event(object):
     """Event represents the events fired by SSE."""
 
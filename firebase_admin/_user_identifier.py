@@ -0,0 +1,104 @@
+# Copyright 2018 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Firebase user identifier sub module."""
+
+from firebase_admin import _auth_utils
+
+
+class UserIdentifier(object):
+    """Identifies a user to be looked up via ``auth.get_users()``.
+
+    This is the base class of ``UidIdentifier``, ``EmailIdentifier`` and ``PhoneIdentifier``.
+    """
+
+    # Name of the accounts:lookup request field, and of the user record field, that holds the
+    # identifier value.
+    _field = None
+
+    def __init__(self, value):
+        self._value = value
+
+    def __repr__(self):
+        return '{0}({1!r})'.format(type(self).__name__, self._value)
+
+    def _lookup_key(self):
+        """Returns a key that equals the _record_keys() entry of each matching user record."""
+        return self._field, self._value
+
+
+class UidIdentifier(UserIdentifier):
+    """Identifies a user by user ID.
+
+    Args:
+        uid: A user ID string.
+    """
+
+    _field = 'localId'
+
+    def __init__(self, uid):
+        super(UidIdentifier, self).__init__(_auth_utils.validate_uid(uid, required=True))
+
+    @property
+    def uid(self):
+        return self._value
+
+
+class EmailIdentifier(UserIdentifier):
+    """Identifies a user by email address.
+
+    Args:
+        email: A user email address string.
+    """
+
+    _field = 'email'
+
+    def __init__(self, email):
+        super(EmailIdentifier, self).__init__(_auth_utils.validate_email(email, required=True))
+
+    @property
+    def email(self):
+        return self._value
+
+    def _lookup_key(self):
+        # Email addresses are matched case-insensitively.
+        return self._field, self._value.lower()
+
+
+class PhoneIdentifier(UserIdentifier):
+    """Identifies a user by phone number.
+
+    Args:
+        phone_number: A phone number string.
+    """
+
+    _field = 'phoneNumber'
+
+    def __init__(self, phone_number):
+        super(PhoneIdentifier, self).__init__(
+            _auth_utils.validate_phone(phone_number, required=True))
+
+    @property
+    def phone_number(self):
+        return self._value
+
+
+def _record_keys(data):
+    """Returns the lookup keys of all the identifiers that match the given user record."""
+    keys = [('localId', data.get('localId'))]
+    if data.get('email'):
+        keys.append(('email', data['email'].lower()))
+    if data.get('phoneNumber'):
+        keys.append(('phoneNumber', data['phoneNumber']))
+    return keys
@@ -465,7 +465,10 @@ class UserImportHash(object):
 
 
 class ErrorInfo(object):
-    """Represents an error encountered while importing an ``ImportUserRecord``."""
+    """Represents an error encountered while importing an ``ImportUserRecord``.
+
+    Also used to describe the errors encountered by ``auth.delete_users()``.
+    """
 
     def __init__(self, error):
         self._index = error['index']
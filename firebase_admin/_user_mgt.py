@@ -14,6 +14,8 @@
 
 """Firebase user management sub module."""
 
+import collections
+import itertools
 import json
 
 import requests
@@ -21,6 +23,8 @@ import six
 from six.moves import urllib
 
 from firebase_admin import _auth_utils
+from firebase_admin import _concurrency
+from firebase_admin import _user_identifier
 from firebase_admin import _user_import
 
 
@@ -35,6 +39,9 @@ GENERATE_EMAIL_ACTION_LINK_ERROR = 'GENERATE_EMAIL_ACTION_LINK_ERROR'
 
 MAX_LIST_USERS_RESULTS = 1000
 MAX_IMPORT_USERS_SIZE = 1000
+MAX_GET_USERS_IDENTIFIERS = 100
+MAX_DELETE_USERS_SIZE = 1000
+DEFAULT_CONCURRENCY = 10
 
 class _Unspecified(object):
     pass
@@ -300,11 +307,18 @@ class ListUsersPage(object):
         self._download = download
         self._max_results = max_results
         self._current = download(page_token, max_results)
+        self._records = None
 
     @property
     def users(self):
         """A list of ``ExportedUserRecord`` instances available in this page."""
-        return [ExportedUserRecord(user) for user in self._current.get('users', [])]
+        return list(self._get_records())
+
+    def _get_records(self):
+        # Records are created on first access, and reused for all subsequent accesses.
+        if self._records is None:
+            self._records = [ExportedUserRecord(user) for user in self._current.get('users', [])]
+        return self._records
 
     @property
     def next_page_token(self):
@@ -326,17 +340,89 @@ class ListUsersPage(object):
             return ListUsersPage(self._download, self.next_page_token, self._max_results)
         return None
 
-    def iterate_all(self):
+    def iterate_all(self, prefetch=0):
         """Retrieves an iterator for user accounts.
 
         Returned iterator will iterate through all the user accounts in the Firebase project
-        starting from this page. The iterator will never buffer more than one page of users
-        in memory at a time.
+        starting from this page. By default, the iterator will never buffer more than one page of
+        users in memory at a time, and only requests the next page once the current page has been
+        traversed. When ``prefetch`` is set, up to that many subsequent pages are requested on
+        background threads while the caller processes the current page. Pages are still requested
+        one after the other, since each page request requires the token returned by the previous
+        one. The iterator then buffers at most ``prefetch + 1`` pages in memory.
+
+        Args:
+            prefetch: A non-negative integer indicating the number of pages to fetch ahead of the
+                current page (optional). Defaults to 0, which disables prefetching.
 
         Returns:
             iterator: An iterator of ExportedUserRecord instances.
+
+        Raises:
+            ValueError: If prefetch is not a non-negative integer.
         """
-        return _UserIterator(self)
+        if not isinstance(prefetch, six.integer_types) or isinstance(prefetch, bool) or \
+                prefetch < 0:
+            raise ValueError('Prefetch must be a non-negative integer.')
+        return _UserIterator(self, prefetch)
+
+
+class GetUsersResult(object):
+    """Represents the result of a batch user lookup operation.
+
+    See ``auth.get_users()`` API for more details.
+    """
+
+    def __init__(self, identifiers, users):
+        records = collections.OrderedDict()
+        found = set()
+        for user in users:
+            uid = user.get('localId')
+            if uid not in records:
+                records[uid] = UserRecord(user)
+                found.update(_user_identifier._record_keys(user)) # pylint: disable=protected-access
+        self._users = list(records.values())
+        self._not_found = [
+            identifier for identifier in identifiers
+            if identifier._lookup_key() not in found] # pylint: disable=protected-access
+
+    @property
+    def users(self):
+        """A list of ``auth.UserRecord`` instances, one for each user that was found."""
+        return self._users
+
+    @property
+    def not_found(self):
+        """A list of the ``auth.UserIdentifier`` instances that did not match any user."""
+        return self._not_found
+
+
+class DeleteUsersResult(object):
+    """Represents the result of a bulk user deletion operation.
+
+    See ``auth.delete_users()`` API for more details.
+    """
+
+    def __init__(self, result, total):
+        errors = result.get('errors', [])
+        self._success_count = total - len(errors)
+        self._failure_count = len(errors)
+        self._errors = [_user_import.ErrorInfo(err) for err in errors]
+
+    @property
+    def success_count(self):
+        """Returns the number of users successfully deleted."""
+        return self._success_count
+
+    @property
+    def failure_count(self):
+        """Returns the number of users that failed to be deleted."""
+        return self._failure_count
+
+    @property
+    def errors(self):
+        """Returns a list of ``auth.ErrorInfo`` instances describing the errors encountered."""
+        return self._errors
 
 
 class ProviderUserInfo(UserInfo):
@@ -488,6 +574,37 @@ class UserManager(object):
                     'No user record found for the provided {0}: {1}.'.format(key_type, key))
             return response['users'][0]
 
+    def get_users(self, identifiers, concurrency=DEFAULT_CONCURRENCY):
+        """Gets the user data corresponding to the provided identifiers.
+
+        Identifiers are looked up in batches of up to ``MAX_GET_USERS_IDENTIFIERS``, with at most
+        ``concurrency`` batches in flight at any given time.
+        """
+        if not isinstance(identifiers, (list, tuple)):
+            raise ValueError('Identifiers must be a list of UserIdentifier instances.')
+        if any(not isinstance(i, _user_identifier.UserIdentifier) for i in identifiers):
+            raise ValueError('One or more identifiers are invalid.')
+        concurrency = _auth_utils.validate_int(concurrency, 'concurrency', low=1)
+
+        def lookup(batch):
+            payload = {}
+            for identifier in batch:
+                # pylint: disable=protected-access
+                payload.setdefault(identifier._field, []).append(identifier._value)
+            try:
+                response = self._client.body('post', '/accounts:lookup', json=payload)
+            except requests.exceptions.RequestException as error:
+                self._handle_http_error(INTERNAL_ERROR, 'Failed to get users.', error)
+            else:
+                return response.get('users', []) if response else []
+
+        batches = (identifiers[i:i + MAX_GET_USERS_IDENTIFIERS]
+                   for i in range(0, len(identifiers), MAX_GET_USERS_IDENTIFIERS))
+        users = []
+        for batch_users in _concurrency.map_ordered(lookup, batches, concurrency):
+            users.extend(batch_users)
+        return users
+
     def list_users(self, page_token=None, max_results=MAX_LIST_USERS_RESULTS):
         """Retrieves a batch of users."""
         if page_token is not None:
@@ -594,6 +711,48 @@ class UserManager(object):
             if not response or not response.get('kind'):
                 raise ApiCallError(USER_DELETE_ERROR, 'Failed to delete user: {0}.'.format(uid))
 
+    def delete_users(self, uids, force=True, concurrency=DEFAULT_CONCURRENCY, max_rate=None):
+        """Deletes the users identified by the specified user IDs.
+
+        User IDs are deleted in batches of up to ``MAX_DELETE_USERS_SIZE``, with at most
+        ``concurrency`` batches in flight at any given time, and if ``max_rate`` is set, at most
+        ``max_rate`` batches started per second. The indices of the errors reported for each
+        batch are mapped back to positions in ``uids``.
+        """
+        if not isinstance(uids, (list, tuple)):
+            raise ValueError('User IDs must be a list of strings.')
+        for uid in uids:
+            _auth_utils.validate_uid(uid, required=True)
+        concurrency = _auth_utils.validate_int(concurrency, 'concurrency', low=1)
+        limiter = None
+        if max_rate is not None:
+            limiter = _concurrency.RateLimiter(_auth_utils.validate_rate(max_rate, 'max_rate'))
+
+        def delete(offset):
+            if limiter:
+                limiter.acquire()
+            payload = {
+                'localIds': uids[offset:offset + MAX_DELETE_USERS_SIZE],
+                'force': bool(force),
+            }
+            try:
+                response = self._client.body('post', '/accounts:batchDelete', json=payload)
+            except requests.exceptions.RequestException as error:
+                self._handle_http_error(USER_DELETE_ERROR, 'Failed to delete users.', error)
+            else:
+                if not isinstance(response, dict):
+                    raise ApiCallError(USER_DELETE_ERROR, 'Failed to delete users.')
+                errors = response.get('errors', [])
+                for error in errors:
+                    error['index'] = error.get('index', 0) + offset
+                return errors
+
+        offsets = range(0, len(uids), MAX_DELETE_USERS_SIZE)
+        errors = []
+        for batch_errors in _concurrency.map_ordered(delete, offsets, concurrency):
+            errors.extend(batch_errors)
+        return {'errors': errors}
+
     def import_users(self, users, hash_alg=None):
         """Imports the given list of users to Firebase Auth."""
         try:
@@ -620,6 +779,43 @@ class UserManager(object):
                 raise ApiCallError(USER_IMPORT_ERROR, 'Failed to import users.')
             return response
 
+    def import_users_stream(self, users, hash_alg=None, concurrency=DEFAULT_CONCURRENCY):
+        """Imports the users produced by the given iterable to Firebase Auth.
+
+        The iterable is consumed lazily, in batches of ``MAX_IMPORT_USERS_SIZE`` users, and at
+        most ``concurrency`` batches are in flight at any given time. Returns the merged response
+        of all batches, with the error indices mapped back to positions in the iterable, along
+        with the total number of users.
+        """
+        concurrency = _auth_utils.validate_int(concurrency, 'concurrency', low=1)
+        try:
+            users = iter(users)
+        except TypeError:
+            raise ValueError('users must be iterable')
+
+        def batches():
+            offset = 0
+            while True:
+                batch = list(itertools.islice(users, MAX_IMPORT_USERS_SIZE))
+                if not batch:
+                    return
+                yield offset, batch
+                offset += len(batch)
+
+        def send(offset_and_batch):
+            offset, batch = offset_and_batch
+            errors = self.import_users(batch, hash_alg).get('error', [])
+            for error in errors:
+                error['index'] += offset
+            return len(batch), errors
+
+        total = 0
+        errors = []
+        for count, batch_errors in _concurrency.map_ordered(send, batches(), concurrency):
+            total += count
+            errors.extend(batch_errors)
+        return {'error': errors}, total
+
     def generate_email_action_link(self, action_type, email, action_code_settings=None):
         """Fetches the email action links for types
 
@@ -667,29 +863,67 @@ class _UserIterator(object):
     """An iterator that allows iterating over user accounts, one at a time.
 
     This implementation loads a page of users into memory, and iterates on them. When the whole
-    page has been traversed, it loads another page. This class never keeps more than one page
-    of entries in memory.
+    page has been traversed, it loads another page. Unless prefetching is enabled, this class
+    never keeps more than one page of entries in memory. The user records of each page are
+    created once, when the iterator reaches the page.
+
+    With prefetching, each upcoming page is requested on its own background thread, which waits
+    for the page before it to obtain its page token. At most ``prefetch`` such requests are
+    pending at any given time.
     """
 
-    def __init__(self, current_page):
+    def __init__(self, current_page, prefetch=0):
         if not current_page:
             raise ValueError('Current page must not be None.')
         self._current_page = current_page
+        self._records = current_page._get_records() # pylint: disable=protected-access
         self._index = 0
+        self._prefetch = prefetch
+        self._pending = collections.deque()
+        self._schedule_pages()
 
     def next(self):
-        if self._index == len(self._current_page.users):
-            if self._current_page.has_next_page:
-                self._current_page = self._current_page.get_next_page()
-                self._index = 0
-        if self._index < len(self._current_page.users):
-            result = self._current_page.users[self._index]
-            self._index += 1
-            return result
-        raise StopIteration
+        while self._index == len(self._records):
+            page = self._get_next_page()
+            if page is None:
+                raise StopIteration
+            self._current_page = page
+            self._records = page._get_records() # pylint: disable=protected-access
+            self._index = 0
+            self._schedule_pages()
+        result = self._records[self._index]
+        self._index += 1
+        return result
 
     def __next__(self):
         return self.next()
 
     def __iter__(self):
         return self
+
+    def _get_next_page(self):
+        if self._pending:
+            return self._pending.popleft().result()
+        return self._current_page.get_next_page()
+
+    def _schedule_pages(self):
+        while len(self._pending) < self._prefetch:
+            if self._pending:
+                last = self._pending[-1]
+                if last.done() and last.exception() is None and not _has_next_page(last.result()):
+                    return
+                future = _concurrency.run_in_background(_get_page_after, last)
+            else:
+                if not self._current_page.has_next_page:
+                    return
+                future = _concurrency.run_in_background(self._current_page.get_next_page)
+            self._pending.append(future)
+
+
+def _has_next_page(page):
+    return page is not None and page.has_next_page
+
+
+def _get_page_after(future):
+    page = future.result()
+    return page.get_next_page() if page is not None else None
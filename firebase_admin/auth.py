@@ -24,6 +24,7 @@ import time
 import firebase_admin
 from firebase_admin import _http_client
 from firebase_admin import _token_gen
+from firebase_admin import _user_identifier
 from firebase_admin import _user_import
 from firebase_admin import _user_mgt
 from firebase_admin import _utils
@@ -37,10 +38,16 @@ _SESSION_COOKIE_REVOKED = 'SESSION_COOKIE_REVOKED'
 __all__ = [
     'ActionCodeSettings',
     'AuthError',
+    'DeleteUsersResult',
+    'EmailIdentifier',
     'ErrorInfo',
     'ExportedUserRecord',
+    'GetUsersResult',
     'ImportUserRecord',
     'ListUsersPage',
+    'PhoneIdentifier',
+    'UidIdentifier',
+    'UserIdentifier',
     'UserImportHash',
     'UserImportResult',
     'UserInfo',
@@ -52,13 +59,16 @@ __all__ = [
     'create_session_cookie',
     'create_user',
     'delete_user',
+    'delete_users',
     'generate_email_verification_link',
     'generate_password_reset_link',
     'generate_sign_in_with_email_link',
     'get_user',
     'get_user_by_email',
     'get_user_by_phone_number',
+    'get_users',
     'import_users',
+    'import_users_stream',
     'list_users',
     'revoke_refresh_tokens',
     'set_custom_user_claims',
@@ -68,9 +78,15 @@ __all__ = [
 ]
 
 ActionCodeSettings = _user_mgt.ActionCodeSettings
+DeleteUsersResult = _user_mgt.DeleteUsersResult
+EmailIdentifier = _user_identifier.EmailIdentifier
 ErrorInfo = _user_import.ErrorInfo
 ExportedUserRecord = _user_mgt.ExportedUserRecord
+GetUsersResult = _user_mgt.GetUsersResult
 ListUsersPage = _user_mgt.ListUsersPage
+PhoneIdentifier = _user_identifier.PhoneIdentifier
+UidIdentifier = _user_identifier.UidIdentifier
+UserIdentifier = _user_identifier.UserIdentifier
 UserImportHash = _user_import.UserImportHash
 ImportUserRecord = _user_import.ImportUserRecord
 UserImportResult = _user_import.UserImportResult
@@ -281,6 +297,34 @@ def get_user_by_phone_number(phone_number, app=None):
     except _user_mgt.ApiCallError as error:
         raise AuthError(error.code, str(error), error.detail)
 
+def get_users(identifiers, concurrency=_user_mgt.DEFAULT_CONCURRENCY, app=None):
+    """Gets the user data corresponding to the specified identifiers.
+
+    Identifiers of different types (``UidIdentifier``, ``EmailIdentifier`` and
+    ``PhoneIdentifier``) can be mixed in a single call. They are looked up in batches of up to 100
+    identifiers per request, and multiple batches are sent in parallel. Identifiers that do not
+    match any user are reported via ``GetUsersResult.not_found`` instead of raising an error.
+
+    Args:
+        identifiers: A list of ``UserIdentifier`` instances.
+        concurrency: Maximum number of lookup requests in flight at any given time (optional).
+        app: An App instance (optional).
+
+    Returns:
+        GetUsersResult: A GetUsersResult instance. Each user that was found is included only once,
+        even if more than one of the identifiers matched the user.
+
+    Raises:
+        ValueError: If the identifiers or concurrency are invalid.
+        AuthError: If an error occurs while retrieving the users.
+    """
+    user_manager = _get_auth_service(app).user_manager
+    try:
+        users = user_manager.get_users(identifiers, concurrency)
+        return GetUsersResult(identifiers, users)
+    except _user_mgt.ApiCallError as error:
+        raise AuthError(error.code, str(error), error.detail)
+
 def list_users(page_token=None, max_results=_user_mgt.MAX_LIST_USERS_RESULTS, app=None):
     """Retrieves a page of user accounts from a Firebase project.
 
@@ -424,13 +468,49 @@ def delete_user(uid, app=None):
     except _user_mgt.ApiCallError as error:
         raise AuthError(error.code, str(error), error.detail)
 
+def delete_users(uids, force=True, concurrency=_user_mgt.DEFAULT_CONCURRENCY, max_rate=None,
+                 app=None):
+    """Deletes the users identified by the specified user IDs.
+
+    User IDs are deleted in batches of up to 1000 per request, and multiple batches are sent in
+    parallel. The failure to delete an individual user does not stop the operation, and is
+    instead reported in the returned ``DeleteUsersResult``. Deleting a user ID that does not exist
+    is considered a success.
+
+    Args:
+        uids: A list of user ID strings.
+        force: A boolean indicating whether to delete users that are not disabled (optional).
+            Defaults to ``True``. When ``False``, only disabled user accounts are deleted, and an
+            error is reported for each user that is still enabled.
+        concurrency: Maximum number of delete requests in flight at any given time (optional).
+        max_rate: Maximum number of delete requests started per second (optional). Requests are
+            spaced out evenly to stay under this rate. By default, only ``concurrency`` limits
+            the rate at which requests are sent to the backend.
+        app: An App instance (optional).
+
+    Returns:
+        DeleteUsersResult: An object summarizing the result of the delete operation. The
+        ``index`` of each error refers to a position in ``uids``.
+
+    Raises:
+        ValueError: If any of the arguments are invalid.
+        AuthError: If an error occurs while deleting a batch of users.
+    """
+    user_manager = _get_auth_service(app).user_manager
+    try:
+        result = user_manager.delete_users(uids, force, concurrency, max_rate)
+        return DeleteUsersResult(result, len(uids))
+    except _user_mgt.ApiCallError as error:
+        raise AuthError(error.code, str(error), error.detail)
+
 def import_users(users, hash_alg=None, app=None):
     """Imports the specified list of users into Firebase Auth.
 
     At most 1000 users can be imported at a time. This operation is optimized for bulk imports and
     will ignore checks on identifier uniqueness which could result in duplications. The
     ``hash_alg`` parameter must be specified when importing users with passwords. Refer to the
-    ``UserImportHash`` class for supported hash algorithms.
+    ``UserImportHash`` class for supported hash algorithms. Use ``import_users_stream()`` to import
+    larger numbers of users.
 
     Args:
         users: A list of ``ImportUserRecord`` instances to import. Length of the list must not
@@ -453,6 +533,41 @@ def import_users(users, hash_alg=None, app=None):
     except _user_mgt.ApiCallError as error:
         raise AuthError(error.code, str(error), error.detail)
 
+def import_users_stream(users, hash_alg=None, concurrency=_user_mgt.DEFAULT_CONCURRENCY,
+                        app=None):
+    """Imports the users produced by the specified iterable into Firebase Auth.
+
+    Unlike ``import_users()``, this accepts any number of users. The iterable (e.g. a generator) is
+    consumed lazily, in batches of 1000 users, and multiple batches are imported in parallel.
+    Hence only a bounded number of ``ImportUserRecord`` instances need to be held in memory at
+    any given time. The results of all batches are merged into a single ``UserImportResult``.
+
+    Batches are imported as they are produced. If a batch contains invalid users, or fails to be
+    imported, an exception is raised when the import reaches that batch, and the earlier batches
+    remain imported.
+
+    Args:
+        users: An iterable of ``ImportUserRecord`` instances to import.
+        hash_alg: A ``UserImportHash`` object (optional). Required when importing users with
+            passwords.
+        concurrency: Maximum number of import requests in flight at any given time (optional).
+        app: An App instance (optional).
+
+    Returns:
+        UserImportResult: An object summarizing the result of the import operation. The ``index``
+        of each error refers to the position of the user in ``users``.
+
+    Raises:
+        ValueError: If the provided arguments are invalid.
+        AuthError: If an error occurs while importing users.
+    """
+    user_manager = _get_auth_service(app).user_manager
+    try:
+        result, total = user_manager.import_users_stream(users, hash_alg, concurrency)
+        return UserImportResult(result, total)
+    except _user_mgt.ApiCallError as error:
+        raise AuthError(error.code, str(error), error.detail)
+
 def generate_password_reset_link(email, action_code_settings=None, app=None):
     """Generates the out-of-band email action link for password reset flows for the specified email
     address.
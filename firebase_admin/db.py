@@ -20,27 +20,38 @@ limit queries and range queries. However, it does not support realtime update no
 module uses the Firebase REST API underneath.
 """
 
-import collections
 import json
-import sys
-import threading
+import time
 
 import requests
 import six
-from six.moves import urllib
 
-import firebase_admin
-from firebase_admin import _http_client
+from firebase_admin import _concurrency
+from firebase_admin import _db_batch
+from firebase_admin import _db_bulk
+from firebase_admin import _db_client
+from firebase_admin import _db_listeners
+from firebase_admin import _db_mirror
+from firebase_admin import _db_query
+from firebase_admin import _db_transaction
+from firebase_admin import _db_utils
 from firebase_admin import _sseclient
 from firebase_admin import _utils
 
 
-_DB_ATTRIBUTE = '_database'
-_INVALID_PATH_CHARACTERS = '[].?#$'
-_RESERVED_FILTERS = ('$key', '$value', '$priority')
-_USER_AGENT = 'Firebase/HTTP/{0}/{1}.{2}/AdminPython'.format(
-    firebase_admin.__version__, sys.version_info.major, sys.version_info.minor)
-_TRANSACTION_MAX_RETRIES = 25
+# Matches the default connection pool size of the underlying HTTP session.
+_DEFAULT_CONCURRENCY = 10
+
+
+ApiCallError = _db_utils.ApiCallError
+Event = _db_listeners.Event
+ListenerRegistration = _db_listeners.ListenerRegistration
+ListenerStats = _db_listeners.ListenerStats
+Mirror = _db_mirror.Mirror
+Query = _db_query.Query
+TransactionError = _db_transaction.TransactionError
+TransactionStats = _db_transaction.TransactionStats
+WriteBatcher = _db_batch.WriteBatcher
 
 
 def reference(path='/', app=None, url=None):
@@ -63,75 +74,232 @@ def reference(path='/', app=None, url=None):
     Raises:
       ValueError: If the specified path or app is invalid.
     """
-    service = _utils.get_app_service(app, _DB_ATTRIBUTE, _DatabaseService)
+    service = _utils.get_app_service(app, _db_client.DB_ATTRIBUTE, _db_client.DatabaseService)
     client = service.get_client(url)
     return Reference(client=client, path=path)
 
-def _parse_path(path):
-    """Parses a path string into a set of segments."""
-    if not isinstance(path, six.string_types):
-        raise ValueError('Invalid path: "{0}". Path must be a string.'.format(path))
-    if any(ch in path for ch in _INVALID_PATH_CHARACTERS):
-        raise ValueError(
-            'Invalid path: "{0}". Path contains illegal characters.'.format(path))
-    return [seg for seg in path.split('/') if seg]
+def export_subtree(ref, sink, concurrency=_DEFAULT_CONCURRENCY):
+    """Exports the data at the given database location as newline-delimited JSON (NDJSON).
 
+    Rather than reading the whole location with a single request, this function first discovers
+    the keys of the immediate child nodes with a shallow read, and then fetches the child nodes
+    concurrently. Each child is written to the sink as soon as it becomes available, in key order,
+    so that at most ``concurrency`` child nodes are held in memory at a time. This makes it
+    possible to export locations that are too large to be read in one piece.
 
-class Event(object):
-    """Represents a realtime update event received from the database."""
+    Each line of the output is a JSON object of the form ``{"path": <path>, "value": <value>}``,
+    where ``path`` is the absolute database path of a child node. If the location has no child
+    nodes (i.e. it contains a primitive value), a single line for the location itself is written.
+    Nothing is written if the location is empty.
 
-    def __init__(self, sse_event):
-        self._sse_event = sse_event
-        self._data = json.loads(sse_event.data)
+    Args:
+      ref: A ``db.Reference`` pointing to the location to be exported.
+      sink: A file-like object opened in text mode, or a callable that accepts each line of the
+          output as a string (without the trailing newline).
+      concurrency: Maximum number of child nodes to fetch in parallel (optional).
 
-    @property
-    def data(self):
-        """Parsed JSON data of this event."""
-        return self._data['data']
+    Returns:
+      int: The number of lines written to the sink.
 
-    @property
-    def path(self):
-        """Path of the database reference that triggered this event."""
-        return self._data['path']
+    Raises:
+      ValueError: If any of the arguments are invalid.
+      ApiCallError: If an error occurs while communicating with the remote database server.
+    """
+    if not isinstance(ref, Reference):
+        raise ValueError('Invalid reference argument: "{0}". Reference must be a db.Reference '
+                         'instance.'.format(ref))
+    if hasattr(sink, 'write'):
+        write = lambda line: sink.write(line + '\n')
+    elif callable(sink):
+        write = sink
+    else:
+        raise ValueError('Invalid sink argument: "{0}". Sink must be a file-like object or a '
+                         'callable.'.format(sink))
+    if not isinstance(concurrency, six.integer_types) or isinstance(concurrency, bool) or \
+            concurrency < 1:
+        raise ValueError('Concurrency must be a positive integer.')
+
+    shallow = ref.get(shallow=True)
+    if isinstance(shallow, dict):
+        children = [ref.child(key) for key in sorted(shallow, key=_db_utils.get_key_order)]
+        records = _concurrency.map_ordered(
+            lambda child: (child.path, child.get()), children, concurrency)
+    elif shallow is not None:
+        # Shallow reads return primitive values as is.
+        records = [(ref.path, shallow)]
+    else:
+        records = []
+
+    count = 0
+    for path, value in records:
+        # Children deleted since the shallow read are skipped.
+        if value is not None:
+            write(json.dumps({'path': path, 'value': value}, separators=(',', ':')))
+            count += 1
+    return count
+
+def get_many(refs, concurrency=_DEFAULT_CONCURRENCY):
+    """Reads the values at multiple database locations concurrently.
+
+    Each location is read with a separate request, as in ``Reference.get()`` or ``Query.get()``,
+    and at most ``concurrency`` requests are in progress at a time. Each request is subject to the
+    ``httpTimeout`` option of the app the location belongs to.
 
-    @property
-    def event_type(self):
-        """Event type string (put, patch)."""
-        return self._sse_event.event_type
+    Args:
+      refs: A list of ``db.Reference`` or ``db.Query`` instances.
+      concurrency: Maximum number of requests to send in parallel (optional).
 
+    Returns:
+      list: A list with one entry per reference, in the same order as ``refs``. Each entry is
+      either the value at the corresponding location, or the ``ApiCallError`` raised while
+      reading it.
 
-class ListenerRegistration(object):
-    """Represents the addition of an event listener to a database reference."""
+    Raises:
+      ValueError: If any of the arguments are invalid.
+    """
+    if not isinstance(refs, (list, tuple)):
+        raise ValueError('Invalid refs argument: "{0}". Refs must be a list.'.format(refs))
+    for ref in refs:
+        if not isinstance(ref, (Reference, Query)):
+            raise ValueError('Invalid reference: "{0}". Each reference must be a db.Reference '
+                             'or a db.Query instance.'.format(ref))
+    if not isinstance(concurrency, six.integer_types) or isinstance(concurrency, bool) or \
+            concurrency < 1:
+        raise ValueError('Concurrency must be a positive integer.')
+
+    def get(ref):
+        try:
+            return ref.get()
+        except ApiCallError as error:
+            return error
 
-    def __init__(self, callback, sse):
-        """Initializes a new listener with given parameters.
+    return list(_concurrency.map_ordered(get, refs, concurrency))
 
-        This is an internal API. Use the ``db.Reference.listen()`` method to start a
-        new listener.
+def get_large(ref, size_hint=None, concurrency=_DEFAULT_CONCURRENCY):
+    """Reads the value at a database location that may be too large for a single request.
 
-        Args:
-          callback: The callback function to fire in case of event.
-          sse: A transport session to make requests with.
-        """
-        self._callback = callback
-        self._sse = sse
-        self._thread = threading.Thread(target=self._start_listen)
-        self._thread.start()
-
-    def _start_listen(self):
-        # iterate the sse client's generator
-        for sse_event in self._sse:
-            # only inject data events
-            if sse_event:
-                self._callback(Event(sse_event))
-
-    def close(self):
-        """Stops the event listener represented by this registration
-
-        This closes the SSE HTTP connection, and joins the background thread.
-        """
-        self._sse.close()
-        self._thread.join()
+    First attempts to read the whole location, as in ``Reference.get()``. If the server refuses
+    the read because the requested data exceeds its maximum size, or the request times out, the
+    keys of the immediate child nodes are discovered with a shallow read, and the child nodes
+    are read concurrently instead. Child nodes that are too large themselves are split up in
+    the same way. The values of the child nodes are then put back together, so that the result
+    is the same as if the location had been read in one piece.
+
+    If the approximate size of the value is known in advance, it can be passed as ``size_hint``.
+    Locations estimated to be larger than 64 MB are split up without attempting to read them in
+    one piece first, and the estimate is divided evenly among their child nodes.
+
+    The child nodes are read from the current state of the database. Hence, unlike
+    ``Reference.get()``, the result is not an atomic snapshot of the location if it is modified
+    while being read.
+
+    Args:
+      ref: A ``db.Reference`` pointing to the location to be read.
+      size_hint: Estimated size of the value in bytes (optional).
+      concurrency: Maximum number of requests to send in parallel (optional).
+
+    Returns:
+      object: The decoded JSON value of the location.
+
+    Raises:
+      ValueError: If any of the arguments are invalid.
+      ApiCallError: If an error occurs while communicating with the remote database server.
+    """
+    if not isinstance(ref, Reference):
+        raise ValueError('Invalid reference argument: "{0}". Reference must be a db.Reference '
+                         'instance.'.format(ref))
+    if size_hint is not None and (not isinstance(size_hint, six.integer_types) or
+                                  isinstance(size_hint, bool) or size_hint < 0):
+        raise ValueError('Size hint must be a non-negative integer.')
+    if not isinstance(concurrency, six.integer_types) or isinstance(concurrency, bool) or \
+            concurrency < 1:
+        raise ValueError('Concurrency must be a positive integer.')
+    return _db_bulk.LargeReader(concurrency).read(ref, size_hint)
+
+def bulk_load(ref, source, max_payload_bytes=_db_client.BULK_LOAD_MAX_PAYLOAD_BYTES,
+              concurrency=_DEFAULT_CONCURRENCY):
+    """Writes a large number of values under the given database location.
+
+    Consumes the source lazily, and packs the values into multi-location updates (as in
+    ``Reference.update()``) that each stay under ``max_payload_bytes``. Values that are too large
+    to fit into a single request on their own are split up by their child nodes. The updates
+    are sent concurrently, and each update is retried a few times if it fails due to a network
+    error or a transient server error.
+
+    A value that is split up is merged into the existing data at its path, rather than replacing
+    it: children that exist in the database but not in the value are left in place. Delete the
+    path beforehand to replace it outright.
+
+    The source may be a file-like object containing newline-delimited JSON in the format
+    produced by ``export_subtree()``, or an iterable of ``(path, value)`` tuples (e.g. the
+    ``items()`` of a dictionary). In either case paths are interpreted relative to ``ref``, and
+    must not be nested within each other. Loading is not atomic. If an error is raised, some of
+    the values may have been written to the database already.
+
+    Args:
+      ref: A ``db.Reference`` pointing to the location to write to.
+      source: A file-like object opened in text mode, or an iterable of ``(path, value)`` tuples.
+      max_payload_bytes: Maximum size of the JSON payload of a single request (optional).
+      concurrency: Maximum number of requests to send in parallel (optional).
+
+    Returns:
+      int: The number of values read from the source.
+
+    Raises:
+      ValueError: If any of the arguments, or any of the records read from the source are invalid.
+      ApiCallError: If an error occurs while communicating with the remote database server.
+    """
+    if not isinstance(ref, Reference):
+        raise ValueError('Invalid reference argument: "{0}". Reference must be a db.Reference '
+                         'instance.'.format(ref))
+    if hasattr(source, 'read'):
+        records = (_db_bulk.parse_ndjson_record(line) for line in source if line.strip())
+    elif hasattr(source, '__iter__') and not isinstance(source, (six.string_types, dict)):
+        records = source
+    else:
+        raise ValueError('Invalid source argument: "{0}". Source must be a file-like object or '
+                         'an iterable of (path, value) tuples.'.format(source))
+    for name, arg in (('Max payload bytes', max_payload_bytes), ('Concurrency', concurrency)):
+        if not isinstance(arg, six.integer_types) or isinstance(arg, bool) or arg < 1:
+            raise ValueError('{0} must be a positive integer.'.format(name))
+
+    def send(batch):
+        entries, record_count = batch
+        ref._patch_entries(entries) # pylint: disable=protected-access
+        return record_count
+
+    batches = _db_bulk.bulk_load_batches(records, max_payload_bytes)
+    return sum(_concurrency.map_ordered(send, batches, concurrency))
+
+def get_listener_stats(app=None):
+    """Returns statistics about the dispatch of realtime listener callbacks in the given app.
+
+    Listener callbacks are dispatched to a pool of worker threads when the
+    ``databaseListenerDispatchThreads`` or ``databaseListenerThreads`` option is set at app
+    initialization. Each worker has a queue of up to ``databaseListenerQueueSize`` pending events
+    (1000 by default). The ``databaseListenerOverflow`` option determines what happens when an
+    event arrives for a worker whose queue is full:
+
+    - ``block`` (default): Reading the event stream pauses until the queue has room. If the
+      ``databaseListenerThreads`` option is set, the event streams of all listeners are read by a
+      shared I/O thread, so a single slow callback then pauses every listener of the app.
+    - ``drop_oldest``: The oldest event in the queue is discarded.
+    - ``coalesce``: If the new event is a ``put``, queued events of the same listener at the same
+      path are discarded, since the new event overwrites them. Otherwise reading pauses as with
+      ``block``.
+
+    Args:
+      app: An App instance (optional).
+
+    Returns:
+      ListenerStats: The current statistics, or None if listener callbacks are not dispatched to
+      a pool of worker threads.
+
+    Raises:
+      ValueError: If the specified app is invalid.
+    """
+    service = _utils.get_app_service(app, _db_client.DB_ATTRIBUTE, _db_client.DatabaseService)
+    return service.get_listener_stats()
 
 
 class Reference(object):
@@ -147,7 +315,7 @@ class Reference(object):
         if 'segments' in kwargs:
             self._segments = kwargs.get('segments')
         else:
-            self._segments = _parse_path(kwargs.get('path'))
+            self._segments = _db_utils.parse_path(kwargs.get('path'))
         self._pathurl = '/' + '/'.join(self._segments)
 
     @property
@@ -181,16 +349,10 @@ class Reference(object):
         Raises:
           ValueError: If the child path is not a string, not well-formed or begins with '/'.
         """
-        if not path or not isinstance(path, six.string_types):
-            raise ValueError(
-                'Invalid path argument: "{0}". Path must be a non-empty string.'.format(path))
-        if path.startswith('/'):
-            raise ValueError(
-                'Invalid path argument: "{0}". Child path must not start with "/"'.format(path))
-        full_path = self._pathurl + '/' + path
-        return Reference(client=self._client, path=full_path)
-
-    def get(self, etag=False, shallow=False):
+        _db_utils.validate_child_path(path)
+        return Reference(client=self._client, segments=self._segments + _db_utils.parse_path(path))
+
+    def get(self, etag=False, shallow=False, server_timeout=None):
         """Returns the value, and optionally the ETag, at the current location of the database.
 
         Args:
@@ -198,6 +360,16 @@ class Reference(object):
           shallow: A boolean indicating whether to execute a shallow read (optional). Shallow
               reads do not retrieve the child nodes of the current database location. Cannot be
               set to True if ``etag`` is also set to True.
+          server_timeout: Maximum number of seconds the server may spend on the read, up to 900
+              (optional). Reads that take longer fail with an error. Defaults to the
+              ``databaseServerTimeout`` option of the app.
+
+        If the ``databaseCacheMaxBytes`` option was set at app initialization, non-shallow reads
+        are served from an in-memory cache of recently read values. Values in the cache are
+        revalidated with the server using their ETags, once they are older than the
+        ``databaseCacheMaxAge`` option (in seconds, defaults to 0). If the value has not changed,
+        the server does not send it again. Values returned from the cache are shared between
+        callers, and must not be modified.
 
         Returns:
           object: If etag is False returns the decoded JSON value of the current database location.
@@ -205,18 +377,26 @@ class Reference(object):
           associated with the current database location.
 
         Raises:
-          ValueError: If both ``etag`` and ``shallow`` are set to True.
+          ValueError: If both ``etag`` and ``shallow`` are set to True, or if the server timeout
+              is invalid.
           ApiCallError: If an error occurs while communicating with the remote database server.
         """
+        if etag and shallow:
+            raise ValueError('etag and shallow cannot both be set to True.')
+        _db_client.validate_server_timeout(server_timeout)
+        if self._client.read_cache is not None and not shallow:
+            data, etag_value = self._client.read_cache.get(
+                self._client, self._add_suffix(), server_timeout=server_timeout)
+            return (data, etag_value) if etag else data
         if etag:
-            if shallow:
-                raise ValueError('etag and shallow cannot both be set to True.')
             headers, data = self._client.headers_and_body(
-                'get', self._add_suffix(), headers={'X-Firebase-ETag' : 'true'})
+                'get', self._add_suffix(), headers={'X-Firebase-ETag' : 'true'},
+                server_timeout=server_timeout)
             return data, headers.get('ETag')
         else:
             params = 'shallow=true' if shallow else None
-            return self._client.body('get', self._add_suffix(), params=params)
+            return self._client.body(
+                'get', self._add_suffix(), params=params, server_timeout=server_timeout)
 
     def get_if_changed(self, etag):
         """Gets data in this location only if the specified ETag does not match.
@@ -244,22 +424,121 @@ class Reference(object):
         else:
             return True, resp.json(), resp.headers.get('ETag')
 
-    def set(self, value):
+    def iterate_children(self, page_size=1000, prefetch=False):
+        """Iterates over the child nodes of this location, fetching them one page at a time.
+
+        Child nodes are retrieved in key order, using a series of ``order_by_key()`` queries that
+        each fetch at most ``page_size`` children. Therefore, unlike ``get()``, this can be used to
+        walk through locations that are too large to be held in memory at once. Pages are read
+        from the current state of the database as the iteration progresses. Children added or
+        removed during the iteration may or may not be reported.
+
+        Args:
+          page_size: Maximum number of child nodes to fetch per request (optional).
+          prefetch: A boolean indicating whether to fetch the next page on a background thread,
+              while the caller processes the current page (optional). At most two pages are held
+              in memory at any given time.
+
+        Returns:
+          generator: A generator that yields a ``(key, value)`` tuple for each child node.
+
+        Raises:
+          ValueError: If the page size is not a positive integer.
+          ApiCallError: If an error occurs while communicating with the remote database server.
+        """
+        if not isinstance(page_size, six.integer_types) or isinstance(page_size, bool) or \
+                page_size < 1:
+            raise ValueError('Page size must be a positive integer.')
+        return self._iterate_children(page_size, prefetch)
+
+    def _iterate_children(self, page_size, prefetch):
+        # Every page after the first starts at the last key of the previous page (start_at() is
+        # inclusive). Hence fetch one extra child to make up for the duplicate.
+        fetch_size = page_size
+        page = self._get_children_page(None, fetch_size)
+        while True:
+            items, has_more = page
+            next_page = None
+            if has_more:
+                fetch_size = page_size + 1
+                if prefetch:
+                    next_page = _concurrency.run_in_background(
+                        self._get_children_page, items[-1][0], fetch_size)
+            for item in items:
+                yield item
+            if not has_more:
+                return
+            if next_page is not None:
+                page = next_page.result()
+            else:
+                page = self._get_children_page(items[-1][0], fetch_size)
+            if not page[0]:
+                return
+
+    def _get_children_page(self, start_key, limit):
+        query = self.order_by_key().limit_to_first(limit)
+        if start_key is not None:
+            query.start_at(start_key)
+        result = self._client.body(
+            'get', self._add_suffix(), params=query._querystr) # pylint: disable=protected-access
+        if isinstance(result, list):
+            result = {str(idx): val for idx, val in enumerate(result) if val is not None}
+        elif not isinstance(result, dict):
+            result = {}
+        has_more = len(result) >= limit
+        items = sorted(result.items(), key=lambda item: _db_utils.get_key_order(item[0]))
+        if start_key is not None and items and items[0][0] == start_key:
+            items = items[1:]
+        return items, has_more
+
+    def stream_children(self, server_timeout=None):
+        """Streams the child nodes of this location, parsing them as they are received.
+
+        Unlike ``get()``, this does not hold the whole response in memory. The response is parsed
+        incrementally, and each child node is yielded as soon as it has been received in full.
+        Hence only one child node at a time needs to fit into memory, along with whatever the
+        caller retains. Child nodes are yielded in the order the server sends them, which is not
+        specified. The read is not served from the cache enabled by the ``databaseCacheMaxBytes``
+        option.
+
+        Args:
+          server_timeout: Maximum number of seconds the server may spend on the read, up to 900
+              (optional). Defaults to the ``databaseServerTimeout`` option of the app.
+
+        Returns:
+          generator: A generator that yields a ``(key, value)`` tuple for each child node. Yields
+          nothing if this location is empty, or contains a primitive value.
+
+        Raises:
+          ValueError: If the server timeout is invalid.
+          ApiCallError: If an error occurs while communicating with the remote database server,
+              or while iterating over the results.
+        """
+        _db_client.validate_server_timeout(server_timeout)
+        return _db_query.stream_children(self._client, self._add_suffix(), None, server_timeout)
+
+    def set(self, value, write_size_limit=None):
         """Sets the data at this location to the given value.
 
         The value must be JSON-serializable and not None.
 
         Args:
           value: JSON-serializable value to be set at this location.
+          write_size_limit: The largest write the server should process, as one of ``tiny``,
+              ``small``, ``medium``, ``large`` or ``unlimited`` (optional). Writes estimated to be
+              larger are rejected. Defaults to the ``databaseWriteSizeLimit`` option of the app,
+              or the server default (``large``).
 
         Raises:
-          ValueError: If the provided value is None.
+          ValueError: If the provided value is None, or if the write size limit is invalid.
           TypeError: If the value is not JSON-serializable.
           ApiCallError: If an error occurs while communicating with the remote database server.
         """
         if value is None:
             raise ValueError('Value must not be None.')
-        self._client.request('put', self._add_suffix(), json=value, params='print=silent')
+        _db_client.validate_write_size_limit(write_size_limit)
+        self._client.request('put', self._add_suffix(), json=value, params='print=silent',
+                             write_size_limit=write_size_limit)
 
     def set_if_unchanged(self, expected_etag, value):
         """Conditonally sets the data at this location to the given value.
@@ -322,31 +601,52 @@ class Reference(object):
         push_id = output.get('name')
         return self.child(push_id)
 
-    def update(self, value):
+    def update(self, value, write_size_limit=None):
         """Updates the specified child keys of this Reference to the provided values.
 
         Args:
           value: A dictionary containing the child keys to update, and their new values.
+          write_size_limit: The largest write the server should process, as one of ``tiny``,
+              ``small``, ``medium``, ``large`` or ``unlimited`` (optional). Writes estimated to be
+              larger are rejected. Defaults to the ``databaseWriteSizeLimit`` option of the app,
+              or the server default (``large``).
 
         Raises:
-          ValueError: If value is empty or not a dictionary.
+          ValueError: If value is empty or not a dictionary, or if the write size limit is
+              invalid.
           ApiCallError: If an error occurs while communicating with the remote database server.
         """
         if not value or not isinstance(value, dict):
             raise ValueError('Value argument must be a non-empty dictionary.')
         if None in value.keys():
             raise ValueError('Dictionary must not contain None keys.')
-        self._client.request('patch', self._add_suffix(), json=value, params='print=silent')
+        _db_client.validate_write_size_limit(write_size_limit)
+        self._client.request('patch', self._add_suffix(), json=value, params='print=silent',
+                             write_size_limit=write_size_limit)
 
-    def delete(self):
+    def _patch_entries(self, entries):
+        self._client.patch_entries(self._add_suffix(), entries)
+
+    def delete(self, write_size_limit=None):
         """Deletes this node from the database.
 
+        Deleting a large node may be rejected by the server with the default write size limit.
+        Pass ``unlimited`` to delete it regardless of its size.
+
+        Args:
+          write_size_limit: The largest write the server should process, as one of ``tiny``,
+              ``small``, ``medium``, ``large`` or ``unlimited`` (optional). Writes estimated to be
+              larger are rejected. Defaults to the ``databaseWriteSizeLimit`` option of the app,
+              or the server default (``large``).
+
         Raises:
+          ValueError: If the write size limit is invalid.
           ApiCallError: If an error occurs while communicating with the remote database server.
         """
-        self._client.request('delete', self._add_suffix())
+        _db_client.validate_write_size_limit(write_size_limit)
+        self._client.request('delete', self._add_suffix(), write_size_limit=write_size_limit)
 
-    def listen(self, callback):
+    def listen(self, callback, resync=False):
         """Registers the ``callback`` function to receive realtime updates.
 
         The specified callback function will get invoked with ``db.Event`` objects for each
@@ -354,15 +654,34 @@ class Reference(object):
         reconnects to the server due to network issues and credential expiration. In general,
         the OAuth2 credentials used to authorize connections to the server expire every hour.
         Therefore clients should expect the ``callback`` to fire at least once every hour, even if
-        there are no updates in the database.
+        there are no updates in the database. The ``data`` of each event is decoded only when the
+        callback first accesses it, and callbacks that forward events unchanged can read the
+        undecoded ``raw_data`` bytes instead.
 
         This API is based on the event streaming support available in the Firebase REST API. Each
-        call to ``listen()`` starts a new HTTP connection and a background thread. This is an
-        experimental feature. It currently does not honor the auth overrides and timeout settings.
-        Cannot be used in thread-constrained environments like Google App Engine.
+        call to ``listen()`` starts a new HTTP connection and a background thread, which executes
+        the callback. If the ``databaseListenerDispatchThreads`` option was set at app
+        initialization, callbacks are instead executed on a fixed-size pool of worker threads, so
+        that a slow callback does not hold up reading the event stream. Each listener is always
+        served by the same worker, so that its callback receives events in order. Events wait for
+        a worker in a bounded queue, whose size and overflow policy can be configured with the
+        ``databaseListenerQueueSize`` and ``databaseListenerOverflow`` options (see
+        ``get_listener_stats()``). If the ``databaseListenerThreads`` option was set, all
+        listeners of the app share a single I/O thread, and callbacks are always executed on the
+        worker pool. Connections that cannot be read by the shared thread are read by a dedicated
+        thread each. This is an experimental feature. It currently does not honor the auth
+        overrides and timeout settings. Cannot be used in thread-constrained environments like
+        Google App Engine.
 
         Args:
           callback: A function to be called when a data change is detected.
+          resync: A boolean indicating whether to reduce the snapshots sent by the server after
+              each reconnect to the changes they contain (optional). When set, the callback
+              receives the first snapshot as a ``put`` event at ``/``. Each later snapshot is
+              compared with the last known state of the children of this location, and delivered
+              as a single ``patch`` event at ``/`` that sets the changed children and removes the
+              deleted ones (with a ``None`` value), or not at all if nothing has changed. Applying
+              the events received in order yields the same state either way.
 
         Returns:
           ListenerRegistration: An object that can be used to stop the event listener.
@@ -370,10 +689,34 @@ class Reference(object):
         Raises:
           ApiCallError: If an error occurs while starting the initial HTTP connection.
         """
+        if resync:
+            callback = _db_listeners.ResyncFilter(callback)
+        manager = self._client.listener_manager
+        if manager is not None:
+            return manager.listen(self._client.base_url + self._add_suffix(), callback)
         session = _sseclient.KeepAuthSession(self._client.credential)
         return self._listen_with_session(callback, session)
 
-    def transaction(self, transaction_update):
+    def mirror(self):
+        """Starts mirroring the subtree at this location into local memory.
+
+        The returned ``Mirror`` starts a realtime listener on this location (see ``listen()``), and
+        applies every update received from the database to an in-memory copy of the subtree. Reads
+        made through the ``Mirror`` (including reads of child nodes and queries) are then served
+        from memory without contacting the server. This is suitable for small, frequently read
+        nodes like configuration data. Call ``Mirror.close()`` to stop the underlying listener.
+
+        Returns:
+          Mirror: A Mirror instance representing this location.
+
+        Raises:
+          ApiCallError: If an error occurs while starting the realtime listener.
+        """
+        return Mirror(_db_mirror.MirrorStore(self), ())
+
+    def transaction(self, transaction_update, max_retries=_db_transaction.MAX_RETRIES,
+                    initial_backoff=_db_transaction.INITIAL_BACKOFF_SECONDS,
+                    max_backoff=_db_transaction.MAX_BACKOFF_SECONDS, timeout=None, stats=None):
         """Atomically modifies the data at this location.
 
         Unlike a normal ``set()``, which just overwrites the data regardless of its previous state,
@@ -383,10 +726,13 @@ class Reference(object):
         This is accomplished by passing an update function which is used to transform the current
         value of this reference into a new value. If another client writes to this location before
         the new value is successfully saved, the update function is called again with the new
-        current value, and the write will be retried. In case of repeated failures, this method
-        will retry the transaction up to 25 times before giving up and raising a TransactionError.
-        The update function may also force an early abort by raising an exception instead of
-        returning a value.
+        current value (as returned by the server along with the conflict), and the write will be
+        retried. Retries are spaced out using exponential backoff with random jitter, so that
+        clients contending for the same location do not retry in lockstep. In case of repeated
+        failures, this method will retry the transaction up to ``max_retries`` times (25 by
+        default), or for up to ``timeout`` seconds, before giving up and raising a
+        TransactionError. The update function may also force an early abort by raising an
+        exception instead of returning a value.
 
         Args:
           transaction_update: A function which will be passed the current data stored at this
@@ -394,26 +740,48 @@ class Reference(object):
               an exception is raised, the transaction will be aborted, and the data at this
               location will not be modified. The exceptions raised by this function are
               propagated to the caller of the transaction method.
+          max_retries: Maximum number of attempts to write the new value (optional).
+          initial_backoff: Upper bound of the random delay before the first retry, in seconds.
+              The bound doubles after each retry (optional).
+          max_backoff: Maximum upper bound of the random delay between retries, in seconds
+              (optional).
+          timeout: Maximum number of seconds to spend on the transaction, or None to only limit
+              the number of attempts (optional). The transaction is aborted instead of retried
+              if the next retry would start after the timeout.
+          stats: A ``db.TransactionStats`` instance, which will be populated with statistics
+              about the transaction, whether it commits or not (optional).
 
         Returns:
           object: New value of the current database Reference (only if the transaction commits).
 
         Raises:
-          TransactionError: If the transaction aborts after exhausting all retry attempts.
-          ValueError: If transaction_update is not a function.
+          TransactionError: If the transaction aborts after exhausting all retry attempts, or
+              after running out of time.
+          ValueError: If transaction_update is not a function, or if any of the other arguments
+              are invalid.
         """
-        if not callable(transaction_update):
-            raise ValueError('transaction_update must be a function.')
-
-        tries = 0
-        data, etag = self.get(etag=True)
-        while tries < _TRANSACTION_MAX_RETRIES:
-            new_data = transaction_update(data)
-            success, data, etag = self.set_if_unchanged(etag, new_data)
-            if success:
-                return new_data
-            tries += 1
-        raise TransactionError('Transaction aborted after failed retries.')
+        stats = _db_transaction.validate_args(
+            transaction_update, max_retries, initial_backoff, max_backoff, timeout, stats)
+        start = time.time()
+        backoff = initial_backoff
+        try:
+            data, etag = self.get(etag=True)
+            while True:
+                new_data = transaction_update(data)
+                stats.attempts += 1
+                # On a conflict, the server responds with the current value, which becomes the
+                # input to the next attempt.
+                success, data, etag = self.set_if_unchanged(etag, new_data)
+                if success:
+                    return new_data
+                stats.conflicts += 1
+                delay = _db_transaction.get_retry_delay(
+                    stats, start, backoff, max_retries, max_backoff, timeout)
+                time.sleep(delay)
+                stats.backoff_time += delay
+                backoff *= 2
+        finally:
+            stats.elapsed_time = time.time() - start
 
     def order_by_child(self, path):
         """Returns a Query that orders data by child values.
@@ -430,7 +798,7 @@ class Reference(object):
         Raises:
           ValueError: If the child path is not a string, not well-formed or None.
         """
-        if path in _RESERVED_FILTERS:
+        if path in _db_utils.RESERVED_FILTERS:
             raise ValueError('Illegal child path: {0}'.format(path))
         return Query(order_by=path, client=self._client, pathurl=self._add_suffix())
 
@@ -463,451 +831,6 @@ class Reference(object):
         url = self._client.base_url + self._add_suffix()
         try:
             sse = _sseclient.SSEClient(url, session)
-            return ListenerRegistration(callback, sse)
-        except requests.exceptions.RequestException as error:
-            raise ApiCallError(_Client.extract_error_message(error), error)
-
-
-class Query(object):
-    """Represents a complex query that can be executed on a Reference.
-
-    Complex queries can consist of up to 2 components: a required ordering constraint, and an
-    optional filtering constraint. At the server, data is first sorted according to the given
-    ordering constraint (e.g. order by child). Then the filtering constraint (e.g. limit, range)
-    is applied on the sorted data to produce the final result. Despite the ordering constraint,
-    the final result is returned by the server as an unordered collection. Therefore the Query
-    interface performs another round of sorting at the client-side before returning the results
-    to the caller. This client-side sorted results are returned to the user as a Python
-    OrderedDict.
-    """
-
-    def __init__(self, **kwargs):
-        order_by = kwargs.pop('order_by')
-        if not order_by or not isinstance(order_by, six.string_types):
-            raise ValueError('order_by field must be a non-empty string')
-        if order_by not in _RESERVED_FILTERS:
-            if order_by.startswith('/'):
-                raise ValueError('Invalid path argument: "{0}". Child path must not start '
-                                 'with "/"'.format(order_by))
-            segments = _parse_path(order_by)
-            order_by = '/'.join(segments)
-        self._client = kwargs.pop('client')
-        self._pathurl = kwargs.pop('pathurl')
-        self._order_by = order_by
-        self._params = {'orderBy' : json.dumps(order_by)}
-        if kwargs:
-            raise ValueError('Unexpected keyword arguments: {0}'.format(kwargs))
-
-    def limit_to_first(self, limit):
-        """Creates a query with limit, and anchors it to the start of the window.
-
-        Args:
-          limit: The maximum number of child nodes to return.
-
-        Returns:
-          Query: The updated Query instance.
-
-        Raises:
-          ValueError: If the value is not an integer, or set_limit_last() was called previously.
-        """
-        if not isinstance(limit, int) or limit < 0:
-            raise ValueError('Limit must be a non-negative integer.')
-        if 'limitToLast' in self._params:
-            raise ValueError('Cannot set both first and last limits.')
-        self._params['limitToFirst'] = limit
-        return self
-
-    def limit_to_last(self, limit):
-        """Creates a query with limit, and anchors it to the end of the window.
-
-        Args:
-          limit: The maximum number of child nodes to return.
-
-        Returns:
-          Query: The updated Query instance.
-
-        Raises:
-          ValueError: If the value is not an integer, or set_limit_first() was called previously.
-        """
-        if not isinstance(limit, int) or limit < 0:
-            raise ValueError('Limit must be a non-negative integer.')
-        if 'limitToFirst' in self._params:
-            raise ValueError('Cannot set both first and last limits.')
-        self._params['limitToLast'] = limit
-        return self
-
-    def start_at(self, start):
-        """Sets the lower bound for a range query.
-
-        The Query will only return child nodes with a value greater than or equal to the specified
-        value.
-
-        Args:
-          start: JSON-serializable value to start at, inclusive.
-
-        Returns:
-          Query: The updated Query instance.
-
-        Raises:
-          ValueError: If the value is ``None``.
-        """
-        if start is None:
-            raise ValueError('Start value must not be None.')
-        self._params['startAt'] = json.dumps(start)
-        return self
-
-    def end_at(self, end):
-        """Sets the upper bound for a range query.
-
-        The Query will only return child nodes with a value less than or equal to the specified
-        value.
-
-        Args:
-          end: JSON-serializable value to end at, inclusive.
-
-        Returns:
-          Query: The updated Query instance.
-
-        Raises:
-          ValueError: If the value is ``None``.
-        """
-        if end is None:
-            raise ValueError('End value must not be None.')
-        self._params['endAt'] = json.dumps(end)
-        return self
-
-    def equal_to(self, value):
-        """Sets an equals constraint on the Query.
-
-        The Query will only return child nodes whose value is equal to the specified value.
-
-        Args:
-          value: JSON-serializable value to query for.
-
-        Returns:
-          Query: The updated Query instance.
-
-        Raises:
-          ValueError: If the value is ``None``.
-        """
-        if value is None:
-            raise ValueError('Equal to value must not be None.')
-        self._params['equalTo'] = json.dumps(value)
-        return self
-
-    @property
-    def _querystr(self):
-        params = []
-        for key in sorted(self._params):
-            params.append('{0}={1}'.format(key, self._params[key]))
-        return '&'.join(params)
-
-    def get(self):
-        """Executes this Query and returns the results.
-
-        The results will be returned as a sorted list or an OrderedDict.
-
-        Returns:
-          object: Decoded JSON result of the Query.
-
-        Raises:
-          ApiCallError: If an error occurs while communicating with the remote database server.
-        """
-        result = self._client.body('get', self._pathurl, params=self._querystr)
-        if isinstance(result, (dict, list)) and self._order_by != '$priority':
-            return _Sorter(result, self._order_by).get()
-        return result
-
-
-class ApiCallError(Exception):
-    """Represents an Exception encountered while invoking the Firebase database server API."""
-
-    def __init__(self, message, error):
-        Exception.__init__(self, message)
-        self.detail = error
-
-
-class TransactionError(Exception):
-    """Represents an Exception encountered while performing a transaction."""
-
-    def __init__(self, message):
-        Exception.__init__(self, message)
-
-
-
-class _Sorter(object):
-    """Helper class for sorting query results."""
-
-    def __init__(self, results, order_by):
-        if isinstance(results, dict):
-            self.dict_input = True
-            entries = [_SortEntry(k, v, order_by) for k, v in results.items()]
-        elif isinstance(results, list):
-            self.dict_input = False
-            entries = [_SortEntry(k, v, order_by) for k, v in enumerate(results)]
-        else:
-            raise ValueError('Sorting not supported for "{0}" object.'.format(type(results)))
-        self.sort_entries = sorted(entries)
-
-    def get(self):
-        if self.dict_input:
-            return collections.OrderedDict([(e.key, e.value) for e in self.sort_entries])
-        else:
-            return [e.value for e in self.sort_entries]
-
-
-class _SortEntry(object):
-    """A wrapper that is capable of sorting items in a dictionary."""
-
-    _type_none = 0
-    _type_bool_false = 1
-    _type_bool_true = 2
-    _type_numeric = 3
-    _type_string = 4
-    _type_object = 5
-
-    def __init__(self, key, value, order_by):
-        self._key = key
-        self._value = value
-        if order_by == '$key' or order_by == '$priority':
-            self._index = key
-        elif order_by == '$value':
-            self._index = value
-        else:
-            self._index = _SortEntry._extract_child(value, order_by)
-        self._index_type = _SortEntry._get_index_type(self._index)
-
-    @property
-    def key(self):
-        return self._key
-
-    @property
-    def index(self):
-        return self._index
-
-    @property
-    def index_type(self):
-        return self._index_type
-
-    @property
-    def value(self):
-        return self._value
-
-    @classmethod
-    def _get_index_type(cls, index):
-        """Assigns an integer code to the type of the index.
-
-        The index type determines how differently typed values are sorted. This ordering is based
-        on https://firebase.google.com/docs/database/rest/retrieve-data#section-rest-ordered-data
-        """
-        if index is None:
-            return cls._type_none
-        elif isinstance(index, bool) and not index:
-            return cls._type_bool_false
-        elif isinstance(index, bool) and index:
-            return cls._type_bool_true
-        elif isinstance(index, (int, float)):
-            return cls._type_numeric
-        elif isinstance(index, six.string_types):
-            return cls._type_string
-        else:
-            return cls._type_object
-
-    @classmethod
-    def _extract_child(cls, value, path):
-        segments = path.split('/')
-        current = value
-        for segment in segments:
-            if isinstance(current, dict):
-                current = current.get(segment)
-            else:
-                return None
-        return current
-
-    def _compare(self, other):
-        """Compares two _SortEntry instances.
-
-        If the indices have the same numeric or string type, compare them directly. Ties are
-        broken by comparing the keys. If the indices have the same type, but are neither numeric
-        nor string, compare the keys. In all other cases compare based on the ordering provided
-        by index types.
-        """
-        self_key, other_key = self.index_type, other.index_type
-        if self_key == other_key:
-            if self_key in (self._type_numeric, self._type_string) and self.index != other.index:
-                self_key, other_key = self.index, other.index
-            else:
-                self_key, other_key = self.key, other.key
-
-        if self_key < other_key:
-            return -1
-        elif self_key > other_key:
-            return 1
-        else:
-            return 0
-
-    def __lt__(self, other):
-        return self._compare(other) < 0
-
-    def __le__(self, other):
-        return self._compare(other) <= 0
-
-    def __gt__(self, other):
-        return self._compare(other) > 0
-
-    def __ge__(self, other):
-        return self._compare(other) >= 0
-
-    def __eq__(self, other):
-        return self._compare(other) is 0
-
-
-class _DatabaseService(object):
-    """Service that maintains a collection of database clients."""
-
-    _DEFAULT_AUTH_OVERRIDE = '_admin_'
-
-    def __init__(self, app):
-        self._credential = app.credential.get_credential()
-        db_url = app.options.get('databaseURL')
-        if db_url:
-            self._db_url = _DatabaseService._validate_url(db_url)
-        else:
-            self._db_url = None
-        auth_override = _DatabaseService._get_auth_override(app)
-        if auth_override != self._DEFAULT_AUTH_OVERRIDE and auth_override != {}:
-            encoded = json.dumps(auth_override, separators=(',', ':'))
-            self._auth_override = 'auth_variable_override={0}'.format(encoded)
-        else:
-            self._auth_override = None
-        self._timeout = app.options.get('httpTimeout')
-        self._clients = {}
-
-    def get_client(self, base_url=None):
-        if base_url is None:
-            base_url = self._db_url
-        base_url = _DatabaseService._validate_url(base_url)
-        if base_url not in self._clients:
-            client = _Client(self._credential, base_url, self._auth_override, self._timeout)
-            self._clients[base_url] = client
-        return self._clients[base_url]
-
-    @classmethod
-    def _validate_url(cls, url):
-        """Parses and validates a given database URL."""
-        if not url or not isinstance(url, six.string_types):
-            raise ValueError(
-                'Invalid database URL: "{0}". Database URL must be a non-empty '
-                'URL string.'.format(url))
-        parsed = urllib.parse.urlparse(url)
-        if parsed.scheme != 'https':
-            raise ValueError(
-                'Invalid database URL: "{0}". Database URL must be an HTTPS URL.'.format(url))
-        elif not parsed.netloc.endswith('.firebaseio.com'):
-            raise ValueError(
-                'Invalid database URL: "{0}". Database URL must be a valid URL to a '
-                'Firebase Realtime Database instance.'.format(url))
-        return 'https://{0}'.format(parsed.netloc)
-
-    @classmethod
-    def _get_auth_override(cls, app):
-        auth_override = app.options.get('databaseAuthVariableOverride', cls._DEFAULT_AUTH_OVERRIDE)
-        if auth_override == cls._DEFAULT_AUTH_OVERRIDE or auth_override is None:
-            return auth_override
-        if not isinstance(auth_override, dict):
-            raise ValueError('Invalid databaseAuthVariableOverride option: "{0}". Override '
-                             'value must be a dict or None.'.format(auth_override))
-        else:
-            return auth_override
-
-    def close(self):
-        for value in self._clients.values():
-            value.close()
-        self._clients = {}
-
-
-class _Client(_http_client.JsonHttpClient):
-    """HTTP client used to make REST calls.
-
-    _Client maintains an HTTP session, and handles authenticating HTTP requests along with
-    marshalling and unmarshalling of JSON data.
-    """
-
-    def __init__(self, credential, base_url, auth_override, timeout):
-        """Creates a new _Client from the given parameters.
-
-        This exists primarily to enable testing. For regular use, obtain _Client instances by
-        calling the from_app() class method.
-
-        Args:
-          credential: A Google credential that can be used to authenticate requests.
-          base_url: A URL prefix to be added to all outgoing requests. This is typically the
-              Firebase Realtime Database URL.
-          auth_override: The encoded auth_variable_override query parameter to be included in
-              outgoing requests.
-          timeout: HTTP request timeout in seconds. If not set connections will never
-              timeout, which is the default behavior of the underlying requests library.
-        """
-        _http_client.JsonHttpClient.__init__(
-            self, credential=credential, base_url=base_url, headers={'User-Agent': _USER_AGENT})
-        self.credential = credential
-        self.auth_override = auth_override
-        self.timeout = timeout
-
-    def request(self, method, url, **kwargs):
-        """Makes an HTTP call using the Python requests library.
-
-        Extends the request() method of the parent JsonHttpClient class. Handles auth overrides,
-        and low-level exceptions.
-
-        Args:
-          method: HTTP method name as a string (e.g. get, post).
-          url: URL path of the remote endpoint. This will be appended to the server's base URL.
-          kwargs: An additional set of keyword arguments to be passed into requests API
-              (e.g. json, params).
-
-        Returns:
-          Response: An HTTP response object.
-
-        Raises:
-          ApiCallError: If an error occurs while making the HTTP call.
-        """
-        if self.auth_override:
-            params = kwargs.get('params')
-            if params:
-                params += '&{0}'.format(self.auth_override)
-            else:
-                params = self.auth_override
-            kwargs['params'] = params
-        if self.timeout:
-            kwargs['timeout'] = self.timeout
-        try:
-            return super(_Client, self).request(method, url, **kwargs)
+            return ListenerRegistration(callback, sse, self._client.listener_dispatcher)
         except requests.exceptions.RequestException as error:
-            raise ApiCallError(_Client.extract_error_message(error), error)
-
-    @classmethod
-    def extract_error_message(cls, error):
-        """Extracts an error message from an exception.
-
-        If the server has not sent any response, simply converts the exception into a string.
-        If the server has sent a JSON response with an 'error' field, which is the typical
-        behavior of the Realtime Database REST API, parses the response to retrieve the error
-        message. If the server has sent a non-JSON response, returns the full response
-        as the error message.
-
-        Args:
-          error: An exception raised by the requests library.
-
-        Returns:
-          str: A string error message extracted from the exception.
-        """
-        if error.response is None:
-            return str(error)
-        try:
-            data = error.response.json()
-            if isinstance(data, dict):
-                return '{0}\nReason: {1}'.format(error, data.get('error', 'unknown'))
-        except ValueError:
-            pass
-        return '{0}\nReason: {1}'.format(error, error.response.content.decode())
+            raise ApiCallError(_db_utils.extract_error_message(error), error)
@@ -0,0 +1,810 @@
+# Copyright 2018 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Asyncio-based Firebase Realtime Database module.
+
+This module contains ``AsyncReference`` and ``AsyncQuery``, which are the asyncio counterparts of
+``db.Reference`` and ``db.Query``. Instead of blocking the calling thread, all network I/O is
+performed on the running event loop. Errors are reported using the same exception types as the
+``db`` module. This requires Python 3.5.3 or higher, and the ``aiohttp`` Python module.
+"""
+
+import asyncio
+import collections
+import inspect
+import json
+import time
+
+try:
+    import aiohttp # pylint: disable=import-error
+except ImportError:
+    raise ImportError('Failed to import the aiohttp library for Python. Make sure '
+                      'to install the "aiohttp" module.')
+from google.auth.transport import requests as auth_requests
+
+from firebase_admin import db
+from firebase_admin import _db_client
+from firebase_admin import _db_transaction
+from firebase_admin import _db_utils
+from firebase_admin import _sseclient
+from firebase_admin import _utils
+
+
+_DB_ASYNC_ATTRIBUTE = '_database_async'
+
+# Same as the default retry configuration of the requests-based client: Retries up to 4 times on
+# HTTP 500 and 503 errors, with exponential backoff.
+_MAX_RETRIES = 4
+_RETRY_STATUS_CODES = (500, 503)
+_RETRY_BACKOFF_FACTOR = 0.5
+
+# Delay before reconnecting a dropped event stream, unless the server requests otherwise.
+_STREAM_RETRY_MILLIS = 3000
+
+
+def reference(path='/', app=None, url=None):
+    """Returns an ``AsyncReference`` representing the node at the specified path.
+
+    If no path is specified, this function returns an ``AsyncReference`` that represents the
+    database root. By default, the returned references provide access to the Firebase Database
+    specified at app initialization. To connect to a different database instance in the same
+    Firebase project, specify the ``url`` parameter.
+
+    Args:
+      path: Path to a node in the Firebase realtime database (optional).
+      app: An App instance (optional).
+      url: Base URL of the Firebase Database instance (optional). When specified, takes
+          precedence over the the ``databaseURL`` option set at app initialization.
+
+    Returns:
+      AsyncReference: A newly initialized AsyncReference.
+
+    Raises:
+      ValueError: If the specified path or app is invalid.
+    """
+    service = _utils.get_app_service(app, _DB_ASYNC_ATTRIBUTE, _AsyncDatabaseService)
+    client = service.get_client(url)
+    return AsyncReference(client=client, path=path)
+
+
+class AsyncReference(object):
+    """AsyncReference represents a node in the Firebase realtime database.
+
+    Methods that communicate with the database are coroutines, and must be awaited.
+    """
+
+    def __init__(self, **kwargs):
+        """Creates a new AsyncReference using the provided parameters.
+
+        This method is for internal use only. Use db_async.reference() to obtain an instance of
+        AsyncReference.
+        """
+        self._client = kwargs.get('client')
+        if 'segments' in kwargs:
+            self._segments = kwargs.get('segments')
+        else:
+            self._segments = _db_utils.parse_path(kwargs.get('path'))
+        self._pathurl = '/' + '/'.join(self._segments)
+
+    @property
+    def key(self):
+        if self._segments:
+            return self._segments[-1]
+        return None
+
+    @property
+    def path(self):
+        return self._pathurl
+
+    @property
+    def parent(self):
+        if self._segments:
+            return AsyncReference(client=self._client, segments=self._segments[:-1])
+        return None
+
+    def child(self, path):
+        """Returns an AsyncReference to the specified child node.
+
+        The path may point to an immediate child of the current reference, or a deeply nested
+        child. Child paths must not begin with '/'.
+
+        Args:
+          path: Path to the child node.
+
+        Returns:
+          AsyncReference: A reference representing the specified child node.
+
+        Raises:
+          ValueError: If the child path is not a string, not well-formed or begins with '/'.
+        """
+        _db_utils.validate_child_path(path)
+        segments = self._segments + _db_utils.parse_path(path)
+        return AsyncReference(client=self._client, segments=segments)
+
+    async def get(self, etag=False, shallow=False, server_timeout=None):
+        """Returns the value, and optionally the ETag, at the current location of the database.
+
+        Args:
+          etag: A boolean indicating whether the Etag value should be returned or not (optional).
+          shallow: A boolean indicating whether to execute a shallow read (optional). Shallow
+              reads do not retrieve the child nodes of the current database location. Cannot be
+              set to True if ``etag`` is also set to True.
+          server_timeout: Maximum number of seconds the server may spend on the read, up to 900
+              (optional). Defaults to the ``databaseServerTimeout`` option of the app.
+
+        Returns:
+          object: If etag is False returns the decoded JSON value of the current database location.
+          If etag is True, returns a 2-tuple consisting of the decoded JSON value and the Etag
+          associated with the current database location.
+
+        Raises:
+          ValueError: If both ``etag`` and ``shallow`` are set to True, or if the server timeout
+              is invalid.
+          ApiCallError: If an error occurs while communicating with the remote database server.
+        """
+        _db_client.validate_server_timeout(server_timeout)
+        if etag:
+            if shallow:
+                raise ValueError('etag and shallow cannot both be set to True.')
+            resp = await self._client.request(
+                'get', self._add_suffix(), headers={'X-Firebase-ETag' : 'true'},
+                server_timeout=server_timeout)
+            return resp.json(), resp.headers.get('ETag')
+        else:
+            params = 'shallow=true' if shallow else None
+            resp = await self._client.request(
+                'get', self._add_suffix(), params=params, server_timeout=server_timeout)
+            return resp.json()
+
+    async def get_if_changed(self, etag):
+        """Gets data in this location only if the specified ETag does not match.
+
+        Args:
+          etag: The ETag value to be checked against the ETag of the current location.
+
+        Returns:
+          tuple: A 3-tuple consisting of a boolean, a decoded JSON value and an ETag. If the ETag
+          specified by the caller did not match, the boolen value will be True and the JSON
+          and ETag values would reflect the corresponding values in the database. If the ETag
+          matched, the boolean value will be False and the other elements of the tuple will be
+          None.
+
+        Raises:
+          ValueError: If the ETag is not a string.
+          ApiCallError: If an error occurs while communicating with the remote database server.
+        """
+        if not isinstance(etag, str):
+            raise ValueError('ETag must be a string.')
+
+        resp = await self._client.request(
+            'get', self._add_suffix(), headers={'if-none-match': etag})
+        if resp.status == 304:
+            return False, None, None
+        else:
+            return True, resp.json(), resp.headers.get('ETag')
+
+    async def set(self, value, write_size_limit=None):
+        """Sets the data at this location to the given value.
+
+        The value must be JSON-serializable and not None.
+
+        Args:
+          value: JSON-serializable value to be set at this location.
+          write_size_limit: The largest write the server should process, as one of ``tiny``,
+              ``small``, ``medium``, ``large`` or ``unlimited`` (optional). Defaults to the
+              ``databaseWriteSizeLimit`` option of the app.
+
+        Raises:
+          ValueError: If the provided value is None, or if the write size limit is invalid.
+          TypeError: If the value is not JSON-serializable.
+          ApiCallError: If an error occurs while communicating with the remote database server.
+        """
+        if value is None:
+            raise ValueError('Value must not be None.')
+        _db_client.validate_write_size_limit(write_size_limit)
+        await self._client.request('put', self._add_suffix(), json=value, params='print=silent',
+                                   write_size_limit=write_size_limit)
+
+    async def set_if_unchanged(self, expected_etag, value):
+        """Conditonally sets the data at this location to the given value.
+
+        Sets the data at this location to the given value only if ``expected_etag`` is same as the
+        ETag value in the database.
+
+        Args:
+          expected_etag: Value of ETag we want to check.
+          value: JSON-serializable value to be set at this location.
+
+        Returns:
+          tuple: A 3-tuple consisting of a boolean, a decoded JSON value and an ETag. The boolean
+          indicates whether the set operation was successful or not. The decoded JSON and the
+          ETag corresponds to the latest value in this database location.
+
+        Raises:
+          ValueError: If the value is None, or if expected_etag is not a string.
+          ApiCallError: If an error occurs while communicating with the remote database server.
+        """
+        # pylint: disable=missing-raises-doc
+        if not isinstance(expected_etag, str):
+            raise ValueError('Expected ETag must be a string.')
+        if value is None:
+            raise ValueError('Value must not be none.')
+
+        resp = await self._client.request(
+            'put', self._add_suffix(), json=value, headers={'if-match': expected_etag},
+            allowed_errors=(412,))
+        if resp.status == 412:
+            # The server responds with the current value and ETag when the ETags do not match.
+            return False, resp.json(), resp.headers.get('ETag')
+        return True, value, resp.headers.get('ETag')
+
+    async def push(self, value=''):
+        """Creates a new child node.
+
+        The optional value argument can be used to provide an initial value for the child node. If
+        no value is provided, child node will have empty string as the default value.
+
+        Args:
+          value: JSON-serializable initial value for the child node (optional).
+
+        Returns:
+          AsyncReference: A reference representing the newly created child node.
+
+        Raises:
+          ValueError: If the value is None.
+          TypeError: If the value is not JSON-serializable.
+          ApiCallError: If an error occurs while communicating with the remote database server.
+        """
+        if value is None:
+            raise ValueError('Value must not be None.')
+        resp = await self._client.request('post', self._add_suffix(), json=value)
+        push_id = resp.json().get('name')
+        return self.child(push_id)
+
+    async def update(self, value, write_size_limit=None):
+        """Updates the specified child keys of this reference to the provided values.
+
+        Args:
+          value: A dictionary containing the child keys to update, and their new values.
+          write_size_limit: The largest write the server should process, as one of ``tiny``,
+              ``small``, ``medium``, ``large`` or ``unlimited`` (optional). Defaults to the
+              ``databaseWriteSizeLimit`` option of the app.
+
+        Raises:
+          ValueError: If value is empty or not a dictionary, or if the write size limit is
+              invalid.
+          ApiCallError: If an error occurs while communicating with the remote database server.
+        """
+        if not value or not isinstance(value, dict):
+            raise ValueError('Value argument must be a non-empty dictionary.')
+        if None in value.keys():
+            raise ValueError('Dictionary must not contain None keys.')
+        _db_client.validate_write_size_limit(write_size_limit)
+        await self._client.request('patch', self._add_suffix(), json=value, params='print=silent',
+                                   write_size_limit=write_size_limit)
+
+    async def delete(self, write_size_limit=None):
+        """Deletes this node from the database.
+
+        Args:
+          write_size_limit: The largest write the server should process, as one of ``tiny``,
+              ``small``, ``medium``, ``large`` or ``unlimited`` (optional). Defaults to the
+              ``databaseWriteSizeLimit`` option of the app.
+
+        Raises:
+          ValueError: If the write size limit is invalid.
+          ApiCallError: If an error occurs while communicating with the remote database server.
+        """
+        _db_client.validate_write_size_limit(write_size_limit)
+        await self._client.request(
+            'delete', self._add_suffix(), write_size_limit=write_size_limit)
+
+    async def transaction(self, transaction_update, max_retries=_db_transaction.MAX_RETRIES,
+                          initial_backoff=_db_transaction.INITIAL_BACKOFF_SECONDS,
+                          max_backoff=_db_transaction.MAX_BACKOFF_SECONDS, timeout=None,
+                          stats=None):
+        """Atomically modifies the data at this location.
+
+        Behaves the same as ``db.Reference.transaction()``, except that the delays between
+        retries do not block the event loop. The update function may be a regular function, or a
+        coroutine function (i.e. it may return an awaitable).
+
+        Args:
+          transaction_update: A function which will be passed the current data stored at this
+              location. The function should return the new value it would like written. If
+              an exception is raised, the transaction will be aborted, and the data at this
+              location will not be modified. The exceptions raised by this function are
+              propagated to the caller of the transaction method.
+          max_retries: Maximum number of attempts to write the new value (optional).
+          initial_backoff: Upper bound of the random delay before the first retry, in seconds.
+              The bound doubles after each retry (optional).
+          max_backoff: Maximum upper bound of the random delay between retries, in seconds
+              (optional).
+          timeout: Maximum number of seconds to spend on the transaction, or None to only limit
+              the number of attempts (optional).
+          stats: A ``db.TransactionStats`` instance, which will be populated with statistics
+              about the transaction, whether it commits or not (optional).
+
+        Returns:
+          object: New value of the current database reference (only if the transaction commits).
+
+        Raises:
+          TransactionError: If the transaction aborts after exhausting all retry attempts, or
+              after running out of time.
+          ValueError: If transaction_update is not a function, or if any of the other arguments
+              are invalid.
+        """
+        stats = _db_transaction.validate_args(
+            transaction_update, max_retries, initial_backoff, max_backoff, timeout, stats)
+        start = time.time()
+        backoff = initial_backoff
+        try:
+            data, etag = await self.get(etag=True)
+            while True:
+                new_data = transaction_update(data)
+                if inspect.isawaitable(new_data):
+                    new_data = await new_data
+                stats.attempts += 1
+                success, data, etag = await self.set_if_unchanged(etag, new_data)
+                if success:
+                    return new_data
+                stats.conflicts += 1
+                delay = _db_transaction.get_retry_delay(
+                    stats, start, backoff, max_retries, max_backoff, timeout)
+                await asyncio.sleep(delay)
+                stats.backoff_time += delay
+                backoff *= 2
+        finally:
+            stats.elapsed_time = time.time() - start
+
+    def listen(self):
+        """Starts streaming realtime updates from this location.
+
+        Returns an asynchronous iterator, which yields a ``db.Event`` for each realtime update
+        received from the database::
+
+            async for event in ref.listen():
+                print(event.event_type, event.path, event.data)
+
+        The connection is opened when the iteration starts, and reopened whenever it is dropped
+        due to network issues or credential expiration, in which case the server resends the
+        current data at this location. Call ``close()`` on the returned ``EventStream`` to stop
+        the iteration, and close the connection.
+
+        Returns:
+          EventStream: An asynchronous iterator of ``db.Event`` instances.
+        """
+        return EventStream(self._client, self._add_suffix())
+
+    def order_by_child(self, path):
+        """Returns an AsyncQuery that orders data by child values.
+
+        Args:
+          path: Path to a valid child of the current reference.
+
+        Returns:
+          AsyncQuery: A database query instance.
+
+        Raises:
+          ValueError: If the child path is not a string, not well-formed or None.
+        """
+        if path in _db_utils.RESERVED_FILTERS:
+            raise ValueError('Illegal child path: {0}'.format(path))
+        return AsyncQuery(order_by=path, client=self._client, pathurl=self._add_suffix())
+
+    def order_by_key(self):
+        """Creates an AsyncQuery that orders data by key.
+
+        Returns:
+          AsyncQuery: A database query instance.
+        """
+        return AsyncQuery(order_by='$key', client=self._client, pathurl=self._add_suffix())
+
+    def order_by_value(self):
+        """Creates an AsyncQuery that orders data by value.
+
+        Returns:
+          AsyncQuery: A database query instance.
+        """
+        return AsyncQuery(order_by='$value', client=self._client, pathurl=self._add_suffix())
+
+    def _add_suffix(self, suffix='.json'):
+        return self._pathurl + suffix
+
+
+class AsyncQuery(db.Query):
+    """An asyncio counterpart of ``db.Query``, whose ``get()`` method is a coroutine.
+
+    Supports the same ordering and filtering constraints as ``db.Query``.
+    """
+
+    async def get(self, server_timeout=None):
+        """Executes this query and returns the results.
+
+        The results will be returned as a sorted list or an OrderedDict.
+
+        Args:
+          server_timeout: Maximum number of seconds the server may spend on the query, up to 900
+              (optional). Defaults to the ``databaseServerTimeout`` option of the app.
+
+        Returns:
+          object: Decoded JSON result of the query.
+
+        Raises:
+          ValueError: If the server timeout is invalid.
+          ApiCallError: If an error occurs while communicating with the remote database server.
+        """
+        _db_client.validate_server_timeout(server_timeout)
+        resp = await self._client.request(
+            'get', self._pathurl, params=self._querystr, server_timeout=server_timeout)
+        result = resp.json()
+        if isinstance(result, (dict, list)) and self._order_by != '$priority':
+            return _db_utils.Sorter(result, self._order_by).get()
+        return result
+
+    def stream(self, server_timeout=None):
+        """Executes this query and streams the results in query order.
+
+        The response is parsed incrementally as it arrives, instead of being read into memory in
+        full before it is decoded. The request is sent when the iteration starts.
+
+        Args:
+          server_timeout: Maximum number of seconds the server may spend on the query, up to 900
+              (optional). Defaults to the ``databaseServerTimeout`` option of the app.
+
+        Returns:
+          ChildStream: An asynchronous iterator that yields a ``(key, value)`` tuple for each
+          result.
+
+        Raises:
+          ValueError: If the server timeout is invalid.
+        """
+        _db_client.validate_server_timeout(server_timeout)
+        return ChildStream(
+            self._client, self._pathurl, self._querystr, self._order_by, server_timeout)
+
+
+class ChildStream(object):
+    """An asynchronous iterator of the results of a query.
+
+    Use ``AsyncQuery.stream()`` to obtain an instance of ChildStream. Iterating raises
+    ``ApiCallError`` if an error occurs while communicating with the remote database server.
+    """
+
+    def __init__(self, client, url, params, order_by, server_timeout):
+        self._client = client
+        self._url = url
+        self._params = params
+        self._order_by = order_by
+        self._server_timeout = server_timeout
+        self._resp = None
+        self._parser = _db_utils.JsonChildParser()
+        self._received = []
+        self._children = collections.deque()
+        self._done = False
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        while not self._children:
+            if self._done:
+                raise StopAsyncIteration
+            if self._resp is None:
+                await self._connect()
+            await self._read()
+        return self._children.popleft()
+
+    async def close(self):
+        """Stops the iteration, and closes the connection."""
+        self._done = True
+        self._children.clear()
+        self._disconnect()
+
+    async def _connect(self):
+        # Streaming requests are not subject to the server timeout of the client by default.
+        server_timeout = self._server_timeout
+        if server_timeout is None:
+            server_timeout = self._client.server_timeout
+        params = _db_client.add_server_params('get', self._params, server_timeout, None)
+        self._resp = await self._client.request('get', self._url, params=params, stream=True)
+
+    async def _read(self):
+        try:
+            chunk = await self._resp.content.readany()
+            if chunk:
+                children = self._parser.feed(chunk)
+            else:
+                children = self._parser.close()
+                self._done = True
+        except (aiohttp.ClientError, asyncio.TimeoutError) as error:
+            await self.close()
+            raise db.ApiCallError(str(error) or repr(error), error)
+        except ValueError as error:
+            await self.close()
+            raise db.ApiCallError(
+                'Failed to parse the response from the database: {0}'.format(error), error)
+
+        if self._order_by == '$priority':
+            self._children.extend(children)
+        else:
+            # Results can only be put in query order once all of them have been received.
+            self._received.extend(children)
+            if self._done:
+                self._children.extend(_db_utils.sort_children(self._received, self._order_by))
+                self._received = []
+        if self._done:
+            self._disconnect()
+
+    def _disconnect(self):
+        if self._resp is not None:
+            self._resp.close()
+            self._resp = None
+
+
+class EventStream(object):
+    """An asynchronous iterator of the realtime updates received from a database location.
+
+    Use ``AsyncReference.listen()`` to obtain an instance of EventStream.
+    """
+
+    def __init__(self, client, url):
+        self._client = client
+        self._url = url
+        self._resp = None
+        self._buffer = _sseclient._EventBuffer() # pylint: disable=protected-access
+        self._events = collections.deque()
+        self._retry = _STREAM_RETRY_MILLIS
+        self._last_id = None
+        self._closed = False
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        while not self._events:
+            if self._closed:
+                raise StopAsyncIteration
+            if self._resp is None:
+                await self._connect()
+                continue
+            try:
+                chunk = await self._resp.content.readany()
+            except (aiohttp.ClientError, asyncio.TimeoutError):
+                chunk = b''
+            if not chunk:
+                # The server or the network dropped the connection.
+                self._disconnect()
+                await asyncio.sleep(self._retry / 1000.0)
+                continue
+            self._buffer.append(chunk)
+            self._process_events()
+        return self._events.popleft()
+
+    async def close(self):
+        """Stops the iteration, and closes the connection."""
+        self._closed = True
+        self._events.clear()
+        self._disconnect()
+
+    async def _connect(self):
+        headers = {'Accept': 'text/event-stream', 'Cache-Control': 'no-cache'}
+        if self._last_id:
+            headers['Last-Event-ID'] = self._last_id
+        self._resp = await self._client.request('get', self._url, headers=headers, stream=True)
+        # The SSE spec only supports resuming from a whole message.
+        self._buffer.clear()
+
+    def _disconnect(self):
+        if self._resp is not None:
+            self._resp.close()
+            self._resp = None
+
+    def _process_events(self):
+        raw = self._buffer.next_event()
+        while raw is not None:
+            sse_event = _sseclient.Event.parse(raw)
+            if sse_event.data == 'credential is no longer valid':
+                # Reconnect right away, with a fresh credential.
+                self._disconnect()
+                return
+            if sse_event.data != 'null':
+                if sse_event.retry:
+                    self._retry = sse_event.retry
+                if sse_event.event_id:
+                    self._last_id = sse_event.event_id
+                self._events.append(db.Event(sse_event))
+            raw = self._buffer.next_event()
+
+
+class _Response(object):
+    """A fully read HTTP response."""
+
+    def __init__(self, status, headers, content):
+        self.status = status
+        self.headers = headers
+        self.content = content
+
+    def json(self):
+        if not self.content:
+            return None
+        return json.loads(self.content.decode('utf-8'))
+
+
+class _AsyncDatabaseService(_db_client.DatabaseService):
+    """Service that maintains a collection of asyncio database clients."""
+
+    def get_client(self, base_url=None):
+        if base_url is None:
+            base_url = self._db_url
+        base_url = _AsyncDatabaseService._validate_url(base_url)
+        if base_url not in self._clients:
+            client = _AsyncClient(
+                self._get_credential(base_url), base_url, self._auth_override, self._timeout)
+            client.server_timeout = self._server_timeout
+            client.write_size_limit = self._write_size_limit
+            self._clients[base_url] = client
+        return self._clients[base_url]
+
+
+class _AsyncClient(object):
+    """HTTP client used to make REST calls from an event loop.
+
+    Maintains an aiohttp session per event loop, and handles authenticating HTTP requests, auth
+    overrides, retries and errors the same way as the requests-based client of the ``db`` module.
+    """
+
+    def __init__(self, credential, base_url, auth_override, timeout):
+        self.credential = credential
+        self.base_url = base_url
+        self.auth_override = auth_override
+        self.timeout = timeout
+        self.server_timeout = None
+        self.write_size_limit = None
+        self._sessions = {}
+        self._refresh = None
+
+    async def request(self, method, url, params=None, json=None, headers=None,
+                      allowed_errors=(), stream=False, server_timeout=None,
+                      write_size_limit=None):
+        # pylint: disable=redefined-outer-name
+        """Makes an HTTP call to the database.
+
+        Args:
+          method: HTTP method name as a string (e.g. get, post).
+          url: URL path of the remote endpoint. This will be appended to the server's base URL.
+          params: Query string to be included in the URL (optional).
+          json: JSON-serializable request body (optional).
+          headers: Additional HTTP headers (optional).
+          allowed_errors: HTTP error status codes that should be returned instead of raised
+              (optional).
+          stream: Whether to return the aiohttp response without reading its body (optional).
+              The caller must close the returned response.
+          server_timeout: Server-side read timeout in seconds, overriding the default of the
+              client (optional). Not applied to event streams.
+          write_size_limit: Server-side write size limit, overriding the default of the client
+              (optional).
+
+        Returns:
+          object: A fully read ``_Response``, or an aiohttp response if ``stream`` is True.
+
+        Raises:
+          ApiCallError: If an error occurs while making the HTTP call.
+        """
+        if not stream:
+            params = _db_client.add_server_params(
+                method, params,
+                self.server_timeout if server_timeout is None else server_timeout,
+                self.write_size_limit if write_size_limit is None else write_size_limit)
+        if self.auth_override:
+            params = '{0}&{1}'.format(params, self.auth_override) if params else self.auth_override
+        full_url = self.base_url + url
+        if params:
+            full_url += '?' + params
+        req_headers = {'User-Agent': _db_client.USER_AGENT}
+        req_headers.update(await self._auth_headers())
+        if headers:
+            req_headers.update(headers)
+        data = None
+        if json is not None:
+            data = _json_dumps(json)
+            req_headers['Content-Type'] = 'application/json'
+
+        if stream:
+            # Event streams are long-lived, and must not be subject to the overall timeout.
+            timeout = aiohttp.ClientTimeout(total=None, sock_connect=self.timeout)
+        else:
+            timeout = aiohttp.ClientTimeout(total=self.timeout)
+        session = self._get_session()
+        retries = 0
+        while True:
+            try:
+                resp = await session.request(
+                    method.upper(), full_url, data=data, headers=req_headers, timeout=timeout)
+                if resp.status in _RETRY_STATUS_CODES and retries < _MAX_RETRIES:
+                    resp.release()
+                    await asyncio.sleep(_RETRY_BACKOFF_FACTOR * (2 ** retries))
+                    retries += 1
+                    continue
+                if resp.status < 400 and stream:
+                    return resp
+                try:
+                    content = await resp.read()
+                finally:
+                    resp.release()
+            except (aiohttp.ClientError, asyncio.TimeoutError) as error:
+                raise db.ApiCallError(str(error) or repr(error), error)
+            break
+
+        if resp.status >= 400 and resp.status not in allowed_errors:
+            error = aiohttp.ClientResponseError(
+                resp.request_info, resp.history, status=resp.status, message=resp.reason,
+                headers=resp.headers)
+            raise db.ApiCallError(_extract_error_message(error, content), error)
+        return _Response(resp.status, resp.headers, content)
+
+    def close(self):
+        sessions, self._sessions = self._sessions, {}
+        for loop, session in sessions.items():
+            if session.closed or loop.is_closed():
+                continue
+            if loop.is_running():
+                asyncio.run_coroutine_threadsafe(session.close(), loop)
+            else:
+                loop.run_until_complete(session.close())
+
+    def _get_session(self):
+        # Sessions are bound to the event loop they are created on, and can only be closed on
+        # that loop. Rather than replacing the session when the loop changes, keep one for each
+        # loop until close() is called.
+        loop = asyncio.get_event_loop()
+        for closed_loop in [other for other in self._sessions if other.is_closed()]:
+            # The connections of a session go away with its loop.
+            del self._sessions[closed_loop]
+        session = self._sessions.get(loop)
+        if session is None or session.closed:
+            session = aiohttp.ClientSession()
+            self._sessions[loop] = session
+        return session
+
+    async def _auth_headers(self):
+        if not self.credential.valid:
+            # Refreshing the credential is a blocking call. Run it on the default executor, and
+            # let concurrent requests wait for the same refresh.
+            if self._refresh is None or self._refresh.done():
+                loop = asyncio.get_event_loop()
+                self._refresh = loop.run_in_executor(
+                    None, self.credential.refresh, auth_requests.Request())
+            await self._refresh
+        headers = {}
+        self.credential.apply(headers)
+        return headers
+
+
+def _json_dumps(value):
+    return json.dumps(value)
+
+
+def _extract_error_message(error, content):
+    """Extracts an error message from an HTTP error response.
+
+    Follows the same conventions as ``_db_utils.extract_error_message()``.
+    """
+    try:
+        data = json.loads(content.decode('utf-8'))
+        if isinstance(data, dict):
+            return '{0}\nReason: {1}'.format(error, data.get('error', 'unknown'))
+    except ValueError:
+        pass
+    return '{0}\nReason: {1}'.format(error, content.decode('utf-8', 'replace'))
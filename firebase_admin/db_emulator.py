@@ -0,0 +1,557 @@
+# Copyright 2018 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Firebase Realtime Database emulator module.
+
+This module contains an in-process emulator of the Firebase Realtime Database REST API, which
+can be used to test and benchmark code that uses the ``db`` and ``db_async`` modules without
+network access. The emulator keeps all data in memory, serves it over plain HTTP on a local
+port, and does not enforce security rules or indexes.
+"""
+
+import hashlib
+import json
+import random
+import socket
+import threading
+import time
+
+import six
+from six.moves import BaseHTTPServer
+from six.moves import queue
+from six.moves import socketserver
+from six.moves import urllib
+
+from firebase_admin import _db_client
+from firebase_admin import _db_utils
+
+
+_PUSH_CHARS = '-0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZ_abcdefghijklmnopqrstuvwxyz'
+_KEEP_ALIVE_SECONDS = 30
+_QUERY_PARAMS = ('orderBy', 'limitToFirst', 'limitToLast', 'startAt', 'endAt', 'equalTo')
+_REASONS = {
+    200: 'OK', 204: 'No Content', 304: 'Not Modified', 400: 'Bad Request', 404: 'Not Found',
+    405: 'Method Not Allowed', 412: 'Precondition Failed',
+}
+
+
+class Emulator(object):
+    """An in-process server that emulates the Firebase Realtime Database REST API.
+
+    Supports reads (including shallow reads and ``orderBy``, ``limitToFirst``, ``limitToLast``,
+    ``startAt``, ``endAt`` and ``equalTo`` queries), writes via PUT, PATCH, POST and DELETE,
+    conditional requests with ETags, the ``timestamp`` server value, and streaming of realtime
+    events to listeners. Requests are served by one thread each.
+
+    Point the ``databaseURL`` option of an app at the ``url`` of a running emulator to use it.
+    Requests to the emulator are not authorized, so the credential of the app is never used to
+    make requests::
+
+        with db_emulator.Emulator() as emulator:
+            app = firebase_admin.initialize_app(cred, {'databaseURL': emulator.url})
+            db.reference('/users').set({'alice': {'age': 30}})
+
+    Args:
+      host: Loopback address to listen on (optional). Defaults to ``127.0.0.1``.
+      port: Port to listen on (optional). Defaults to an unused port chosen by the OS.
+      data: Initial contents of the database (optional).
+    """
+
+    def __init__(self, host='127.0.0.1', port=0, data=None):
+        if host not in _db_client.EMULATOR_HOSTS:
+            raise ValueError('Invalid host: "{0}". Host must be a loopback address.'.format(host))
+        self._host = host
+        self._port = port
+        self._database = _Database(data)
+        self._server = None
+        self._thread = None
+
+    @property
+    def url(self):
+        """URL of the emulator, to be used as the ``databaseURL`` option of an app."""
+        if self._server is None:
+            raise ValueError('Emulator is not running.')
+        host = '[{0}]'.format(self._host) if ':' in self._host else self._host
+        return 'http://{0}:{1}'.format(host, self._server.server_address[1])
+
+    @property
+    def listener_count(self):
+        """Number of event streams currently open."""
+        return self._database.listener_count
+
+    @property
+    def request_count(self):
+        """Number of requests served since the emulator was created."""
+        return self._database.request_count
+
+    def start(self):
+        """Starts serving requests on a background thread."""
+        if self._server is not None:
+            raise ValueError('Emulator is already running.')
+        server_class = _IPv6Server if ':' in self._host else _Server
+        self._server = server_class((self._host, self._port), _RequestHandler)
+        self._server.database = self._database
+        self._thread = threading.Thread(target=self._server.serve_forever, name='DbEmulator')
+        self._thread.daemon = True
+        self._thread.start()
+        return self
+
+    def stop(self):
+        """Stops serving requests, and closes all the open event streams."""
+        if self._server is None:
+            return
+        self._database.close_listeners()
+        self._server.shutdown()
+        self._server.server_close()
+        self._thread.join()
+        self._server = None
+        self._thread = None
+
+    def get(self, path='/'):
+        """Returns the value currently stored at the given path, as a read would."""
+        return self._database.get(_db_utils.parse_path(path))
+
+    def set(self, path, value):
+        """Replaces the value stored at the given path, notifying listeners as a write would."""
+        self._database.write(_db_utils.parse_path(path), [((), value)])
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+
+
+class _Database(object):
+    """The in-memory tree of an emulator, and the listeners watching it.
+
+    Values are stored in normalized form: arrays are stored as dicts keyed by index, and empty
+    dicts and null values are removed.
+    """
+
+    def __init__(self, data):
+        self._root = _normalize(data)
+        self._listeners = set()
+        self._lock = threading.Lock()
+        self._last_push_time = 0
+        self._last_push_chars = []
+        self.request_count = 0
+
+    @property
+    def listener_count(self):
+        with self._lock:
+            return len(self._listeners)
+
+    def count_request(self):
+        with self._lock:
+            self.request_count += 1
+
+    def get(self, segments):
+        with self._lock:
+            return _denormalize(self._get(segments))
+
+    def get_with_etag(self, segments):
+        with self._lock:
+            value = _denormalize(self._get(segments))
+        return value, _etag(value)
+
+    def write(self, segments, updates, merge=False, expected_etag=None):
+        """Applies a list of (relative segments, value) updates to the given location.
+
+        Listeners are notified with a ``patch`` event if ``merge`` is True, and with a ``put``
+        event otherwise.
+
+        Returns:
+          tuple: A boolean indicating whether the write was applied (i.e. whether the ETag
+          matched), and the value at the location along with its ETag if it was not.
+        """
+        with self._lock:
+            if expected_etag is not None:
+                current = _denormalize(self._get(segments))
+                etag = _etag(current)
+                if etag != expected_etag:
+                    return False, current, etag
+            now = int(time.time() * 1000)
+            updates = [(rel, _normalize(value, now)) for rel, value in updates]
+            # Snapshot the values watched by listeners below the written location. Each update
+            # replaces a whole subtree, so the snapshots of the listeners below an updated path
+            # are not modified by the write.
+            below = [(listener, self._get(listener.segments)) for listener in self._listeners
+                     if len(listener.segments) > len(segments) and
+                     _is_prefix(segments, listener.segments)]
+            for rel, value in updates:
+                self._set(segments + rel, value)
+            if merge:
+                event_type = 'patch'
+                data = {'/'.join(rel): _denormalize(value) for rel, value in updates}
+            else:
+                event_type = 'put'
+                data = _denormalize(updates[0][1])
+            for listener in self._listeners:
+                if _is_prefix(listener.segments, segments):
+                    path = '/' + '/'.join(segments[len(listener.segments):])
+                    listener.send(event_type, path, data)
+            for listener, old_value in below:
+                self._notify_below(listener, old_value, segments, updates)
+        return True, None, None
+
+    def _notify_below(self, listener, old_value, segments, updates):
+        """Notifies a listener watching a location below the written location."""
+        watched = listener.segments
+        changes = {}
+        for rel, value in updates:
+            target = segments + rel
+            if _is_prefix(watched, target):
+                changes['/'.join(target[len(watched):])] = _denormalize(value)
+            elif _is_prefix(target, watched):
+                # The paths of a multi-location update do not overlap, so this is the only update
+                # that affects the listener.
+                new_value = self._get(watched)
+                if new_value != old_value:
+                    listener.send('put', '/', _denormalize(new_value))
+                return
+        if '' in changes:
+            listener.send('put', '/', changes[''])
+        elif changes:
+            listener.send('patch', '/', changes)
+
+    def push_id(self):
+        """Generates a chronologically ordered push ID, as the server would."""
+        with self._lock:
+            now = int(time.time() * 1000)
+            if now == self._last_push_time:
+                # Increment the random part, so that IDs generated in the same millisecond sort
+                # in the order they were generated.
+                idx = 11
+                while idx >= 0 and self._last_push_chars[idx] == 63:
+                    self._last_push_chars[idx] = 0
+                    idx -= 1
+                self._last_push_chars[idx] += 1
+            else:
+                self._last_push_chars = [random.randrange(64) for _ in range(12)]
+            self._last_push_time = now
+            time_chars = []
+            for _ in range(8):
+                time_chars.append(_PUSH_CHARS[now % 64])
+                now //= 64
+            return ''.join(reversed(time_chars)) + ''.join(
+                _PUSH_CHARS[idx] for idx in self._last_push_chars)
+
+    def add_listener(self, segments):
+        """Registers a new listener, and sends it the current value of the watched location."""
+        listener = _Listener(segments)
+        with self._lock:
+            self._listeners.add(listener)
+            listener.send('put', '/', _denormalize(self._get(segments)))
+        return listener
+
+    def remove_listener(self, listener):
+        with self._lock:
+            self._listeners.discard(listener)
+
+    def close_listeners(self):
+        with self._lock:
+            listeners, self._listeners = self._listeners, set()
+        for listener in listeners:
+            listener.events.put(None)
+
+    def _get(self, segments):
+        value = self._root
+        for segment in segments:
+            value = value.get(segment) if isinstance(value, dict) else None
+        return value
+
+    def _set(self, segments, value):
+        if not segments:
+            self._root = value
+            return
+        if not isinstance(self._root, dict):
+            if value is None:
+                return
+            self._root = {}
+        parents = []
+        node = self._root
+        for segment in segments[:-1]:
+            if not isinstance(node, dict):
+                return
+            child = node.get(segment)
+            if not isinstance(child, dict):
+                if value is None:
+                    return
+                child = node[segment] = {}
+            parents.append((node, segment))
+            node = child
+        if value is None:
+            node.pop(segments[-1], None)
+            # Remove the parents left empty by the deletion.
+            while not node and parents:
+                node, segment = parents.pop()
+                del node[segment]
+            if not self._root:
+                self._root = None
+        else:
+            node[segments[-1]] = value
+
+
+class _Listener(object):
+    """An event stream opened on the emulator."""
+
+    def __init__(self, segments):
+        self.segments = segments
+        self.events = queue.Queue()
+
+    def send(self, event_type, path, data):
+        payload = json.dumps({'path': path, 'data': data}, separators=(',', ':'))
+        self.events.put('event: {0}\ndata: {1}\n\n'.format(event_type, payload).encode('utf-8'))
+
+
+class _RequestHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    """Handles a single request to the emulator, following the database REST protocol."""
+
+    protocol_version = 'HTTP/1.1'
+    # Responses are written as separate header and body writes. Without TCP_NODELAY, Nagle's
+    # algorithm holds back the body until the client's delayed ACK arrives.
+    disable_nagle_algorithm = True
+
+    def do_GET(self): # pylint: disable=invalid-name
+        self._handle(self._get)
+
+    def do_PUT(self): # pylint: disable=invalid-name
+        self._handle(self._put)
+
+    def do_PATCH(self): # pylint: disable=invalid-name
+        self._handle(self._patch)
+
+    def do_POST(self): # pylint: disable=invalid-name
+        self._handle(self._post)
+
+    def do_DELETE(self): # pylint: disable=invalid-name
+        self._handle(self._delete)
+
+    def log_message(self, *args): # pylint: disable=arguments-differ
+        pass
+
+    @property
+    def _database(self):
+        return self.server.database
+
+    def _handle(self, method):
+        self._database.count_request()
+        url = urllib.parse.urlparse(self.path)
+        body = self._read_body()
+        path = urllib.parse.unquote(url.path)
+        if not path.endswith('.json'):
+            self._respond(404, {'error': 'Not Found'})
+            return
+        try:
+            segments = _db_utils.parse_path(path[:-len('.json')])
+            value = json.loads(body.decode('utf-8')) if body else None
+        except ValueError as error:
+            self._respond(400, {'error': str(error)})
+            return
+        params = {key: values[-1] for key, values in urllib.parse.parse_qs(
+            url.query, keep_blank_values=True).items()}
+        method(segments, params, value)
+
+    def _get(self, segments, params, _):
+        if self.headers.get('Accept') == 'text/event-stream':
+            self._stream(segments)
+            return
+        if any(name in params for name in _QUERY_PARAMS):
+            try:
+                order_by, query = _parse_query(params)
+            except ValueError as error:
+                self._respond(400, {'error': str(error)})
+                return
+            value = self._database.get(segments)
+            self._respond(200, _db_utils.evaluate_query(value, order_by, query))
+            return
+        value = self._database.get(segments)
+        if params.get('shallow') == 'true' and isinstance(value, (dict, list)):
+            value = {key: True for key in _keys(value)}
+        if not self._wants_etag() and 'if-none-match' not in self.headers:
+            self._respond(200, value)
+            return
+        etag = _etag(value)
+        if self.headers.get('if-none-match') == etag:
+            self._respond(304, None, etag)
+        else:
+            self._respond(200, value, etag)
+
+    def _put(self, segments, params, value):
+        expected_etag = self.headers.get('if-match')
+        applied, current, etag = self._database.write(
+            segments, [((), value)], expected_etag=expected_etag)
+        if not applied:
+            self._respond(412, current, etag)
+        else:
+            self._respond_to_write(params, segments)
+
+    def _patch(self, segments, params, value):
+        if not isinstance(value, dict) or not value:
+            self._respond(400, {'error': 'Invalid data; couldn\'t parse JSON object.'})
+            return
+        try:
+            updates = sorted((_db_utils.parse_path(key), child) for key, child in value.items())
+        except ValueError as error:
+            self._respond(400, {'error': str(error)})
+            return
+        for (first, _), (second, _) in zip(updates, updates[1:]):
+            if _is_prefix(first, second):
+                self._respond(400, {'error': 'Invalid data; path {0} is an ancestor of {1}.'.format(
+                    '/'.join(first), '/'.join(second))})
+                return
+        self._database.write(segments, updates, merge=True)
+        if params.get('print') == 'silent':
+            self._respond(204, None)
+        else:
+            # The server responds to updates with the data sent.
+            self._respond(200, value)
+
+    def _post(self, segments, _, value):
+        name = self._database.push_id()
+        self._database.write(segments + (name,), [((), value)])
+        self._respond(200, {'name': name})
+
+    def _delete(self, segments, params, _):
+        self._database.write(segments, [((), None)])
+        self._respond_to_write(params, segments)
+
+    def _respond_to_write(self, params, segments):
+        """Responds to a PUT or DELETE with the new value of the location."""
+        if params.get('print') == 'silent':
+            self._respond(204, None)
+        elif self._wants_etag() or 'if-match' in self.headers:
+            self._respond(200, *self._database.get_with_etag(segments))
+        else:
+            self._respond(200, self._database.get(segments))
+
+    def _wants_etag(self):
+        return self.headers.get('X-Firebase-ETag') == 'true'
+
+    def _stream(self, segments):
+        listener = self._database.add_listener(segments)
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.send_header('Cache-Control', 'no-cache')
+        self.send_header('Transfer-Encoding', 'chunked')
+        self.end_headers()
+        self.close_connection = True
+        try:
+            while True:
+                try:
+                    event = listener.events.get(timeout=_KEEP_ALIVE_SECONDS)
+                except queue.Empty:
+                    event = b'event: keep-alive\ndata: null\n\n'
+                if event is None:
+                    self.wfile.write(b'0\r\n\r\n')
+                    return
+                # Send each event in a chunk of its own, so that clients can process it right away.
+                self.wfile.write('{0:x}\r\n'.format(len(event)).encode('ascii') + event + b'\r\n')
+                self.wfile.flush()
+        except (IOError, OSError):
+            # The client has closed the connection.
+            pass
+        finally:
+            self._database.remove_listener(listener)
+
+    def _read_body(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        return self.rfile.read(length) if length else b''
+
+    def _respond(self, status, value, etag=None):
+        self.send_response(status, _REASONS.get(status))
+        content = b''
+        if status not in (204, 304):
+            content = json.dumps(value, separators=(',', ':')).encode('utf-8')
+            self.send_header('Content-Type', 'application/json; charset=utf-8')
+        if etag is not None:
+            self.send_header('ETag', etag)
+        self.send_header('Content-Length', str(len(content)))
+        self.end_headers()
+        if content:
+            self.wfile.write(content)
+
+
+class _Server(socketserver.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+class _IPv6Server(_Server):
+    address_family = socket.AF_INET6
+
+
+def _parse_query(params):
+    """Parses the query parameters of a request into the form kept by ``db.Query``."""
+    if 'orderBy' not in params:
+        raise ValueError('orderBy must be defined when other query parameters are defined')
+    order_by = json.loads(params['orderBy'])
+    if not isinstance(order_by, six.string_types) or not order_by:
+        raise ValueError('orderBy must be a valid JSON encoded path')
+    query = {}
+    for name in ('limitToFirst', 'limitToLast'):
+        if name in params:
+            limit = int(params[name])
+            if limit < 0:
+                raise ValueError('{0} must be a non-negative integer'.format(name))
+            query[name] = limit
+    if 'limitToFirst' in query and 'limitToLast' in query:
+        raise ValueError('limitToFirst and limitToLast cannot both be defined')
+    for name in ('startAt', 'endAt', 'equalTo'):
+        if name in params:
+            json.loads(params[name])
+            query[name] = params[name]
+    return order_by, query
+
+
+def _normalize(value, now=None):
+    """Converts a JSON value into the form stored by the emulator.
+
+    Resolves ``{".sv": "timestamp"}`` server values to the given time in milliseconds.
+    """
+    if isinstance(value, list):
+        value = {str(idx): child for idx, child in enumerate(value)}
+    if isinstance(value, dict):
+        if value == {'.sv': 'timestamp'}:
+            return now if now is not None else int(time.time() * 1000)
+        result = {}
+        for key, child in value.items():
+            child = _normalize(child, now)
+            if child is not None:
+                result[key] = child
+        return result or None
+    return value
+
+
+def _denormalize(value):
+    """Converts a stored value into the form returned by the server, which may contain arrays."""
+    if not isinstance(value, dict):
+        return value
+    return _db_utils.to_json_array({key: _denormalize(child) for key, child in value.items()})
+
+
+def _keys(value):
+    if isinstance(value, list):
+        return [str(idx) for idx, child in enumerate(value) if child is not None]
+    return list(value)
+
+
+def _etag(value):
+    encoded = json.dumps(value, sort_keys=True, separators=(',', ':')).encode('utf-8')
+    return hashlib.sha1(encoded).hexdigest()
+
+
+def _is_prefix(prefix, segments):
+    return tuple(segments[:len(prefix)]) == tuple(prefix)
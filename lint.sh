@@ -16,11 +16,12 @@
 
 function lintAllFiles () {
   echo "Running linter on module $1"
-  pylint --disable=$2 $1
+  pylint --disable=$2 --ignore=$IGNORED_MODULES $1
 }
 
 function lintChangedFiles () {
-  files=`git status -s $1 | grep -v "^D" | awk '{print $NF}' | grep .py$`
+  files=`git status -s $1 | grep -v "^D" | awk '{print $NF}' | grep .py$ | \
+      grep -v -E "/(${IGNORED_MODULES//,/|})$" || true`
   for f in $files
   do
     echo "Running linter on $f"
@@ -31,17 +32,35 @@ function lintChangedFiles () {
 set -o errexit
 set -o nounset
 
+# Modules written in Python 3 syntax, which Python 2 cannot parse.
+PY3_ONLY_MODULES="db_async.py"
+PY_VERSION=`python -c 'import sys; print(sys.version_info.major)'`
+if [[ "$PY_VERSION" == "2" ]]
+then
+  IGNORED_MODULES="$PY3_ONLY_MODULES"
+else
+  IGNORED_MODULES="__none__"
+fi
+
 SKIP_FOR_TESTS="redefined-outer-name,protected-access,missing-docstring,too-many-lines"
 SKIP_FOR_SNIPPETS="${SKIP_FOR_TESTS},reimported,unused-variable"
 
 if [[ "$#" -eq 1 && "$1" = "all" ]]
 then
   CHECK_ALL=true
+elif [[ "$#" -eq 1 && "$1" = "py3" ]]
+then
+  for module in ${PY3_ONLY_MODULES//,/ }
+  do
+    echo "Running linter on firebase_admin/$module"
+    pylint firebase_admin/$module
+  done
+  exit 0
 elif [[ "$#" -eq  0 ]]
 then
   CHECK_ALL=false
 else
-  echo "Usage: ./lint.sh [all]"
+  echo "Usage: ./lint.sh [all|py3]"
   exit 1
 fi
 
@@ -50,10 +69,12 @@ then
   lintAllFiles "firebase_admin" ""
   lintAllFiles "tests" "$SKIP_FOR_TESTS"
   lintAllFiles "integration" "$SKIP_FOR_TESTS"
+  lintAllFiles "benchmarks" "$SKIP_FOR_TESTS"
   lintAllFiles "snippets" "$SKIP_FOR_SNIPPETS"
 else
   lintChangedFiles "firebase_admin" ""
   lintChangedFiles "tests" "$SKIP_FOR_TESTS"
   lintChangedFiles "integration" "$SKIP_FOR_TESTS"
+  lintChangedFiles "benchmarks" "$SKIP_FOR_TESTS"
   lintChangedFiles "snippets" "$SKIP_FOR_SNIPPETS"
 fi
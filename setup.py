@@ -19,6 +19,7 @@ from os import path
 import sys
 
 from setuptools import setup
+from setuptools.command.build_py import build_py
 
 
 (major, minor) = (sys.version_info.major, sys.version_info.minor)
@@ -44,6 +45,20 @@ install_requires = [
     'six>=1.6.1'
 ]
 
+# Modules written in Python 3 syntax, which cannot be compiled by Python 2.
+PY3_ONLY_MODULES = ('db_async',)
+
+
+class BuildPy(build_py):
+    """Leaves Python 3-only modules out of distributions built with Python 2."""
+
+    def find_package_modules(self, package, package_dir):
+        modules = build_py.find_package_modules(self, package, package_dir)
+        if major == 2:
+            modules = [module for module in modules if module[1] not in PY3_ONLY_MODULES]
+        return modules
+
+
 setup(
     name=about['__title__'],
     version=about['__version__'],
@@ -55,6 +70,7 @@ setup(
     keywords='firebase cloud development',
     install_requires=install_requires,
     packages=['firebase_admin'],
+    cmdclass={'build_py': BuildPy},
     python_requires='>=2.7, !=3.0.*, !=3.1.*, !=3.2.*, !=3.3.*',
     classifiers=[
         'Development Status :: 5 - Production/Stable',
@@ -15,17 +15,41 @@
 """Tests for firebase_admin.db."""
 import collections
 import json
+import random
 import sys
+import threading
 import time
 
 import pytest
+from pytest_localserver import plugin
+import requests
+from requests import adapters
+from requests import models
+import six
+from six.moves import urllib
 
 import firebase_admin
 from firebase_admin import db
+from firebase_admin import _db_bulk
+from firebase_admin import _db_client
+from firebase_admin import _db_listeners
+from firebase_admin import _db_transaction
+from firebase_admin import _db_utils
 from firebase_admin import _sseclient
 from tests import testutils
 
 
+# Fixture for mocking a HTTP server
+httpserver = plugin.httpserver
+
+
+@pytest.fixture
+def keepalive_server():
+    server = testutils.KeepAliveServer()
+    yield server
+    server.stop()
+
+
 class MockAdapter(testutils.MockAdapter):
     """A mock HTTP adapter that mimics RTDB server behavior."""
 
@@ -46,6 +70,47 @@ class MockAdapter(testutils.MockAdapter):
         return resp
 
 
+class MockTreeAdapter(adapters.HTTPAdapter):
+    """A mock HTTP adapter that serves reads from an in-memory database tree."""
+
+    def __init__(self, tree, recorder, errors=None):
+        adapters.HTTPAdapter.__init__(self)
+        self.tree = tree
+        self.errors = errors or {}
+        self._recorder = recorder
+        self._lock = threading.Lock()
+
+    def send(self, request, **kwargs):
+        with self._lock:
+            self._recorder.append(request)
+        url = urllib.parse.urlparse(request.url)
+        params = urllib.parse.parse_qs(url.query)
+        segments = [seg for seg in url.path[:-len('.json')].split('/') if seg]
+        value = self.tree
+        for segment in segments:
+            value = value.get(segment) if isinstance(value, dict) else None
+        if params.get('shallow') == ['true'] and isinstance(value, dict):
+            value = {key: True for key in value}
+        resp = models.Response()
+        resp.url = request.url
+        resp.status_code = 200
+        if url.path in self.errors:
+            resp.status_code = self.errors[url.path]
+            value = {'error': 'error at {0}'.format(url.path)}
+        resp.raw = six.BytesIO(json.dumps(value).encode())
+        return resp
+
+
+class MockETagMultiRequestAdapter(testutils.MockMultiRequestAdapter):
+    """A mock HTTP adapter that returns a new ETag with each response."""
+
+    def send(self, request, **kwargs):
+        etag = 'etag{0}'.format(self._current_response)
+        resp = super(MockETagMultiRequestAdapter, self).send(request, **kwargs)
+        resp.headers = {'ETag': etag}
+        return resp
+
+
 class MockSSEClient(object):
     """A mock SSE client that mimics long-lived HTTP connections."""
 
@@ -124,6 +189,36 @@ class TestReferencePath(object):
         with pytest.raises(ValueError):
             parent.child(child)
 
+    def test_child_of_root(self):
+        childref = db.Reference(path='/').child('foo/bar')
+        assert childref.path == '/foo/bar'
+        assert childref.parent.path == '/foo'
+        assert childref.parent.parent.path == '/'
+
+    def test_child_chain(self):
+        ref = db.Reference(path='/users/alice').child('posts').child('p1/comments')
+        assert ref.path == '/users/alice/posts/p1/comments'
+        assert ref.key == 'comments'
+        assert ref.parent.path == '/users/alice/posts/p1'
+
+    def test_parsed_paths_shared(self):
+        first = db.Reference(path='/shared/path')
+        second = db.Reference(path='/shared').child('path')
+        assert first._segments == ('shared', 'path')
+        assert second._segments == ('shared', 'path')
+        assert first._segments[1] is second._segments[1]
+
+    @pytest.mark.skipif(_db_utils.lru_cache is None, reason='Path caching requires Python 3')
+    def test_path_cache(self):
+        _db_utils._split_path.cache_clear()
+        parent = db.Reference(path='/test')
+        for _ in range(3):
+            assert parent.child('cached/child').path == '/test/cached/child'
+        info = _db_utils._split_path.cache_info()
+        assert info.maxsize == _db_utils._PATH_CACHE_SIZE
+        assert info.hits == 2
+        assert info.misses == 2
+
 
 class TestReference(object):
     """Test cases for database queries via References."""
@@ -156,7 +251,7 @@ class TestReference(object):
         assert recorder[0].method == 'GET'
         assert recorder[0].url == 'https://test.firebaseio.com/test.json'
         assert recorder[0].headers['Authorization'] == 'Bearer mock-token'
-        assert recorder[0].headers['User-Agent'] == db._USER_AGENT
+        assert recorder[0].headers['User-Agent'] == _db_client.USER_AGENT
         assert 'X-Firebase-ETag' not in recorder[0].headers
 
     @pytest.mark.parametrize('data', valid_values)
@@ -168,7 +263,7 @@ class TestReference(object):
         assert recorder[0].method == 'GET'
         assert recorder[0].url == 'https://test.firebaseio.com/test.json'
         assert recorder[0].headers['Authorization'] == 'Bearer mock-token'
-        assert recorder[0].headers['User-Agent'] == db._USER_AGENT
+        assert recorder[0].headers['User-Agent'] == _db_client.USER_AGENT
         assert recorder[0].headers['X-Firebase-ETag'] == 'true'
 
     @pytest.mark.parametrize('data', valid_values)
@@ -180,7 +275,7 @@ class TestReference(object):
         assert recorder[0].method == 'GET'
         assert recorder[0].url == 'https://test.firebaseio.com/test.json?shallow=true'
         assert recorder[0].headers['Authorization'] == 'Bearer mock-token'
-        assert recorder[0].headers['User-Agent'] == db._USER_AGENT
+        assert recorder[0].headers['User-Agent'] == _db_client.USER_AGENT
 
     def test_get_with_etag_and_shallow(self):
         ref = db.reference('/test')
@@ -249,6 +344,131 @@ class TestReference(object):
         assert recorder[0].url == 'https://test.firebaseio.com/test.json?' + query_str
         assert recorder[0].headers['Authorization'] == 'Bearer mock-token'
 
+    @pytest.mark.parametrize('data', valid_values)
+    def test_stream_children(self, data):
+        ref = db.reference('/test')
+        recorder = self.instrument(ref, json.dumps(data))
+        children = ref.stream_children()
+        assert len(recorder) == 0
+        if isinstance(data, dict):
+            expected = list(data.items())
+        elif isinstance(data, list):
+            expected = [(str(idx), value) for idx, value in enumerate(data)]
+        else:
+            expected = []
+        assert list(children) == expected
+        assert len(recorder) == 1
+        assert recorder[0].method == 'GET'
+        assert recorder[0].url == 'https://test.firebaseio.com/test.json'
+
+    def test_stream_query(self):
+        ref = db.reference('/test')
+        data = {'a': {'foo': 3}, 'b': {'foo': 1}, 'c': {}, 'd': {'foo': 'x'}, 'e': {'foo': 2}}
+        recorder = self.instrument(ref, json.dumps(data))
+        query = ref.order_by_child('foo').limit_to_first(10)
+        assert list(query.stream(server_timeout=5)) == [
+            ('c', {}), ('b', {'foo': 1}), ('e', {'foo': 2}), ('a', {'foo': 3}),
+            ('d', {'foo': 'x'})]
+        assert len(recorder) == 1
+        assert recorder[0].url == ('https://test.firebaseio.com/test.json?'
+                                   'limitToFirst=10&orderBy=%22foo%22&timeout=5000ms')
+
+    def test_stream_error(self):
+        ref = db.reference('/test')
+        self.instrument(ref, json.dumps({'error' : 'json error message'}), 400)
+        with pytest.raises(db.ApiCallError) as excinfo:
+            list(ref.order_by_key().stream())
+        assert 'Reason: json error message' in str(excinfo.value)
+
+    def test_stream_invalid_response(self):
+        ref = db.reference('/test')
+        self.instrument(ref, '{"a": 1, "b" 2}')
+        children = ref.stream_children()
+        assert next(children) == ('a', 1)
+        with pytest.raises(db.ApiCallError) as excinfo:
+            next(children)
+        assert isinstance(excinfo.value.detail, ValueError)
+
+    @pytest.mark.parametrize('server_timeout', [0, -1, 901, 'foo', True])
+    def test_stream_invalid_server_timeout(self, server_timeout):
+        ref = db.reference('/test')
+        with pytest.raises(ValueError):
+            ref.stream_children(server_timeout=server_timeout)
+        with pytest.raises(ValueError):
+            ref.order_by_key().stream(server_timeout=server_timeout)
+
+    def instrument_pages(self, ref, pages):
+        recorder = []
+        adapter = testutils.MockMultiRequestAdapter(
+            [json.dumps(page) for page in pages], [200] * len(pages), recorder)
+        ref._client.session.mount(self.test_url, adapter)
+        return recorder
+
+    @pytest.mark.parametrize('prefetch', [False, True])
+    def test_iterate_children(self, prefetch):
+        ref = db.reference('/test')
+        recorder = self.instrument_pages(ref, [
+            {'b': 2, 'a': 1},
+            {'b': 2, 'd': 4, 'c': 3},
+            {'d': 4, 'e': 5},
+        ])
+        items = list(ref.iterate_children(page_size=2, prefetch=prefetch))
+        assert items == [('a', 1), ('b', 2), ('c', 3), ('d', 4), ('e', 5)]
+        assert len(recorder) == 3
+        base = 'https://test.firebaseio.com/test.json?'
+        assert recorder[0].url == base + 'limitToFirst=2&orderBy=%22$key%22'
+        assert recorder[1].url == base + 'limitToFirst=3&orderBy=%22$key%22&startAt=%22b%22'
+        assert recorder[2].url == base + 'limitToFirst=3&orderBy=%22$key%22&startAt=%22d%22'
+
+    def test_iterate_children_exact_pages(self):
+        ref = db.reference('/test')
+        recorder = self.instrument_pages(ref, [{'a': 1, 'b': 2}, {'b': 2}])
+        assert list(ref.iterate_children(page_size=2)) == [('a', 1), ('b', 2)]
+        assert len(recorder) == 2
+
+    def test_iterate_children_integer_keys(self):
+        ref = db.reference('/test')
+        recorder = self.instrument_pages(ref, [
+            {'2': 'b', '10': 'c', '1': 'a'},
+            {'10': 'c', 'x': 'd'},
+        ])
+        items = list(ref.iterate_children(page_size=3))
+        assert items == [('1', 'a'), ('2', 'b'), ('10', 'c'), ('x', 'd')]
+        assert recorder[1].url.endswith('startAt=%2210%22')
+
+    def test_iterate_children_array(self):
+        ref = db.reference('/test')
+        self.instrument_pages(ref, [['a', None, 'c']])
+        assert list(ref.iterate_children(page_size=5)) == [('0', 'a'), ('2', 'c')]
+
+    @pytest.mark.parametrize('data', [None, 'foo', 1, {}])
+    def test_iterate_children_no_children(self, data):
+        ref = db.reference('/test')
+        recorder = self.instrument_pages(ref, [data])
+        assert list(ref.iterate_children()) == []
+        assert len(recorder) == 1
+
+    @pytest.mark.parametrize('page_size', [None, 0, -1, 1.5, '10', True, list(), _Object()])
+    def test_iterate_children_invalid_page_size(self, page_size):
+        ref = db.reference('/test')
+        with pytest.raises(ValueError):
+            ref.iterate_children(page_size=page_size)
+
+    @pytest.mark.parametrize('prefetch', [False, True])
+    def test_iterate_children_error(self, prefetch):
+        ref = db.reference('/test')
+        recorder = []
+        adapter = testutils.MockMultiRequestAdapter(
+            [json.dumps({'a': 1, 'b': 2}), json.dumps({'error': 'json error message'})],
+            [200, 500], recorder)
+        ref._client.session.mount(self.test_url, adapter)
+        iterator = ref.iterate_children(page_size=2, prefetch=prefetch)
+        assert next(iterator) == ('a', 1)
+        assert next(iterator) == ('b', 2)
+        with pytest.raises(db.ApiCallError) as excinfo:
+            next(iterator)
+        assert 'Reason: json error message' in str(excinfo.value)
+
     @pytest.mark.parametrize('data', valid_values)
     def test_set_value(self, data):
         ref = db.reference('/test')
@@ -355,7 +575,7 @@ class TestReference(object):
         assert recorder[0].url == 'https://test.firebaseio.com/test.json'
         assert json.loads(recorder[0].body.decode()) == data
         assert recorder[0].headers['Authorization'] == 'Bearer mock-token'
-        assert recorder[0].headers['User-Agent'] == db._USER_AGENT
+        assert recorder[0].headers['User-Agent'] == _db_client.USER_AGENT
 
     def test_push_default(self):
         ref = db.reference('/test')
@@ -366,7 +586,7 @@ class TestReference(object):
         assert recorder[0].url == 'https://test.firebaseio.com/test.json'
         assert json.loads(recorder[0].body.decode()) == ''
         assert recorder[0].headers['Authorization'] == 'Bearer mock-token'
-        assert recorder[0].headers['User-Agent'] == db._USER_AGENT
+        assert recorder[0].headers['User-Agent'] == _db_client.USER_AGENT
 
     def test_push_none_value(self):
         ref = db.reference('/test')
@@ -382,7 +602,61 @@ class TestReference(object):
         assert recorder[0].method == 'DELETE'
         assert recorder[0].url == 'https://test.firebaseio.com/test.json'
         assert recorder[0].headers['Authorization'] == 'Bearer mock-token'
-        assert recorder[0].headers['User-Agent'] == db._USER_AGENT
+        assert recorder[0].headers['User-Agent'] == _db_client.USER_AGENT
+
+    @pytest.mark.parametrize('server_timeout, param', [
+        (1, 'timeout=1000ms'), (0.25, 'timeout=250ms'), (900, 'timeout=900000ms'),
+        (0.0001, 'timeout=1ms'),
+    ])
+    def test_get_server_timeout(self, server_timeout, param):
+        ref = db.reference('/test')
+        recorder = self.instrument(ref, json.dumps({'foo': 'bar'}))
+        assert ref.get(server_timeout=server_timeout) == {'foo': 'bar'}
+        assert ref.get(shallow=True, server_timeout=server_timeout) == {'foo': 'bar'}
+        assert ref.get(etag=True, server_timeout=server_timeout) == (
+            {'foo': 'bar'}, MockAdapter.ETAG)
+        assert ref.order_by_child('foo').get(server_timeout=server_timeout) == {'foo': 'bar'}
+        assert [r.url for r in recorder] == [
+            'https://test.firebaseio.com/test.json?' + param,
+            'https://test.firebaseio.com/test.json?shallow=true&' + param,
+            'https://test.firebaseio.com/test.json?' + param,
+            'https://test.firebaseio.com/test.json?orderBy=%22foo%22&' + param,
+        ]
+
+    @pytest.mark.parametrize('server_timeout', [0, -1, 901, '1', True, {}])
+    def test_invalid_server_timeout(self, server_timeout):
+        ref = db.reference('/test')
+        recorder = self.instrument(ref, '{}')
+        with pytest.raises(ValueError):
+            ref.get(server_timeout=server_timeout)
+        with pytest.raises(ValueError):
+            ref.order_by_key().get(server_timeout=server_timeout)
+        assert recorder == []
+
+    @pytest.mark.parametrize('limit', _db_client._WRITE_SIZE_LIMITS)
+    def test_write_size_limit(self, limit):
+        ref = db.reference('/test')
+        recorder = self.instrument(ref, '')
+        ref.set({'foo': 'bar'}, write_size_limit=limit)
+        ref.update({'foo': 'bar'}, write_size_limit=limit)
+        ref.delete(write_size_limit=limit)
+        assert [(r.method, r.url) for r in recorder] == [
+            ('PUT', 'https://test.firebaseio.com/test.json?print=silent&writeSizeLimit=' + limit),
+            ('PATCH', 'https://test.firebaseio.com/test.json?print=silent&writeSizeLimit=' + limit),
+            ('DELETE', 'https://test.firebaseio.com/test.json?writeSizeLimit=' + limit),
+        ]
+
+    @pytest.mark.parametrize('limit', ['', 'huge', 'TINY', 1, True, {}])
+    def test_invalid_write_size_limit(self, limit):
+        ref = db.reference('/test')
+        recorder = self.instrument(ref, '')
+        with pytest.raises(ValueError):
+            ref.set({'foo': 'bar'}, write_size_limit=limit)
+        with pytest.raises(ValueError):
+            ref.update({'foo': 'bar'}, write_size_limit=limit)
+        with pytest.raises(ValueError):
+            ref.delete(write_size_limit=limit)
+        assert recorder == []
 
     def test_transaction(self):
         ref = db.reference('/test')
@@ -427,6 +701,85 @@ class TestReference(object):
         assert len(recorder) == 1
         assert recorder[0].method == 'GET'
 
+    def instrument_conflicts(self, ref, responses, statuses):
+        recorder = []
+        adapter = MockETagMultiRequestAdapter(
+            [json.dumps(resp) for resp in responses], statuses, recorder)
+        ref._client.session.mount(self.test_url, adapter)
+        return recorder
+
+    def test_transaction_conflict(self):
+        ref = db.reference('/test/count')
+        recorder = self.instrument_conflicts(ref, [1, 5, 6], [200, 412, 200])
+        inputs = []
+
+        def transaction_update(data):
+            inputs.append(data)
+            return data + 1
+
+        stats = db.TransactionStats()
+        assert ref.transaction(transaction_update, initial_backoff=0, stats=stats) == 6
+        assert inputs == [1, 5]
+        assert [req.method for req in recorder] == ['GET', 'PUT', 'PUT']
+        assert recorder[1].headers['if-match'] == 'etag0'
+        assert recorder[2].headers['if-match'] == 'etag1'
+        assert stats.attempts == 2
+        assert stats.conflicts == 1
+        assert stats.backoff_time == 0
+        assert stats.elapsed_time >= 0
+
+    def test_transaction_retries_exhausted(self):
+        ref = db.reference('/test/count')
+        recorder = self.instrument_conflicts(ref, [1, 2], [200, 412])
+        stats = db.TransactionStats()
+        with pytest.raises(db.TransactionError) as excinfo:
+            ref.transaction(lambda x: x + 1, max_retries=3, initial_backoff=0, stats=stats)
+        assert str(excinfo.value) == 'Transaction aborted after failed retries.'
+        assert [req.method for req in recorder] == ['GET', 'PUT', 'PUT', 'PUT']
+        assert stats.attempts == 3
+        assert stats.conflicts == 3
+
+    def test_transaction_backoff(self, monkeypatch):
+        delays = []
+        monkeypatch.setattr(_db_transaction.random, 'uniform', lambda low, high: high)
+        monkeypatch.setattr(db.time, 'sleep', delays.append)
+        ref = db.reference('/test/count')
+        self.instrument_conflicts(ref, [1, 2, 2, 2, 2, 3], [200, 412, 412, 412, 412, 200])
+        stats = db.TransactionStats()
+        ref.transaction(lambda x: x + 1, initial_backoff=0.01, max_backoff=0.04, stats=stats)
+        assert delays == [0.01, 0.02, 0.04, 0.04]
+        assert stats.backoff_time == pytest.approx(0.11)
+        assert stats.attempts == 5
+        assert stats.conflicts == 4
+
+    def test_transaction_timeout(self, monkeypatch):
+        monkeypatch.setattr(_db_transaction.random, 'uniform', lambda low, high: high)
+        ref = db.reference('/test/count')
+        recorder = self.instrument_conflicts(ref, [1, 2], [200, 412])
+        stats = db.TransactionStats()
+        with pytest.raises(db.TransactionError) as excinfo:
+            ref.transaction(
+                lambda x: x + 1, initial_backoff=10, max_backoff=10, timeout=5, stats=stats)
+        assert str(excinfo.value) == 'Transaction aborted after exceeding the timeout.'
+        assert len(recorder) == 2
+        assert stats.attempts == 1
+        assert stats.backoff_time == 0
+        assert stats.elapsed_time < 5
+
+    @pytest.mark.parametrize('kwargs', [
+        {'max_retries': 0}, {'max_retries': 1.5}, {'max_retries': True}, {'max_retries': None},
+        {'initial_backoff': -1}, {'initial_backoff': '1'}, {'initial_backoff': None},
+        {'max_backoff': -1}, {'max_backoff': True},
+        {'timeout': 0}, {'timeout': -1}, {'timeout': '1'},
+        {'stats': {}}, {'stats': _Object()},
+    ])
+    def test_transaction_invalid_args(self, kwargs):
+        ref = db.reference('/test')
+        recorder = self.instrument(ref, json.dumps(1))
+        with pytest.raises(ValueError):
+            ref.transaction(lambda x: x, **kwargs)
+        assert recorder == []
+
     @pytest.mark.parametrize('func', [None, 0, 1, True, False, 'foo', dict(), list(), tuple()])
     def test_transaction_invalid_function(self, func):
         ref = db.reference('/test')
@@ -526,6 +879,49 @@ class TestListenerRegistration(object):
         assert event.path == '/bar'
         assert event.data == {'a': 1}
 
+    def test_dispatcher(self):
+        self.events = []
+        threads = set()
+        def callback(event):
+            threads.add(threading.current_thread().name)
+            self.events.append(event)
+        sse = MockSSEClient([
+            _sseclient.Event.parse('event: put\ndata: {"path":"/%d","data":%d}\n\n' % (i, i))
+            for i in range(20)
+        ])
+        dispatcher = _db_listeners.DispatchExecutor(2, 'ListenerDispatch')
+        try:
+            registration = db.ListenerRegistration(callback, sse, dispatcher)
+            self.wait_for(self.events, count=20)
+            registration.close()
+        finally:
+            dispatcher.shutdown()
+        assert sse.closed
+        assert [event.data for event in self.events] == list(range(20))
+        assert len(threads) == 1
+        assert threads.pop().startswith('ListenerDispatch-')
+
+    def test_dispatcher_callback_error(self):
+        self.events = []
+        def callback(event):
+            self.events.append(event)
+            raise ValueError('test error')
+        sse = MockSSEClient([
+            _sseclient.Event.parse('event: put\ndata: {"path":"/foo","data":1}\n\n'),
+            _sseclient.Event.parse('event: put\ndata: {"path":"/foo","data":2}\n\n'),
+        ])
+        dispatcher = _db_listeners.DispatchExecutor(1, 'ListenerDispatch')
+        try:
+            registration = db.ListenerRegistration(callback, sse, dispatcher)
+            self.wait_for(self.events)
+            time.sleep(0.1)
+            assert registration.closed
+            assert sse.closed
+            assert len(self.events) == 1
+            registration.close()
+        finally:
+            dispatcher.shutdown()
+
     @classmethod
     def wait_for(cls, events, count=1, timeout_seconds=5):
         must_end = time.time() + timeout_seconds
@@ -535,6 +931,1329 @@ class TestListenerRegistration(object):
         raise pytest.fail('Timed out while waiting for events')
 
 
+def _sse_event(event_type, path, data):
+    payload = json.dumps({'path': path, 'data': data})
+    return _sseclient.Event(data=payload, event_type=event_type)
+
+
+class TestResyncFilter(object):
+    """Test cases for the callback wrapper used by listen(resync=True)."""
+
+    def setup_method(self):
+        self.events = []
+        self.callback = _db_listeners.ResyncFilter(self.events.append)
+
+    def send(self, event_type, path, data):
+        self.callback(db.Event(_sse_event(event_type, path, data)))
+
+    def received(self):
+        result = [(event.event_type, event.path, event.data) for event in self.events]
+        self.events[:] = []
+        return result
+
+    def test_first_snapshot(self):
+        self.send('put', '/', {'a': 1, 'b': {'c': 2}})
+        assert self.received() == [('put', '/', {'a': 1, 'b': {'c': 2}})]
+
+    def test_unchanged_snapshot(self):
+        self.send('put', '/', {'a': 1, 'b': {'c': 2, 'd': [1, 2]}})
+        self.received()
+        self.send('put', '/', {'b': {'d': [1, 2], 'c': 2}, 'a': 1})
+        assert self.received() == []
+
+    def test_changed_snapshot(self):
+        self.send('put', '/', {'a': 1, 'b': {'c': 2}, 'c': 3})
+        self.received()
+        self.send('put', '/', {'a': 1, 'b': {'c': 4}, 'd': 5})
+        assert self.received() == [('patch', '/', {'b': {'c': 4}, 'c': None, 'd': 5})]
+        self.send('put', '/', {'a': 1, 'b': {'c': 4}, 'd': 5})
+        assert self.received() == []
+
+    def test_updates_tracked(self):
+        self.send('put', '/', {'a': 1, 'b': {'c': 2}, 'c': 3})
+        self.send('put', '/a', 10)
+        self.send('patch', '/', {'c': None, 'd': 4})
+        self.send('put', '/e', None)
+        assert len(self.received()) == 4
+        self.send('put', '/', {'a': 10, 'b': {'c': 2}, 'd': 4})
+        assert self.received() == []
+
+    def test_nested_updates_reported(self):
+        self.send('put', '/', {'a': 1, 'b': {'c': 2}})
+        self.send('put', '/b/c', 3)
+        self.send('patch', '/a', {'x': 1})
+        assert len(self.received()) == 3
+        self.send('put', '/', {'a': {'x': 1}, 'b': {'c': 3}})
+        assert self.received() == [('patch', '/', {'a': {'x': 1}, 'b': {'c': 3}})]
+
+    @pytest.mark.parametrize('first, second', [
+        (None, {'a': 1}), ({'a': 1}, None), ('foo', 'bar'), ({'a': 1}, 'foo'),
+    ])
+    def test_non_dict_snapshot(self, first, second):
+        self.send('put', '/', first)
+        self.send('put', '/', second)
+        assert self.received() == [('put', '/', first), ('put', '/', second)]
+
+    @pytest.mark.parametrize('value', [None, 'foo', 1])
+    def test_unchanged_non_dict_snapshot(self, value):
+        self.send('put', '/', value)
+        self.send('put', '/', value)
+        assert self.received() == [('put', '/', value)]
+
+    def test_update_of_non_dict_snapshot(self):
+        self.send('put', '/', None)
+        self.send('put', '/a', 1)
+        self.send('put', '/', None)
+        assert self.received() == [('put', '/', None), ('put', '/a', 1), ('put', '/', None)]
+
+    def test_listener_registration(self):
+        sse = MockSSEClient([
+            _sse_event('put', '/', {'a': 1, 'b': 2}),
+            _sse_event('put', '/a', 3),
+            _sse_event('put', '/', {'a': 3, 'b': 2}),
+            _sse_event('put', '/', {'a': 3, 'b': 4}),
+        ])
+        registration = db.ListenerRegistration(self.callback, sse)
+        TestListenerRegistration.wait_for(self.events, count=3)
+        registration.close()
+        assert self.received() == [
+            ('put', '/', {'a': 1, 'b': 2}), ('put', '/a', 3), ('patch', '/', {'b': 4})]
+
+    @pytest.mark.parametrize('resync', [True, False])
+    def test_listen(self, resync, monkeypatch):
+        callbacks = []
+        monkeypatch.setattr(db.Reference, '_listen_with_session',
+                            lambda self, callback, session: callbacks.append(callback))
+        firebase_admin.initialize_app(
+            testutils.MockCredential(), {'databaseURL' : 'https://test.firebaseio.com'})
+        try:
+            db.reference('/test').listen(self.events.append, resync=resync)
+        finally:
+            testutils.cleanup_apps()
+        assert isinstance(callbacks[0], _db_listeners.ResyncFilter) is resync
+
+
+class TestEvent(object):
+    """Test cases for decoding realtime update events."""
+
+    @classmethod
+    def make_event(cls, payload, event_type='put'):
+        return db.Event(_sseclient.Event(data=payload, event_type=event_type))
+
+    @pytest.mark.parametrize('data', [
+        None, True, 1, 1.5, 'foo', 'a } b', [1, 'b'], {}, {'a': {'b': [1, None]}, 'c': '}'},
+    ])
+    def test_data(self, data):
+        payload = json.dumps({'path': '/foo/bar', 'data': data})
+        event = self.make_event(payload)
+        assert event.event_type == 'put'
+        assert event.path == '/foo/bar'
+        assert event.data == data
+        assert json.loads(event.raw_data.decode('utf-8')) == data
+        assert isinstance(event.raw_data, bytes)
+
+    def test_data_decoded_lazily(self):
+        event = self.make_event('{"path":"/foo","data":{"a": not json}}')
+        assert event.path == '/foo'
+        assert event.raw_data == b'{"a": not json}'
+        with pytest.raises(ValueError):
+            _ = event.data
+
+    def test_data_decoded_once(self):
+        event = self.make_event('{"path":"/foo","data":{"a": 1}}')
+        assert event.data is event.data
+
+    def test_whitespace(self):
+        event = self.make_event(' { "path" : "/f\\u00f6o" ,\n "data" : [1, 2] } ')
+        assert event.path == u'/f\u00f6o'
+        assert event.data == [1, 2]
+        assert event.raw_data == b'[1, 2]'
+
+    def test_unicode_data(self):
+        event = self.make_event(u'{"path":"/","data":"f\u00f6o"}')
+        assert event.data == u'f\u00f6o'
+        assert event.raw_data == u'"f\u00f6o"'.encode('utf-8')
+
+    @pytest.mark.parametrize('payload', [
+        '{"data":{"a": 1},"path":"/foo"}',
+        '{"path":"/foo","data":{"a": 1},"extra":true}',
+    ])
+    def test_other_formats(self, payload):
+        event = self.make_event(payload)
+        assert event.path == '/foo'
+        assert event.data == {'a': 1}
+        assert json.loads(event.raw_data.decode('utf-8')) == {'a': 1}
+
+    def test_invalid_payload(self):
+        with pytest.raises(ValueError):
+            self.make_event('not json')
+
+
+class TestDispatchExecutor(object):
+    """Test cases for dispatching listener callbacks to worker threads."""
+
+    def setup_method(self):
+        self.gate = threading.Event()
+        self.results = []
+        self.executor = None
+
+    def teardown_method(self):
+        self.gate.set()
+        if self.executor:
+            self.executor.shutdown()
+
+    def start(self, overflow='block', max_queue_size=2):
+        """Starts an executor with a single worker, which stays busy until the gate is set."""
+        self.executor = _db_listeners.DispatchExecutor(
+            1, 'Test', max_queue_size=max_queue_size, overflow=overflow)
+        started = threading.Event()
+        def block():
+            started.set()
+            self.gate.wait()
+        self.executor.submit('key', block)
+        assert started.wait(5)
+        return self.executor
+
+    def submit(self, path, event_type='put'):
+        sse_event = _sseclient.Event(
+            data=json.dumps({'path': path, 'data': None}), event_type=event_type)
+        self.executor.submit_event('key', self.record, sse_event)
+
+    def submit_in_background(self, path, event_type='put'):
+        thread = threading.Thread(target=self.submit, args=(path, event_type))
+        thread.start()
+        time.sleep(0.1)
+        return thread
+
+    def record(self, sse_event):
+        self.results.append('{0} {1}'.format(sse_event.event_type, db.Event(sse_event).path))
+
+    def finish(self, dispatched):
+        self.gate.set()
+        must_end = time.time() + 5
+        while self.executor.stats().dispatched < dispatched:
+            assert time.time() < must_end
+            time.sleep(0.01)
+        return self.executor.stats()
+
+    def test_order(self):
+        executor = _db_listeners.DispatchExecutor(4, 'Test')
+        results = collections.defaultdict(list)
+        try:
+            for i in range(100):
+                for key in ('a', 'b', 'c'):
+                    executor.submit(key, results[key].append, i)
+            must_end = time.time() + 5
+            while executor.stats().dispatched < 300:
+                assert time.time() < must_end
+                time.sleep(0.01)
+        finally:
+            executor.shutdown()
+        assert results == {key: list(range(100)) for key in ('a', 'b', 'c')}
+
+    def test_block(self):
+        self.start('block')
+        self.submit('/a')
+        self.submit('/b')
+        stats = self.executor.stats()
+        assert stats.queue_depth == 2
+        assert stats.queue_capacity == 2
+        thread = self.submit_in_background('/c')
+        assert thread.is_alive()
+        stats = self.finish(4)
+        thread.join()
+        assert self.results == ['put /a', 'put /b', 'put /c']
+        assert stats.queue_depth == 0
+        assert stats.max_queue_depth == 2
+        assert stats.dropped == 0
+        assert stats.coalesced == 0
+
+    def test_drop_oldest(self):
+        self.start('drop_oldest')
+        for path in ('/a', '/b', '/c', '/d'):
+            self.submit(path)
+        stats = self.finish(3)
+        assert self.results == ['put /c', 'put /d']
+        assert stats.max_queue_depth == 2
+        assert stats.dropped == 2
+        assert stats.coalesced == 0
+
+    def test_coalesce(self):
+        self.start('coalesce')
+        self.submit('/a', 'patch')
+        self.submit('/b')
+        self.submit('/a')
+        stats = self.executor.stats()
+        assert stats.queue_depth == 2
+        assert stats.coalesced == 1
+        stats = self.finish(3)
+        assert self.results == ['put /b', 'put /a']
+        assert stats.dropped == 0
+        assert stats.coalesced == 1
+
+    @pytest.mark.parametrize('path, event_type', [('/c', 'put'), ('/a', 'patch')])
+    def test_coalesce_blocks(self, path, event_type):
+        self.start('coalesce')
+        self.submit('/a')
+        self.submit('/b')
+        thread = self.submit_in_background(path, event_type)
+        assert thread.is_alive()
+        stats = self.finish(4)
+        thread.join()
+        assert self.results == ['put /a', 'put /b', '{0} {1}'.format(event_type, path)]
+        assert stats.coalesced == 0
+
+    def test_unbounded(self):
+        self.start(max_queue_size=0)
+        for i in range(100):
+            self.submit('/{0}'.format(i))
+        stats = self.finish(101)
+        assert len(self.results) == 100
+        assert stats.max_queue_depth == 100
+        assert stats.queue_capacity == 0
+
+
+@pytest.mark.skipif(
+    _db_listeners.selectors is None, reason='Listener multiplexing requires Python 3')
+class TestListenerManager(object):
+    """Test cases for listeners multiplexed by a _ListenerManager."""
+
+    payload = ('event: put\nretry: 10\ndata: {"path":"/foo","data":"testevent1"}\n\n'
+               'event: keep-alive\ndata: null\n\n'
+               'event: patch\ndata: {"path":"/bar","data":{"a": 1}}\n\n')
+
+    def setup_method(self):
+        self.events = []
+        self.dispatcher = _db_listeners.DispatchExecutor(2, 'ListenerDispatch')
+        self.manager = _db_listeners.ListenerManager(
+            testutils.MockGoogleCredential(), self.dispatcher)
+
+    def teardown_method(self):
+        self.manager.close()
+        self.dispatcher.shutdown()
+
+    def callback(self, event):
+        self.events.append(event)
+
+    @classmethod
+    def listener_thread_count(cls):
+        # Excludes the threads of the test servers.
+        return len([t for t in threading.enumerate() if t.name.startswith('Listener')])
+
+    def test_listen(self, keepalive_server):
+        keepalive_server.serve_content(self.payload, 200, {'Content-Type': 'text/event-stream'})
+        registration = self.manager.listen(keepalive_server.url + '/test.json', self.callback)
+        assert isinstance(registration, db.ListenerRegistration)
+        TestListenerRegistration.wait_for(self.events, count=2)
+        registration.close()
+        event = self.events[0]
+        assert event.event_type == 'put'
+        assert event.path == '/foo'
+        assert event.data == 'testevent1'
+        event = self.events[1]
+        assert event.event_type == 'patch'
+        assert event.path == '/bar'
+        assert event.data == {'a': 1}
+        request = keepalive_server.requests[0]
+        assert request.path == '/test.json'
+        assert request.headers['Authorization'] == 'Bearer mock-token'
+        assert request.headers['Accept'] == 'text/event-stream'
+
+    def test_reconnect(self, keepalive_server):
+        keepalive_server.serve_content(self.payload, 200, {'Content-Type': 'text/event-stream'})
+        registration = self.manager.listen(keepalive_server.url + '/test.json', self.callback)
+        TestListenerRegistration.wait_for(self.events, count=6)
+        registration.close()
+        assert len(keepalive_server.requests) >= 3
+        assert [e.path for e in self.events[:6]] == ['/foo', '/bar'] * 3
+
+    def test_constant_thread_count(self, keepalive_server):
+        keepalive_server.serve_content(self.payload, 200, {'Content-Type': 'text/event-stream'})
+        thread_count = self.listener_thread_count()
+        url = keepalive_server.url + '/test.json'
+        registrations = [self.manager.listen(url, self.callback) for _ in range(20)]
+        assert self.manager.listener_count == 20
+        TestListenerRegistration.wait_for(self.events, count=40)
+        # Only the I/O thread is added, regardless of the number of listeners.
+        assert self.listener_thread_count() == thread_count + 1
+        for registration in registrations:
+            registration.close()
+        assert self.manager.listener_count == 0
+
+    def test_close_stops_events(self, keepalive_server):
+        keepalive_server.serve_content(self.payload, 200, {'Content-Type': 'text/event-stream'})
+        registration = self.manager.listen(keepalive_server.url + '/test.json', self.callback)
+        TestListenerRegistration.wait_for(self.events, count=2)
+        registration.close()
+        time.sleep(0.1)
+        count = len(self.events)
+        time.sleep(0.1)
+        assert len(self.events) == count
+
+    def test_callback_error_stops_listener(self, keepalive_server):
+        keepalive_server.serve_content(self.payload, 200, {'Content-Type': 'text/event-stream'})
+        def callback(event):
+            self.events.append(event)
+            raise ValueError('test error')
+        registration = self.manager.listen(keepalive_server.url + '/test.json', callback)
+        TestListenerRegistration.wait_for(self.events)
+        time.sleep(0.1)
+        assert registration.closed
+        assert len(self.events) == 1
+        assert self.manager.listener_count == 0
+
+    def test_listen_error(self, keepalive_server):
+        keepalive_server.serve_content(json.dumps({'error' : 'json error message'}), 500)
+        with pytest.raises(db.ApiCallError) as excinfo:
+            self.manager.listen(keepalive_server.url + '/test.json', self.callback)
+        assert 'Reason: json error message' in str(excinfo.value)
+        assert self.manager.listener_count == 0
+
+    def test_listen_falls_back_to_thread(self, httpserver):
+        # The server closes the connection after each response, so the socket of the stream is not
+        # available for multiplexing.
+        httpserver.serve_content(self.payload, 200, {'Content-Type': 'text/event-stream'})
+        thread_count = self.listener_thread_count()
+        registration = self.manager.listen(httpserver.url + '/test.json', self.callback)
+        assert isinstance(registration.stream, _sseclient.SSEClient)
+        assert self.manager.listener_count == 1
+        TestListenerRegistration.wait_for(self.events, count=2)
+        assert [e.path for e in self.events[:2]] == ['/foo', '/bar']
+        # The stream is read by a thread of its own, and the I/O thread is not started.
+        assert self.listener_thread_count() == thread_count + 1
+        assert registration.thread.name == 'ListenerStream'
+        registration.close()
+        registration.thread.join(5)
+        assert not registration.thread.is_alive()
+        assert self.manager.listener_count == 0
+
+
+class _MirrorReference(db.Reference):
+    """A Reference that feeds a fixed sequence of events to its listeners."""
+
+    def __init__(self, events, path='/test'):
+        db.Reference.__init__(self, path=path)
+        self.sse = MockSSEClient([_sseclient.Event.parse(e) for e in events])
+
+    def listen(self, callback):
+        return db.ListenerRegistration(callback, self.sse)
+
+
+class TestMirror(object):
+    """Test cases for db.Mirror."""
+
+    snapshot = {
+        'flags': {'a': True, 'b': False},
+        'users': {
+            'alice': {'age': 30, 'name': 'Alice'},
+            'bob': {'age': 25, 'name': 'Bob'},
+            'carol': {'age': 35, 'name': 'Carol'},
+            'dave': {'name': 'Dave'},
+        },
+        'list': [1, 2, 3],
+    }
+
+    def mirror(self, *events):
+        initial = 'event: put\ndata: {0}\n\n'.format(
+            json.dumps({'path': '/', 'data': self.snapshot}))
+        mirror = _MirrorReference([initial] + list(events)).mirror()
+        assert mirror.wait_for_sync(5)
+        # Wait for the listener thread to apply all the events.
+        mirror._store._registration._thread.join(5)
+        return mirror
+
+    @staticmethod
+    def event(event_type, path, data):
+        return 'event: {0}\ndata: {1}\n\n'.format(
+            event_type, json.dumps({'path': path, 'data': data}))
+
+    def test_initial_snapshot(self):
+        mirror = self.mirror()
+        assert mirror.synced
+        assert mirror.path == '/test'
+        assert mirror.key == 'test'
+        assert mirror.get() == self.snapshot
+        assert mirror.last_sync_time is not None
+        assert mirror.last_update_time >= mirror.last_sync_time
+        assert mirror.memory_usage() > 0
+        mirror.close()
+        assert mirror._store.ref.sse.closed
+
+    def test_child(self):
+        mirror = self.mirror()
+        child = mirror.child('users/alice')
+        assert child.path == '/test/users/alice'
+        assert child.key == 'alice'
+        assert child.get() == {'age': 30, 'name': 'Alice'}
+        assert child.child('name').get() == 'Alice'
+        assert mirror.child('list/1').get() == 2
+        assert mirror.child('missing/child').get() is None
+        assert child.memory_usage() < mirror.memory_usage()
+
+    @pytest.mark.parametrize('child', TestReferencePath.invalid_children)
+    def test_invalid_child(self, child):
+        mirror = self.mirror()
+        with pytest.raises(ValueError):
+            mirror.child(child)
+
+    def test_get_returns_copy(self):
+        mirror = self.mirror()
+        value = mirror.get()
+        value['flags']['a'] = 'modified'
+        assert mirror.child('flags/a').get() is True
+
+    def test_put(self):
+        mirror = self.mirror(
+            self.event('put', '/flags/c', 'new'),
+            self.event('put', '/users/bob', None),
+            self.event('put', '/flags', {'a': None}))
+        assert mirror.child('flags').get() is None
+        assert sorted(mirror.child('users').get().keys()) == ['alice', 'carol', 'dave']
+
+    def test_patch(self):
+        mirror = self.mirror(
+            self.event('patch', '/users', {'bob': {'age': 26}, 'erin/age': 40, 'dave': None}),
+            self.event('patch', '/', {'flags/b': True}))
+        assert mirror.child('users/bob').get() == {'age': 26}
+        assert mirror.child('users/erin').get() == {'age': 40}
+        assert mirror.child('users/dave').get() is None
+        assert mirror.child('flags').get() == {'a': True, 'b': True}
+
+    def test_patch_array(self):
+        mirror = self.mirror(
+            self.event('patch', '/list', {'1': 5}),
+            self.event('put', '/list/3', 4))
+        assert mirror.child('list').get() == [1, 5, 3, 4]
+        assert mirror.get()['list'] == [1, 5, 3, 4]
+        assert mirror.child('list/1').get() == 5
+
+    def test_patch_sparse_array(self):
+        mirror = self.mirror(
+            self.event('patch', '/list', {'0': None, '1': None}),
+            self.event('put', '/list/5', 6))
+        # Fewer than half of the indices have values, so the server would return an object.
+        assert mirror.child('list').get() == {'2': 3, '5': 6}
+        mirror = self.mirror(self.event('patch', '/list', {'0': None}))
+        assert mirror.child('list').get() == [None, 2, 3]
+
+    def test_resync(self):
+        mirror = self.mirror(self.event('put', '/', {'foo': 'bar'}))
+        assert mirror.get() == {'foo': 'bar'}
+
+    def test_order_by_child(self):
+        users = self.mirror().child('users')
+        result = users.order_by_child('age').get()
+        assert isinstance(result, collections.OrderedDict)
+        assert list(result.keys()) == ['dave', 'bob', 'alice', 'carol']
+        result = users.order_by_child('age').start_at(26).end_at(35).get()
+        assert list(result.keys()) == ['alice', 'carol']
+        result = users.order_by_child('age').equal_to(25).get()
+        assert list(result.keys()) == ['bob']
+        result = users.order_by_child('age').start_at(26).limit_to_first(1).get()
+        assert list(result.keys()) == ['alice']
+        result = users.order_by_child('age').limit_to_last(2).get()
+        assert list(result.keys()) == ['alice', 'carol']
+        assert users.order_by_child('age').limit_to_last(0).get() == {}
+        result = users.order_by_child('name').start_at('B').end_at('C~').get()
+        assert list(result.keys()) == ['bob', 'carol']
+
+    def test_order_by_key(self):
+        users = self.mirror().child('users')
+        result = users.order_by_key().start_at('b').limit_to_first(2).get()
+        assert list(result.keys()) == ['bob', 'carol']
+
+    def test_order_by_value(self):
+        flags = self.mirror().child('flags')
+        assert list(flags.order_by_value().get().keys()) == ['b', 'a']
+        assert list(flags.order_by_value().equal_to(True).get().keys()) == ['a']
+        result = self.mirror().child('list').order_by_value().start_at(2).get()
+        assert list(result.items()) == [('1', 2), ('2', 3)]
+
+    def test_query_on_leaf(self):
+        assert self.mirror().child('users/alice/age').order_by_key().get() == 30
+
+    def test_stream(self):
+        users = self.mirror().child('users')
+        result = users.order_by_child('age').start_at(26).stream()
+        assert list(result) == list(users.order_by_child('age').start_at(26).get().items())
+        assert list(self.mirror().child('users/alice/age').order_by_key().stream()) == []
+
+    @pytest.mark.parametrize('path', ['', None, '/', '/foo', '$key', '$value', '$priority'])
+    def test_invalid_order_by_child(self, path):
+        with pytest.raises(ValueError):
+            self.mirror().order_by_child(path)
+
+
+class TestExportSubtree(object):
+    """Test cases for db.export_subtree()."""
+
+    test_url = 'https://test.firebaseio.com'
+    tree = {
+        'users': {
+            'alice': {'name': 'Alice', 'age': 30},
+            'bob': {'name': 'Bob', 'age': 25},
+            '10': 'ten',
+            '9': 'nine',
+        },
+        'count': 4,
+    }
+
+    @classmethod
+    def setup_class(cls):
+        firebase_admin.initialize_app(testutils.MockCredential(), {'databaseURL' : cls.test_url})
+
+    @classmethod
+    def teardown_class(cls):
+        testutils.cleanup_apps()
+
+    def instrument(self, ref):
+        recorder = []
+        ref._client.session.mount(self.test_url, MockTreeAdapter(self.tree, recorder))
+        return recorder
+
+    @pytest.mark.parametrize('concurrency', [1, 2, 10])
+    def test_export_to_file(self, concurrency):
+        ref = db.reference('/users')
+        recorder = self.instrument(ref)
+        sink = six.StringIO()
+        assert db.export_subtree(ref, sink, concurrency=concurrency) == 4
+        lines = sink.getvalue().splitlines()
+        assert [json.loads(line) for line in lines] == [
+            {'path': '/users/9', 'value': 'nine'},
+            {'path': '/users/10', 'value': 'ten'},
+            {'path': '/users/alice', 'value': {'name': 'Alice', 'age': 30}},
+            {'path': '/users/bob', 'value': {'name': 'Bob', 'age': 25}},
+        ]
+        assert len(recorder) == 5
+        assert recorder[0].url == self.test_url + '/users.json?shallow=true'
+        urls = sorted(r.url for r in recorder[1:])
+        assert urls == sorted(
+            '{0}/users/{1}.json'.format(self.test_url, key) for key in self.tree['users'])
+
+    def test_export_to_callback(self):
+        ref = db.reference('/')
+        self.instrument(ref)
+        lines = []
+        assert db.export_subtree(ref, lines.append) == 2
+        assert [json.loads(line)['path'] for line in lines] == ['/count', '/users']
+        assert json.loads(lines[1])['value'] == self.tree['users']
+
+    def test_export_leaf(self):
+        ref = db.reference('/count')
+        recorder = self.instrument(ref)
+        lines = []
+        assert db.export_subtree(ref, lines.append) == 1
+        assert [json.loads(line) for line in lines] == [{'path': '/count', 'value': 4}]
+        assert len(recorder) == 1
+
+    def test_export_empty(self):
+        ref = db.reference('/missing')
+        self.instrument(ref)
+        lines = []
+        assert db.export_subtree(ref, lines.append) == 0
+        assert lines == []
+
+    def test_export_error(self):
+        ref = db.reference('/users')
+        adapter = testutils.MockMultiRequestAdapter(
+            [json.dumps({'alice': True}), json.dumps({'error': 'json error message'})],
+            [200, 500], [])
+        ref._client.session.mount(self.test_url, adapter)
+        lines = []
+        with pytest.raises(db.ApiCallError) as excinfo:
+            db.export_subtree(ref, lines.append)
+        assert 'Reason: json error message' in str(excinfo.value)
+        assert lines == []
+
+    @pytest.mark.parametrize('ref', [None, 'users', _Object()])
+    def test_invalid_ref(self, ref):
+        with pytest.raises(ValueError):
+            db.export_subtree(ref, lambda line: None)
+
+    @pytest.mark.parametrize('sink', [None, 'file', 1, _Object()])
+    def test_invalid_sink(self, sink):
+        with pytest.raises(ValueError):
+            db.export_subtree(db.reference('/users'), sink)
+
+    @pytest.mark.parametrize('concurrency', [None, 0, -1, 1.5, '2', True])
+    def test_invalid_concurrency(self, concurrency):
+        with pytest.raises(ValueError):
+            db.export_subtree(db.reference('/users'), lambda line: None, concurrency=concurrency)
+
+
+class TestGetMany(object):
+    """Test cases for db.get_many()."""
+
+    test_url = 'https://test.firebaseio.com'
+    tree = {
+        'users': {
+            'alice': {'name': 'Alice', 'age': 30},
+            'bob': {'name': 'Bob', 'age': 25},
+            'carol': {'name': 'Carol', 'age': 35},
+        },
+    }
+
+    @classmethod
+    def setup_class(cls):
+        firebase_admin.initialize_app(testutils.MockCredential(), {'databaseURL' : cls.test_url})
+
+    @classmethod
+    def teardown_class(cls):
+        testutils.cleanup_apps()
+
+    def instrument(self, errors=None):
+        recorder = []
+        adapter = MockTreeAdapter(self.tree, recorder, errors)
+        db.reference()._client.session.mount(self.test_url, adapter)
+        return recorder
+
+    @pytest.mark.parametrize('concurrency', [1, 2, 10])
+    def test_get_many(self, concurrency):
+        recorder = self.instrument()
+        keys = ['carol', 'alice', 'missing', 'bob', 'alice']
+        refs = [db.reference('/users/{0}'.format(key)) for key in keys]
+        result = db.get_many(refs, concurrency=concurrency)
+        assert result == [self.tree['users'].get(key) for key in keys]
+        assert len(recorder) == len(keys)
+
+    def test_get_many_queries(self):
+        self.instrument()
+        ref = db.reference('/users')
+        result = db.get_many([ref.child('alice').child('name'), ref.order_by_child('age')])
+        assert result[0] == 'Alice'
+        assert list(result[1].keys()) == ['bob', 'alice', 'carol']
+
+    def test_get_many_errors(self):
+        recorder = self.instrument({'/users/bob.json': 500, '/users/carol.json': 403})
+        refs = [db.reference('/users/{0}'.format(key)) for key in ['alice', 'bob', 'carol']]
+        result = db.get_many(tuple(refs))
+        assert result[0] == self.tree['users']['alice']
+        for idx, path in [(1, '/users/bob.json'), (2, '/users/carol.json')]:
+            assert isinstance(result[idx], db.ApiCallError)
+            assert 'Reason: error at {0}'.format(path) in str(result[idx])
+        assert len(recorder) == 3
+
+    def test_get_many_empty(self):
+        recorder = self.instrument()
+        assert db.get_many([]) == []
+        assert recorder == []
+
+    @pytest.mark.parametrize('refs', [None, 'foo', db, {}, [None], ['/users'], [_Object()]])
+    def test_invalid_refs(self, refs):
+        with pytest.raises(ValueError):
+            db.get_many(refs)
+
+    @pytest.mark.parametrize('concurrency', [None, 0, -1, 1.5, '2', True])
+    def test_invalid_concurrency(self, concurrency):
+        with pytest.raises(ValueError):
+            db.get_many([db.reference('/users')], concurrency=concurrency)
+
+
+class MockLargeTreeAdapter(MockTreeAdapter):
+    """A mock HTTP adapter that refuses to read the specified locations in one piece."""
+
+    def __init__(self, tree, recorder, too_large=(), timeouts=()):
+        MockTreeAdapter.__init__(self, tree, recorder)
+        self.too_large = too_large
+        self.timeouts = timeouts
+
+    def send(self, request, **kwargs):
+        url = urllib.parse.urlparse(request.url)
+        if 'shallow=true' not in url.query:
+            if url.path in self.timeouts:
+                with self._lock:
+                    self._recorder.append(request)
+                raise requests.exceptions.Timeout('Read timed out')
+            if url.path in self.too_large:
+                with self._lock:
+                    self._recorder.append(request)
+                resp = models.Response()
+                resp.url = request.url
+                resp.status_code = 400
+                resp.raw = six.BytesIO(json.dumps({
+                    'error': 'Data requested exceeds the maximum size that can be accessed '
+                             'with a single request.'}).encode())
+                return resp
+        return MockTreeAdapter.send(self, request, **kwargs)
+
+
+class TestGetLarge(object):
+    """Test cases for db.get_large()."""
+
+    test_url = 'https://test.firebaseio.com'
+    tree = {
+        'users': {
+            'alice': {'name': 'Alice', 'posts': {'p1': 'hello', 'p2': 'world'}},
+            'bob': {'name': 'Bob', 'posts': {'p3': 'foo'}},
+        },
+        'scores': {'0': 10, '1': 20, '3': 40},
+        'count': 2,
+    }
+
+    @classmethod
+    def setup_class(cls):
+        firebase_admin.initialize_app(testutils.MockCredential(), {'databaseURL' : cls.test_url})
+
+    @classmethod
+    def teardown_class(cls):
+        testutils.cleanup_apps()
+
+    def instrument(self, too_large=(), timeouts=()):
+        recorder = []
+        adapter = MockLargeTreeAdapter(self.tree, recorder, too_large, timeouts)
+        db.reference()._client.session.mount(self.test_url, adapter)
+        return recorder
+
+    def test_get_small(self):
+        recorder = self.instrument()
+        assert db.get_large(db.reference('/users')) == self.tree['users']
+        assert len(recorder) == 1
+        assert recorder[0].url == self.test_url + '/users.json'
+
+    @pytest.mark.parametrize('concurrency', [1, 2, 10])
+    def test_split_too_large(self, concurrency):
+        recorder = self.instrument(too_large=('/users.json', '/users/alice.json'))
+        assert db.get_large(db.reference('/users'), concurrency=concurrency) == self.tree['users']
+        urls = sorted(r.url[len(self.test_url):] for r in recorder)
+        assert urls == sorted([
+            '/users.json', '/users.json?shallow=true', '/users/alice.json',
+            '/users/alice.json?shallow=true', '/users/alice/name.json',
+            '/users/alice/posts.json', '/users/bob.json'])
+
+    def test_split_timeout(self):
+        recorder = self.instrument(timeouts=('/users.json',))
+        assert db.get_large(db.reference('/users')) == self.tree['users']
+        assert len(recorder) == 4
+
+    def test_split_array(self):
+        self.instrument(too_large=('/scores.json',))
+        assert db.get_large(db.reference('/scores')) == [10, 20, None, 40]
+
+    def test_split_leaf(self):
+        self.instrument(too_large=('/count.json',))
+        assert db.get_large(db.reference('/count')) == 2
+
+    def test_split_missing(self):
+        self.instrument(too_large=('/missing.json',))
+        assert db.get_large(db.reference('/missing')) is None
+
+    def test_size_hint(self):
+        recorder = self.instrument()
+        size_hint = _db_bulk._LARGE_READ_MAX_BYTES * 2
+        assert db.get_large(db.reference('/users'), size_hint=size_hint) == self.tree['users']
+        urls = sorted(r.url[len(self.test_url):] for r in recorder)
+        assert urls == ['/users.json?shallow=true', '/users/alice.json', '/users/bob.json']
+
+    def test_small_size_hint(self):
+        recorder = self.instrument()
+        assert db.get_large(db.reference('/users'), size_hint=1024) == self.tree['users']
+        assert len(recorder) == 1
+
+    def test_other_error(self):
+        recorder = []
+        adapter = MockTreeAdapter(self.tree, recorder, {'/users/bob.json': 500})
+        db.reference()._client.session.mount(self.test_url, adapter)
+        with pytest.raises(db.ApiCallError) as excinfo:
+            db.get_large(db.reference('/users/bob'))
+        assert 'Reason: error at /users/bob.json' in str(excinfo.value)
+        assert len(recorder) == 1
+
+    @pytest.mark.parametrize('ref', [None, 'users', _Object()])
+    def test_invalid_ref(self, ref):
+        with pytest.raises(ValueError):
+            db.get_large(ref)
+
+    @pytest.mark.parametrize('size_hint', [-1, 1.5, '2', True, {}])
+    def test_invalid_size_hint(self, size_hint):
+        with pytest.raises(ValueError):
+            db.get_large(db.reference('/users'), size_hint=size_hint)
+
+    @pytest.mark.parametrize('concurrency', [None, 0, -1, 1.5, '2', True])
+    def test_invalid_concurrency(self, concurrency):
+        with pytest.raises(ValueError):
+            db.get_large(db.reference('/users'), concurrency=concurrency)
+
+
+class TestBulkLoad(object):
+    """Test cases for db.bulk_load()."""
+
+    test_url = 'https://test.firebaseio.com'
+
+    @classmethod
+    def setup_class(cls):
+        firebase_admin.initialize_app(testutils.MockCredential(), {'databaseURL' : cls.test_url})
+
+    @classmethod
+    def teardown_class(cls):
+        testutils.cleanup_apps()
+
+    def instrument(self, ref, responses=None, statuses=None):
+        recorder = []
+        adapter = testutils.MockMultiRequestAdapter(
+            responses or [''], statuses or [200], recorder)
+        ref._client.session.mount(self.test_url, adapter)
+        return recorder
+
+    def merged_body(self, recorder):
+        result = {}
+        for req in recorder:
+            assert req.method == 'PATCH'
+            assert req.headers['Content-Type'] == 'application/json'
+            result.update(json.loads(req.body))
+        return result
+
+    def test_load_items(self):
+        ref = db.reference('/test')
+        recorder = self.instrument(ref)
+        data = {'k{0}'.format(i): {'value': i} for i in range(5)}
+        assert db.bulk_load(ref, data.items()) == 5
+        assert len(recorder) == 1
+        assert recorder[0].url == self.test_url + '/test.json?print=silent'
+        assert json.loads(recorder[0].body) == data
+
+    @pytest.mark.parametrize('concurrency', [1, 3])
+    def test_load_batches(self, concurrency):
+        ref = db.reference('/test')
+        recorder = self.instrument(ref)
+        data = {'k{0}'.format(i): {'value': i} for i in range(20)}
+        max_bytes = 64
+        assert db.bulk_load(
+            ref, data.items(), max_payload_bytes=max_bytes, concurrency=concurrency) == 20
+        assert len(recorder) > 1
+        for req in recorder:
+            assert len(req.body) <= max_bytes
+        assert self.merged_body(recorder) == data
+
+    def test_load_nested_paths(self):
+        ref = db.reference('/')
+        recorder = self.instrument(ref)
+        assert db.bulk_load(ref, [('/users/alice', {'age': 30}), ('users/bob/age', 25)]) == 2
+        assert json.loads(recorder[0].body) == {'users/alice': {'age': 30}, 'users/bob/age': 25}
+
+    def test_load_ndjson(self):
+        export_ref = db.reference('/')
+        export_ref._client.session.mount(
+            self.test_url, MockTreeAdapter({'users': {'alice': {'age': 30}}, 'count': 1}, []))
+        sink = six.StringIO()
+        db.export_subtree(export_ref, sink)
+        sink.write('\n')
+
+        ref = db.reference('/backup')
+        recorder = self.instrument(ref)
+        assert db.bulk_load(ref, six.StringIO(sink.getvalue())) == 2
+        assert recorder[0].url == self.test_url + '/backup.json?print=silent'
+        assert json.loads(recorder[0].body) == {'count': 1, 'users': {'alice': {'age': 30}}}
+
+    def test_split_oversized_value(self):
+        ref = db.reference('/test')
+        recorder = self.instrument(ref)
+        value = {'child{0}'.format(i): 'x' * 20 for i in range(10)}
+        assert db.bulk_load(ref, [('big', value), ('small', 1)], max_payload_bytes=100) == 2
+        assert len(recorder) > 1
+        merged = self.merged_body(recorder)
+        expected = {'big/{0}'.format(key): val for key, val in value.items()}
+        expected['small'] = 1
+        assert merged == expected
+
+    def test_split_value_merges(self):
+        ref = db.reference('/test')
+        recorder = self.instrument(ref)
+        value = {'child{0}'.format(i): 'x' * 20 for i in range(10)}
+        assert db.bulk_load(ref, [('big', value)], max_payload_bytes=100) == 1
+        # The parent path is never written, so existing children not in the value are kept.
+        for req in recorder:
+            for path in json.loads(req.body):
+                assert path.startswith('big/')
+
+    def test_retry(self, monkeypatch):
+        monkeypatch.setattr(_db_client, '_BULK_LOAD_RETRY_DELAY_SECONDS', 0)
+        ref = db.reference('/test')
+        recorder = self.instrument(
+            ref, [json.dumps({'error': 'unavailable'}), ''], [503, 200])
+        assert db.bulk_load(ref, [('foo', 'bar')]) == 1
+        assert len(recorder) == 2
+        assert recorder[0].body == recorder[1].body
+
+    def test_retry_exhausted(self, monkeypatch):
+        monkeypatch.setattr(_db_client, '_BULK_LOAD_RETRY_DELAY_SECONDS', 0)
+        ref = db.reference('/test')
+        recorder = self.instrument(ref, [json.dumps({'error': 'unavailable'})], [503])
+        with pytest.raises(db.ApiCallError) as excinfo:
+            db.bulk_load(ref, [('foo', 'bar')])
+        assert 'Reason: unavailable' in str(excinfo.value)
+        assert len(recorder) == _db_client._BULK_LOAD_MAX_RETRIES + 1
+
+    def test_no_retry_on_client_error(self):
+        ref = db.reference('/test')
+        recorder = self.instrument(ref, [json.dumps({'error': 'json error message'})], [400])
+        with pytest.raises(db.ApiCallError) as excinfo:
+            db.bulk_load(ref, [('foo', 'bar')])
+        assert 'Reason: json error message' in str(excinfo.value)
+        assert len(recorder) == 1
+
+    def test_empty_source(self):
+        ref = db.reference('/test')
+        recorder = self.instrument(ref)
+        assert db.bulk_load(ref, []) == 0
+        assert db.bulk_load(ref, six.StringIO('')) == 0
+        assert recorder == []
+
+    @pytest.mark.parametrize('source', [None, 'foo', 1, {'foo': 'bar'}, _Object()])
+    def test_invalid_source(self, source):
+        with pytest.raises(ValueError):
+            db.bulk_load(db.reference('/test'), source)
+
+    @pytest.mark.parametrize('record', [None, 'foo', ('foo',), ('', 1), ('/', 1), ('a.b', 1)])
+    def test_invalid_record(self, record):
+        ref = db.reference('/test')
+        recorder = self.instrument(ref)
+        with pytest.raises(ValueError):
+            db.bulk_load(ref, [record])
+        assert recorder == []
+
+    @pytest.mark.parametrize('line', ['foo', '[]', '{"path": "foo"}', '1'])
+    def test_invalid_ndjson(self, line):
+        ref = db.reference('/test')
+        self.instrument(ref)
+        with pytest.raises(ValueError):
+            db.bulk_load(ref, six.StringIO(line))
+
+    @pytest.mark.parametrize('arg', [None, 0, -1, 1.5, '2', True])
+    def test_invalid_limits(self, arg):
+        ref = db.reference('/test')
+        with pytest.raises(ValueError):
+            db.bulk_load(ref, [], max_payload_bytes=arg)
+        with pytest.raises(ValueError):
+            db.bulk_load(ref, [], concurrency=arg)
+
+    def test_invalid_ref(self):
+        with pytest.raises(ValueError):
+            db.bulk_load('/test', [])
+
+
+class TestWriteBatcher(object):
+    """Test cases for db.WriteBatcher."""
+
+    test_url = 'https://test.firebaseio.com'
+
+    @classmethod
+    def setup_class(cls):
+        firebase_admin.initialize_app(testutils.MockCredential(), {'databaseURL' : cls.test_url})
+
+    @classmethod
+    def teardown_class(cls):
+        testutils.cleanup_apps()
+
+    def instrument(self, responses=None, statuses=None):
+        recorder = []
+        adapter = testutils.MockMultiRequestAdapter(
+            responses or [''], statuses or [200], recorder)
+        db.reference()._client.session.mount(self.test_url, adapter)
+        return recorder
+
+    def test_coalesce_writes(self):
+        recorder = self.instrument()
+        batcher = db.WriteBatcher(flush_interval=None)
+        futures = [
+            batcher.set('/users/alice', {'age': 30}),
+            batcher.set('users/bob/age', 25),
+            batcher.update('/counts', {'a': 1, 'b/c': 2}),
+        ]
+        assert not any(future.done() for future in futures)
+        assert recorder == []
+        batcher.flush()
+        assert all(future.result() is None for future in futures)
+        assert len(recorder) == 1
+        assert recorder[0].method == 'PATCH'
+        assert recorder[0].url == self.test_url + '/.json?print=silent'
+        assert json.loads(recorder[0].body) == {
+            'users/alice': {'age': 30},
+            'users/bob/age': 25,
+            'counts/a': 1,
+            'counts/b/c': 2,
+        }
+
+    def test_latest_write_wins(self):
+        recorder = self.instrument()
+        batcher = db.WriteBatcher(flush_interval=None)
+        first = batcher.set('foo', 'first')
+        second = batcher.update('/', {'foo': 'second'})
+        batcher.flush()
+        assert first.result() is None
+        assert second.result() is None
+        assert len(recorder) == 1
+        assert json.loads(recorder[0].body) == {'foo': 'second'}
+
+    @pytest.mark.parametrize('paths', [('a', 'a/b'), ('a/b', 'a'), ('a/b/c', 'a')])
+    def test_nested_writes(self, paths):
+        recorder = self.instrument()
+        batcher = db.WriteBatcher(flush_interval=None)
+        batcher.set('other', 0)
+        first = batcher.set(paths[0], 1)
+        assert len(recorder) == 0
+        second = batcher.set(paths[1], 2)
+        assert first.done()
+        assert not second.done()
+        batcher.flush()
+        assert second.result() is None
+        assert [json.loads(req.body) for req in recorder] == [
+            {'other': 0, paths[0]: 1}, {paths[1]: 2}]
+
+    def test_sibling_prefix_writes(self):
+        recorder = self.instrument()
+        batcher = db.WriteBatcher(flush_interval=None)
+        batcher.set('ab', 1)
+        batcher.set('a/b', 2)
+        batcher.set('a/bc', 3)
+        batcher.flush()
+        assert len(recorder) == 1
+
+    def test_max_writes(self):
+        recorder = self.instrument()
+        batcher = db.WriteBatcher(max_writes=3, flush_interval=None)
+        futures = [batcher.set('key{0}'.format(i), i) for i in range(7)]
+        assert len(recorder) == 2
+        assert all(future.done() for future in futures[:6])
+        assert not futures[6].done()
+        batcher.flush()
+        assert len(recorder) == 3
+        assert [len(json.loads(req.body)) for req in recorder] == [3, 3, 1]
+
+    def test_max_payload_bytes(self):
+        recorder = self.instrument()
+        batcher = db.WriteBatcher(max_payload_bytes=30, flush_interval=None)
+        batcher.set('foo', 'x' * 10)
+        assert len(recorder) == 0
+        batcher.set('bar', 'y' * 10)
+        assert len(recorder) == 1
+        assert json.loads(recorder[0].body) == {'foo': 'x' * 10, 'bar': 'y' * 10}
+
+    def test_flush_interval(self):
+        recorder = self.instrument()
+        batcher = db.WriteBatcher(flush_interval=0.01)
+        future = batcher.set('foo', 'bar')
+        assert future.result() is None
+        assert len(recorder) == 1
+        assert json.loads(recorder[0].body) == {'foo': 'bar'}
+
+    def test_failure(self):
+        recorder = self.instrument([json.dumps({'error': 'json error message'})], [400])
+        batcher = db.WriteBatcher(flush_interval=None)
+        futures = [batcher.set('foo', 1), batcher.update('bar', {'baz': 2})]
+        batcher.flush()
+        for future in futures:
+            with pytest.raises(db.ApiCallError) as excinfo:
+                future.result()
+            assert 'Reason: json error message' in str(excinfo.value)
+            assert future.exception() is excinfo.value
+        assert len(recorder) == 1
+
+    def test_unexpected_failure(self, monkeypatch):
+        batcher = db.WriteBatcher(flush_interval=None)
+        def patch_entries(*_):
+            raise ValueError('unexpected error')
+        monkeypatch.setattr(batcher._client, 'patch_entries', patch_entries)
+        futures = [batcher.set('foo', 1), batcher.update('bar', {'baz': 2})]
+        batcher.flush()
+        for future in futures:
+            with pytest.raises(ValueError) as excinfo:
+                future.result()
+            assert str(excinfo.value) == 'unexpected error'
+
+    def test_close(self):
+        recorder = self.instrument()
+        batcher = db.WriteBatcher()
+        future = batcher.set('foo', 'bar')
+        batcher.close()
+        assert future.done()
+        assert len(recorder) == 1
+        with pytest.raises(ValueError):
+            batcher.set('foo', 'bar')
+        with pytest.raises(ValueError):
+            batcher.update('foo', {'bar': 1})
+
+    def test_empty_flush(self):
+        recorder = self.instrument()
+        batcher = db.WriteBatcher()
+        batcher.flush()
+        batcher.close()
+        assert recorder == []
+
+    @pytest.mark.parametrize('path', ['', '/', None, 1, 'a.b', 'a$b'])
+    def test_set_invalid_path(self, path):
+        with pytest.raises(ValueError):
+            db.WriteBatcher().set(path, 1)
+
+    def test_set_none_value(self):
+        with pytest.raises(ValueError):
+            db.WriteBatcher().set('foo', None)
+
+    @pytest.mark.parametrize('value', [
+        None, {}, [], 'foo', {None: 1}, {'': 1}, {'a': 1, 'a/b': 2}, {'a/b': 1, 'a': 2}])
+    def test_update_invalid_value(self, value):
+        with pytest.raises(ValueError):
+            db.WriteBatcher().update('/', value)
+
+    @pytest.mark.parametrize('arg', [None, 0, -1, 1.5, '2', True])
+    def test_invalid_limits(self, arg):
+        with pytest.raises(ValueError):
+            db.WriteBatcher(max_writes=arg)
+        with pytest.raises(ValueError):
+            db.WriteBatcher(max_payload_bytes=arg)
+
+    @pytest.mark.parametrize('interval', [0, -1, '1', True, _Object()])
+    def test_invalid_flush_interval(self, interval):
+        with pytest.raises(ValueError):
+            db.WriteBatcher(flush_interval=interval)
+
+
+class MockETagAdapter(adapters.HTTPAdapter):
+    """A mock HTTP adapter that serves values along with ETags, and honors if-none-match."""
+
+    def __init__(self, values, recorder):
+        adapters.HTTPAdapter.__init__(self)
+        self.values = values
+        self._recorder = recorder
+
+    def send(self, request, **kwargs):
+        self._recorder.append(request)
+        path = urllib.parse.urlparse(request.url).path
+        value = self.values.get(path[:-len('.json')] or '/')
+        etag = str(hash(json.dumps(value, sort_keys=True)))
+        resp = models.Response()
+        resp.url = request.url
+        resp.headers['ETag'] = etag
+        if request.method != 'GET':
+            resp.status_code = 200
+            resp.raw = six.BytesIO(b'')
+        elif request.headers.get('if-none-match') == etag:
+            resp.status_code = 304
+            resp.raw = six.BytesIO(b'')
+        else:
+            resp.status_code = 200
+            resp.raw = six.BytesIO(json.dumps(value).encode())
+        return resp
+
+
+class TestReadCache(object):
+    """Test cases for the ETag-revalidating read cache."""
+
+    test_url = 'https://test.firebaseio.com'
+
+    def setup_method(self):
+        self.values = {'/foo': {'bar': 'baz'}, '/foo/bar': 'baz', '/other': 1}
+
+    def teardown_method(self):
+        testutils.cleanup_apps()
+
+    def init_app(self, **options):
+        options['databaseURL'] = self.test_url
+        firebase_admin.initialize_app(testutils.MockCredential(), options)
+        recorder = []
+        db.reference()._client.session.mount(
+            self.test_url, MockETagAdapter(self.values, recorder))
+        return recorder
+
+    def test_revalidate(self):
+        recorder = self.init_app(databaseCacheMaxBytes=1024)
+        ref = db.reference('/foo')
+        first = ref.get()
+        assert first == {'bar': 'baz'}
+        assert recorder[0].headers['X-Firebase-ETag'] == 'true'
+        assert 'if-none-match' not in recorder[0].headers
+
+        second = ref.get()
+        assert second == first
+        assert second is not first
+        assert len(recorder) == 2
+        assert recorder[1].headers['if-none-match'] == str(
+            hash(json.dumps({'bar': 'baz'}, sort_keys=True)))
+
+    @pytest.mark.parametrize('max_age', [None, 60])
+    def test_modify_returned_value(self, max_age):
+        options = {'databaseCacheMaxBytes': 1024}
+        if max_age:
+            options['databaseCacheMaxAge'] = max_age
+        self.values['/foo'] = {'bar': {'baz': [1, 2]}}
+        self.init_app(**options)
+        ref = db.reference('/foo')
+        first = ref.get()
+        first['bar']['baz'].append(3)
+        first['qux'] = True
+        second = ref.get()
+        assert second == {'bar': {'baz': [1, 2]}}
+        second['bar']['baz'][0] = 10
+        assert ref.get() == {'bar': {'baz': [1, 2]}}
+
+    def test_changed_value(self):
+        recorder = self.init_app(databaseCacheMaxBytes=1024)
+        ref = db.reference('/foo')
+        assert ref.get() == {'bar': 'baz'}
+        self.values['/foo'] = {'bar': 'qux'}
+        assert ref.get() == {'bar': 'qux'}
+        assert ref.get() == {'bar': 'qux'}
+        assert len(recorder) == 3
+
+    def test_get_with_etag(self):
+        self.init_app(databaseCacheMaxBytes=1024)
+        ref = db.reference('/foo')
+        value, etag = ref.get(etag=True)
+        assert value == {'bar': 'baz'}
+        assert etag == str(hash(json.dumps({'bar': 'baz'}, sort_keys=True)))
+        assert ref.get(etag=True) == (value, etag)
+
+    def test_max_age(self):
+        recorder = self.init_app(databaseCacheMaxBytes=1024, databaseCacheMaxAge=60)
+        ref = db.reference('/foo')
+        assert ref.get() == {'bar': 'baz'}
+        assert ref.get() == {'bar': 'baz'}
+        assert len(recorder) == 1
+
+    def test_shallow_not_cached(self):
+        recorder = self.init_app(databaseCacheMaxBytes=1024, databaseCacheMaxAge=60)
+        ref = db.reference('/foo')
+        ref.get(shallow=True)
+        ref.get(shallow=True)
+        assert len(recorder) == 2
+        assert ref._client.read_cache.size == 0
+
+    @pytest.mark.parametrize('write_path, invalidated', [
+        ('/foo', True), ('/foo/bar', True), ('/', True), ('/other', False), ('/foobar', False)])
+    def test_write_invalidates(self, write_path, invalidated):
+        recorder = self.init_app(databaseCacheMaxBytes=1024, databaseCacheMaxAge=60)
+        db.reference('/foo').get()
+        db.reference('/foo/bar').get()
+        assert len(recorder) == 2
+        db.reference(write_path).update({'key': 'value'})
+        db.reference('/foo').get()
+        db.reference('/foo/bar').get()
+        assert len(recorder) == (5 if invalidated else 3)
+
+    def test_byte_budget(self):
+        recorder = self.init_app(databaseCacheMaxBytes=15, databaseCacheMaxAge=60)
+        cache = db.reference()._client.read_cache
+        db.reference('/foo').get()
+        assert cache.size == len(json.dumps({'bar': 'baz'}))
+        db.reference('/foo/bar').get()
+        db.reference('/other').get()
+        assert cache.size == len('"baz"') + len('1')
+        assert len(recorder) == 3
+
+        # The least recently used entry (/foo) has been evicted.
+        db.reference('/other').get()
+        db.reference('/foo/bar').get()
+        assert len(recorder) == 3
+        db.reference('/foo').get()
+        assert len(recorder) == 4
+
+    def test_oversized_value(self):
+        recorder = self.init_app(databaseCacheMaxBytes=5, databaseCacheMaxAge=60)
+        db.reference('/foo').get()
+        db.reference('/foo').get()
+        assert len(recorder) == 2
+        assert db.reference()._client.read_cache.size == 0
+
+
 class TestReferenceWithAuthOverride(object):
     """Test cases for database queries via References."""
 
@@ -567,7 +2286,7 @@ class TestReferenceWithAuthOverride(object):
         assert recorder[0].method == 'GET'
         assert recorder[0].url == 'https://test.firebaseio.com/test.json?' + query_str
         assert recorder[0].headers['Authorization'] == 'Bearer mock-token'
-        assert recorder[0].headers['User-Agent'] == db._USER_AGENT
+        assert recorder[0].headers['User-Agent'] == _db_client.USER_AGENT
 
     def test_set_value(self):
         ref = db.reference('/test')
@@ -580,7 +2299,7 @@ class TestReferenceWithAuthOverride(object):
         assert recorder[0].url == 'https://test.firebaseio.com/test.json?' + query_str
         assert json.loads(recorder[0].body.decode()) == data
         assert recorder[0].headers['Authorization'] == 'Bearer mock-token'
-        assert recorder[0].headers['User-Agent'] == db._USER_AGENT
+        assert recorder[0].headers['User-Agent'] == _db_client.USER_AGENT
 
     def test_order_by_query(self):
         ref = db.reference('/test')
@@ -592,7 +2311,7 @@ class TestReferenceWithAuthOverride(object):
         assert recorder[0].method == 'GET'
         assert recorder[0].url == 'https://test.firebaseio.com/test.json?' + query_str
         assert recorder[0].headers['Authorization'] == 'Bearer mock-token'
-        assert recorder[0].headers['User-Agent'] == db._USER_AGENT
+        assert recorder[0].headers['User-Agent'] == _db_client.USER_AGENT
 
     def test_range_query(self):
         ref = db.reference('/test')
@@ -605,7 +2324,7 @@ class TestReferenceWithAuthOverride(object):
         assert recorder[0].method == 'GET'
         assert recorder[0].url == 'https://test.firebaseio.com/test.json?' + query_str
         assert recorder[0].headers['Authorization'] == 'Bearer mock-token'
-        assert recorder[0].headers['User-Agent'] == db._USER_AGENT
+        assert recorder[0].headers['User-Agent'] == _db_client.USER_AGENT
 
 
 class TestDatabaseInitialization(object):
@@ -719,6 +2438,194 @@ class TestDatabaseInitialization(object):
             assert len(recorder) == 1
             assert recorder[0]._extra_kwargs['timeout'] == 60
 
+    @pytest.mark.skipif(
+        _db_listeners.selectors is None, reason='Listener multiplexing requires Python 3')
+    def test_listener_threads(self):
+        firebase_admin.initialize_app(testutils.MockCredential(), {
+            'databaseURL' : 'https://test.firebaseio.com',
+            'databaseListenerThreads': 4
+        })
+        default_ref = db.reference()
+        other_ref = db.reference(url='https://other.firebaseio.com')
+        manager = default_ref._client.listener_manager
+        assert isinstance(manager, _db_listeners.ListenerManager)
+        assert other_ref._client.listener_manager is manager
+
+    @pytest.mark.skipif(
+        _db_listeners.selectors is None, reason='Listener multiplexing requires Python 3')
+    def test_emulator_listener_manager(self):
+        firebase_admin.initialize_app(testutils.MockCredential(), {
+            'databaseURL' : 'https://test.firebaseio.com',
+            'databaseListenerThreads': 4
+        })
+        manager = db.reference()._client.listener_manager
+        emulator_ref = db.reference(url='http://localhost:9000')
+        emulator_manager = emulator_ref._client.listener_manager
+        assert isinstance(emulator_manager, _db_listeners.ListenerManager)
+        assert emulator_manager is not manager
+        assert isinstance(emulator_manager._session.credentials, _db_client._EmulatorCredential)
+        assert not isinstance(manager._session.credentials, _db_client._EmulatorCredential)
+        other_emulator_ref = db.reference(url='http://127.0.0.1:9000')
+        assert other_emulator_ref._client.listener_manager is emulator_manager
+
+    def test_no_listener_threads(self):
+        firebase_admin.initialize_app(testutils.MockCredential(), {
+            'databaseURL' : 'https://test.firebaseio.com',
+        })
+        assert db.reference()._client.listener_manager is None
+        assert db.reference()._client.listener_dispatcher is None
+        assert db.get_listener_stats() is None
+
+    def test_listener_dispatch_threads(self):
+        firebase_admin.initialize_app(testutils.MockCredential(), {
+            'databaseURL' : 'https://test.firebaseio.com',
+            'databaseListenerDispatchThreads': 4,
+            'databaseListenerQueueSize': 10,
+            'databaseListenerOverflow': 'coalesce',
+        })
+        default_ref = db.reference()
+        other_ref = db.reference(url='https://other.firebaseio.com')
+        dispatcher = default_ref._client.listener_dispatcher
+        assert isinstance(dispatcher, _db_listeners.DispatchExecutor)
+        assert other_ref._client.listener_dispatcher is dispatcher
+        assert default_ref._client.listener_manager is None
+        assert len(dispatcher._threads) == 4
+        assert dispatcher._overflow == 'coalesce'
+        stats = db.get_listener_stats()
+        assert isinstance(stats, db.ListenerStats)
+        assert stats.queue_capacity == 10
+        assert stats.queue_depth == 0
+        assert stats.dispatched == 0
+
+    def test_listener_dispatch_defaults(self):
+        firebase_admin.initialize_app(testutils.MockCredential(), {
+            'databaseURL' : 'https://test.firebaseio.com',
+            'databaseListenerDispatchThreads': 2,
+        })
+        dispatcher = db.reference()._client.listener_dispatcher
+        assert len(dispatcher._threads) == 2
+        assert dispatcher._overflow == 'block'
+        assert db.get_listener_stats().queue_capacity == 1000
+
+    @pytest.mark.skipif(
+        _db_listeners.selectors is None, reason='Listener multiplexing requires Python 3')
+    def test_listener_threads_dispatcher(self):
+        firebase_admin.initialize_app(testutils.MockCredential(), {
+            'databaseURL' : 'https://test.firebaseio.com',
+            'databaseListenerThreads': 3,
+        })
+        client = db.reference()._client
+        assert len(client.listener_dispatcher._threads) == 3
+        assert client.listener_manager._dispatcher is client.listener_dispatcher
+
+    @pytest.mark.parametrize('options', [
+        {'databaseListenerDispatchThreads': 0},
+        {'databaseListenerDispatchThreads': True},
+        {'databaseListenerDispatchThreads': '4'},
+        {'databaseListenerDispatchThreads': 1, 'databaseListenerQueueSize': 0},
+        {'databaseListenerDispatchThreads': 1, 'databaseListenerQueueSize': 1.5},
+        {'databaseListenerDispatchThreads': 1, 'databaseListenerOverflow': 'drop'},
+        {'databaseListenerDispatchThreads': 1, 'databaseListenerOverflow': list()},
+        {'databaseListenerQueueSize': 10},
+        {'databaseListenerOverflow': 'block'},
+    ])
+    def test_invalid_listener_dispatch_options(self, options):
+        options['databaseURL'] = 'https://test.firebaseio.com'
+        firebase_admin.initialize_app(testutils.MockCredential(), options)
+        with pytest.raises(ValueError):
+            db.reference()
+
+    @pytest.mark.parametrize('threads', [0, -1, 1.5, '4', True, list(), dict(), _Object()])
+    def test_invalid_listener_threads(self, threads):
+        firebase_admin.initialize_app(testutils.MockCredential(), {
+            'databaseURL' : 'https://test.firebaseio.com',
+            'databaseListenerThreads': threads
+        })
+        with pytest.raises(ValueError):
+            db.reference()
+
+    def test_read_cache(self):
+        firebase_admin.initialize_app(testutils.MockCredential(), {
+            'databaseURL' : 'https://test.firebaseio.com',
+            'databaseCacheMaxBytes': 1024,
+        })
+        default_ref = db.reference()
+        other_ref = db.reference(url='https://other.firebaseio.com')
+        cache = default_ref._client.read_cache
+        assert isinstance(cache, _db_client._ReadCache)
+        assert cache._max_bytes == 1024
+        assert cache._max_age == 0
+        assert other_ref._client.read_cache is cache
+
+    def test_server_limits(self):
+        firebase_admin.initialize_app(testutils.MockCredential(), {
+            'databaseURL' : 'https://test.firebaseio.com',
+            'databaseServerTimeout': 2.5,
+            'databaseWriteSizeLimit': 'unlimited',
+        })
+        ref = db.reference('/test')
+        assert ref._client.server_timeout == 2.5
+        assert ref._client.write_size_limit == 'unlimited'
+        recorder = []
+        ref._client.session.mount(ref._client.base_url, MockAdapter('{}', 200, recorder))
+        assert ref.get() == {}
+        assert ref.get(server_timeout=10) == {}
+        ref.delete()
+        ref.set({}, write_size_limit='small')
+        assert [r.url for r in recorder] == [
+            'https://test.firebaseio.com/test.json?timeout=2500ms',
+            'https://test.firebaseio.com/test.json?timeout=10000ms',
+            'https://test.firebaseio.com/test.json?writeSizeLimit=unlimited',
+            'https://test.firebaseio.com/test.json?print=silent&writeSizeLimit=small',
+        ]
+
+    def test_no_server_limits(self):
+        firebase_admin.initialize_app(testutils.MockCredential(), {
+            'databaseURL' : 'https://test.firebaseio.com',
+        })
+        ref = db.reference()
+        assert ref._client.server_timeout is None
+        assert ref._client.write_size_limit is None
+
+    @pytest.mark.parametrize('options', [
+        {'databaseServerTimeout': 0},
+        {'databaseServerTimeout': -1},
+        {'databaseServerTimeout': 901},
+        {'databaseServerTimeout': '10'},
+        {'databaseServerTimeout': True},
+        {'databaseWriteSizeLimit': 'huge'},
+        {'databaseWriteSizeLimit': ''},
+        {'databaseWriteSizeLimit': 1},
+    ])
+    def test_invalid_server_limit_options(self, options):
+        options['databaseURL'] = 'https://test.firebaseio.com'
+        firebase_admin.initialize_app(testutils.MockCredential(), options)
+        with pytest.raises(ValueError):
+            db.reference()
+
+    def test_no_read_cache(self):
+        firebase_admin.initialize_app(testutils.MockCredential(), {
+            'databaseURL' : 'https://test.firebaseio.com',
+        })
+        assert db.reference()._client.read_cache is None
+
+    @pytest.mark.parametrize('options', [
+        {'databaseCacheMaxBytes': 0},
+        {'databaseCacheMaxBytes': -1},
+        {'databaseCacheMaxBytes': 1.5},
+        {'databaseCacheMaxBytes': '1024'},
+        {'databaseCacheMaxBytes': True},
+        {'databaseCacheMaxBytes': 1024, 'databaseCacheMaxAge': -1},
+        {'databaseCacheMaxBytes': 1024, 'databaseCacheMaxAge': '60'},
+        {'databaseCacheMaxBytes': 1024, 'databaseCacheMaxAge': True},
+        {'databaseCacheMaxAge': 60},
+    ])
+    def test_invalid_read_cache_options(self, options):
+        options['databaseURL'] = 'https://test.firebaseio.com'
+        firebase_admin.initialize_app(testutils.MockCredential(), options)
+        with pytest.raises(ValueError):
+            db.reference()
+
     def test_app_delete(self):
         app = firebase_admin.initialize_app(
             testutils.MockCredential(), {'databaseURL' : 'https://test.firebaseio.com'})
@@ -737,7 +2644,7 @@ class TestDatabaseInitialization(object):
     def test_user_agent_format(self):
         expected = 'Firebase/HTTP/{0}/{1}.{2}/AdminPython'.format(
             firebase_admin.__version__, sys.version_info.major, sys.version_info.minor)
-        assert db._USER_AGENT == expected
+        assert _db_client.USER_AGENT == expected
 
 
 @pytest.fixture(params=['foo', '$key', '$value'])
@@ -880,8 +2787,88 @@ class TestQuery(object):
             db.Query(order_by='$key', client=ref._client, pathurl=ref._add_suffix(), foo='bar')
 
 
+class TestJsonChildParser(object):
+    """Test cases for the incremental parser used by streaming reads."""
+
+    @staticmethod
+    def _chunks(text, size):
+        data = text.encode('utf-8')
+        return [data[i:i+size] for i in range(0, len(data), size)]
+
+    @pytest.mark.parametrize('size', [1, 2, 3, 7, 1024])
+    @pytest.mark.parametrize('text, expected', [
+        ('{"a": 1, "b": {"c": [1, 2.5e3]}, "d": -12}',
+         [('a', 1), ('b', {'c': [1, 2.5e3]}), ('d', -12)]),
+        (u' { "\u00e9" : "\u00fc\u00fc" , "x":"y,}" } ',
+         [(u'\u00e9', u'\u00fc\u00fc'), ('x', 'y,}')]),
+        ('[1, null, "a", [2]]', [('0', 1), ('2', 'a'), ('3', [2])]),
+        ('{}', []), ('[]', []), ('null', []), ('12345', []), ('"foo"', []), ('', []),
+    ])
+    def test_children(self, text, expected, size):
+        assert list(_db_utils.iter_json_children(self._chunks(text, size))) == expected
+
+    @pytest.mark.parametrize('text', [
+        '{"a": 1', '{"a" 1}', '{1: 1}', '{"a": 1,}', '[1 2]', '{"a": 1} x', '{"a": tru}',
+    ])
+    def test_invalid(self, text):
+        with pytest.raises(ValueError):
+            list(_db_utils.iter_json_children(self._chunks(text, 2)))
+
+    @pytest.mark.parametrize('chunks, expected', [
+        ([b'{"a":1.', b'5}'], [('a', 1.5)]),
+        ([b'[1.', b'5]'], [('0', 1.5)]),
+        ([b'{"a":2.5e', b'10}'], [('a', 2.5e10)]),
+        ([b'{"a":-', b'1}'], [('a', -1)]),
+        ([b'{"a":1', b'0}'], [('a', 10)]),
+        ([b'{"a":true', b'}'], [('a', True)]),
+    ])
+    def test_number_split_across_chunks(self, chunks, expected):
+        assert list(_db_utils.iter_json_children(chunks)) == expected
+
+    def test_random_chunk_boundaries(self):
+        data = {
+            'ints': [0, 7, -12, 1234567890],
+            'floats': [1.5, -0.25, 2.5e10, 3.75E-5, -1e+20],
+            'mixed': {'a': 'x,y}', 'b': None, 'c': True, 'd': [1.5, {'e': -2.5e-3}]},
+            'n': 42,
+            'f': 6.022e23,
+        }
+        text = json.dumps(data)
+        expected = list(_db_utils.iter_json_children([text.encode('utf-8')]))
+        rand = random.Random(0)
+        for _ in range(500):
+            cuts = sorted(rand.sample(range(1, len(text)), rand.randint(1, 10)))
+            chunks = self._chunks_at(text, cuts)
+            assert list(_db_utils.iter_json_children(chunks)) == expected, chunks
+
+    @staticmethod
+    def _chunks_at(text, cuts):
+        data = text.encode('utf-8')
+        bounds = [0] + cuts + [len(data)]
+        return [data[start:end] for start, end in zip(bounds, bounds[1:])]
+
+    def test_feed(self):
+        parser = _db_utils.JsonChildParser()
+        assert parser.feed(b'{"a": 1, "b"') == [('a', 1)]
+        assert parser.feed(b': [1, 2') == []
+        assert parser.feed(b'], "c": 3') == [('b', [1, 2])]
+        assert parser.feed(b'}') == [('c', 3)]
+        assert parser.close() == []
+
+    def test_feed_error(self):
+        parser = _db_utils.JsonChildParser()
+        assert parser.feed(b'{"a": 1, "b" 2}') == [('a', 1)]
+        with pytest.raises(ValueError):
+            parser.feed(b'')
+
+    def test_large_value(self):
+        value = 'x' * 100000
+        chunks = self._chunks(json.dumps({'a': value, 'b': [value]}), 10)
+        assert list(_db_utils.iter_json_children(chunks)) == [('a', value), ('b', [value])]
+
+
 class TestSorter(object):
-    """Test cases for db._Sorter class."""
+    """Test cases for _db_utils.Sorter class."""
 
     value_test_cases = [
         ({'k1' : 1, 'k2' : 2, 'k3' : 3}, ['k1', 'k2', 'k3']),
@@ -901,6 +2888,10 @@ class TestSorter(object):
          ['k3', 'k5', 'k1', 'k2', 'k4', 'k6']),
         ({'k1' : True, 'k2' : 0, 'k3' : 'foo', 'k4' : 'foo', 'k5' : False, 'k6' : dict()},
          ['k5', 'k1', 'k2', 'k3', 'k4', 'k6']),
+        ({'k1' : 1.5, 'k2' : 1, 'k3' : 2, 'k4' : -0.5}, ['k4', 'k2', 'k1', 'k3']),
+        ({'k2' : 1.0, 'k1' : 1, 'k3' : 0.5}, ['k3', 'k1', 'k2']),
+        ({'k3' : [1], 'k1' : {'a': 1}, 'k2' : [], 'k4' : 'a'}, ['k4', 'k1', 'k2', 'k3']),
+        ({'k2' : None, 'k1' : None, 'k4' : False, 'k3' : False}, ['k1', 'k2', 'k3', 'k4']),
     ]
 
     list_test_cases = [
@@ -916,20 +2907,20 @@ class TestSorter(object):
 
     @pytest.mark.parametrize('result, expected', value_test_cases)
     def test_order_by_value(self, result, expected):
-        ordered = db._Sorter(result, '$value').get()
+        ordered = _db_utils.Sorter(result, '$value').get()
         assert isinstance(ordered, collections.OrderedDict)
         assert list(ordered.keys()) == expected
 
     @pytest.mark.parametrize('result, expected', list_test_cases)
     def test_order_by_value_with_list(self, result, expected):
-        ordered = db._Sorter(result, '$value').get()
+        ordered = _db_utils.Sorter(result, '$value').get()
         assert isinstance(ordered, list)
         assert ordered == expected
 
     @pytest.mark.parametrize('value', [None, False, True, 0, 1, 'foo'])
     def test_invalid_sort(self, value):
         with pytest.raises(ValueError):
-            db._Sorter(value, '$value')
+            _db_utils.Sorter(value, '$value')
 
     @pytest.mark.parametrize('result, expected', [
         ({'k1' : 1, 'k2' : 2, 'k3' : 3}, ['k1', 'k2', 'k3']),
@@ -937,7 +2928,7 @@ class TestSorter(object):
         ({'k1' : 3, 'k3' : 1, 'k2' : 2}, ['k1', 'k2', 'k3']),
     ])
     def test_order_by_key(self, result, expected):
-        ordered = db._Sorter(result, '$key').get()
+        ordered = _db_utils.Sorter(result, '$key').get()
         assert isinstance(ordered, collections.OrderedDict)
         assert list(ordered.keys()) == expected
 
@@ -946,7 +2937,7 @@ class TestSorter(object):
         nested = {}
         for key, val in result.items():
             nested[key] = {'child' : val}
-        ordered = db._Sorter(nested, 'child').get()
+        ordered = _db_utils.Sorter(nested, 'child').get()
         assert isinstance(ordered, collections.OrderedDict)
         assert list(ordered.keys()) == expected
 
@@ -955,7 +2946,7 @@ class TestSorter(object):
         nested = {}
         for key, val in result.items():
             nested[key] = {'child' : {'grandchild' : val}}
-        ordered = db._Sorter(nested, 'child/grandchild').get()
+        ordered = _db_utils.Sorter(nested, 'child/grandchild').get()
         assert isinstance(ordered, collections.OrderedDict)
         assert list(ordered.keys()) == expected
 
@@ -965,6 +2956,6 @@ class TestSorter(object):
         ({'k1': {'child': 1}, 'k2': {'child': {}}, 'k3': {}}, ['k3', 'k1', 'k2']),
     ])
     def test_child_path_resolution(self, result, expected):
-        ordered = db._Sorter(result, 'child').get()
+        ordered = _db_utils.Sorter(result, 'child').get()
         assert isinstance(ordered, collections.OrderedDict)
         assert list(ordered.keys()) == expected
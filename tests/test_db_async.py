@@ -0,0 +1,554 @@
+# Copyright 2018 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Tests for firebase_admin.db_async."""
+import collections
+import hashlib
+import json
+import threading
+
+import pytest
+from pytest_localserver import http
+from six.moves import urllib
+
+import firebase_admin
+from firebase_admin import db
+from firebase_admin import _db_client
+from tests import testutils
+
+try:
+    from firebase_admin import db_async
+    import asyncio
+except (ImportError, SyntaxError):
+    # Requires Python 3.5.3+ and aiohttp.
+    db_async = None
+
+
+pytestmark = pytest.mark.skipif(db_async is None, reason='Requires Python 3.5.3+ and aiohttp')
+
+
+class MockDatabase(object):
+    """A WSGI application that mimics the Realtime Database REST API on an in-memory tree."""
+
+    def __init__(self, tree=None):
+        self.tree = tree
+        self.requests = []
+        self.errors = {}
+        self.bodies = {}
+        self._push_count = 0
+        self._lock = threading.Lock()
+
+    def __call__(self, environ, start_response):
+        path = environ['PATH_INFO']
+        assert path.endswith('.json')
+        segments = [seg for seg in path[:-len('.json')].split('/') if seg]
+        query = urllib.parse.parse_qs(environ.get('QUERY_STRING', ''))
+        headers = {key[5:].replace('_', '-').lower(): val
+                   for key, val in environ.items() if key.startswith('HTTP_')}
+        if environ.get('CONTENT_TYPE'):
+            headers['content-type'] = environ['CONTENT_TYPE']
+        length = int(environ.get('CONTENT_LENGTH') or 0)
+        body = environ['wsgi.input'].read(length) if length else b''
+        method = environ['REQUEST_METHOD']
+        with self._lock:
+            self.requests.append((method, path, query, headers, body))
+            if path in self.errors:
+                status, error = self.errors[path]
+                return self._respond(start_response, status, {'error': error})
+            if path in self.bodies:
+                start_response('200 OK', [('Content-Type', 'application/json')])
+                return self.bodies[path]
+            if headers.get('accept') == 'text/event-stream':
+                return self._stream(start_response, segments)
+            return self._handle(start_response, method, segments, query, headers, body)
+
+    def _handle(self, start_response, method, segments, query, headers, body):
+        current = self._get(segments)
+        etag = self._etag(current)
+        if method == 'GET':
+            if headers.get('if-none-match') == etag:
+                return self._respond(start_response, 304, None)
+            if query.get('shallow') == ['true'] and isinstance(current, dict):
+                current = {key: True for key in current}
+            return self._respond(start_response, 200, current, etag)
+        if 'if-match' in headers and headers['if-match'] != etag:
+            return self._respond(start_response, 412, current, etag)
+        value = json.loads(body.decode()) if body else None
+        if method == 'PUT':
+            self._set(segments, value)
+        elif method == 'PATCH':
+            for key, child in value.items():
+                self._set(segments + [seg for seg in key.split('/') if seg], child)
+        elif method == 'POST':
+            self._push_count += 1
+            name = 'pushid{0}'.format(self._push_count)
+            self._set(segments + [name], value)
+            return self._respond(start_response, 200, {'name': name})
+        elif method == 'DELETE':
+            self._set(segments, None)
+        if query.get('print') == ['silent']:
+            return self._respond(start_response, 204, None)
+        return self._respond(start_response, 200, value, self._etag(self._get(segments)))
+
+    def _stream(self, start_response, segments):
+        event = {'path': '/', 'data': self._get(segments)}
+        start_response('200 OK', [('Content-Type', 'text/event-stream')])
+        return [
+            b'event: keep-alive\ndata: null\n\n',
+            'event: put\nretry: 1\ndata: {0}\n\n'.format(json.dumps(event)).encode(),
+        ]
+
+    def _get(self, segments):
+        value = self.tree
+        for segment in segments:
+            value = value.get(segment) if isinstance(value, dict) else None
+        return value
+
+    def _set(self, segments, value):
+        if not segments:
+            self.tree = value
+            return
+        if not isinstance(self.tree, dict):
+            self.tree = {}
+        parent = self.tree
+        for segment in segments[:-1]:
+            if not isinstance(parent.get(segment), dict):
+                parent[segment] = {}
+            parent = parent[segment]
+        if value is None:
+            parent.pop(segments[-1], None)
+        else:
+            parent[segments[-1]] = value
+
+    @classmethod
+    def _etag(cls, value):
+        return hashlib.md5(json.dumps(value, sort_keys=True).encode()).hexdigest()
+
+    @classmethod
+    def _respond(cls, start_response, status, value, etag=None):
+        reasons = {200: 'OK', 204: 'No Content', 304: 'Not Modified', 400: 'Bad Request',
+                   404: 'Not Found', 412: 'Precondition Failed', 500: 'Internal Server Error'}
+        headers = [('Content-Type', 'application/json')]
+        if etag:
+            headers.append(('ETag', etag))
+        start_response('{0} {1}'.format(status, reasons[status]), headers)
+        if status in (204, 304):
+            return [b'']
+        return [json.dumps(value).encode()]
+
+
+@pytest.fixture(scope='module')
+def wsgi_server():
+    # Stopping a server takes a while, so all tests share one, with a fresh MockDatabase each.
+    apps = []
+    server_instance = http.WSGIServer(application=lambda *args: apps[-1](*args))
+    server_instance.apps = apps
+    server_instance.start()
+    yield server_instance
+    server_instance.stop()
+
+
+@pytest.fixture
+def server(wsgi_server):
+    mock_db = MockDatabase()
+    mock_db.url = wsgi_server.url
+    wsgi_server.apps.append(mock_db)
+    return mock_db
+
+
+@pytest.fixture
+def loop():
+    event_loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(event_loop)
+    yield event_loop
+    event_loop.close()
+
+
+@pytest.fixture
+def client(server, loop):
+    async_client = db_async._AsyncClient(
+        testutils.MockGoogleCredential(), server.url, None, None)
+    yield async_client
+    async_client.close()
+
+
+def _collect(loop, stream):
+    children = []
+    while True:
+        try:
+            children.append(loop.run_until_complete(stream.__anext__()))
+        except StopAsyncIteration:
+            return children
+
+
+class TestAsyncReference(object):
+    """Test cases for AsyncReference."""
+
+    def test_properties(self, client):
+        ref = db_async.AsyncReference(client=client, path='/foo/bar')
+        assert ref.key == 'bar'
+        assert ref.path == '/foo/bar'
+        assert ref.parent.path == '/foo'
+        assert ref.parent.parent.key is None
+        assert ref.parent.parent.parent is None
+        assert ref.child('baz/qux').path == '/foo/bar/baz/qux'
+        with pytest.raises(ValueError):
+            ref.child('/baz')
+
+    def test_get(self, server, client, loop):
+        server.tree = {'foo': {'bar': 1, 'baz': {'qux': True}}}
+        ref = db_async.AsyncReference(client=client, path='/foo')
+        assert loop.run_until_complete(ref.get()) == {'bar': 1, 'baz': {'qux': True}}
+        assert loop.run_until_complete(ref.get(shallow=True)) == {'bar': True, 'baz': True}
+        method, path, query, headers, _ = server.requests[0]
+        assert (method, path, query) == ('GET', '/foo.json', {})
+        assert headers['authorization'] == 'Bearer mock-token'
+        assert headers['user-agent'] == _db_client.USER_AGENT
+        assert server.requests[1][2] == {'shallow': ['true']}
+
+    def test_get_missing(self, client, loop):
+        ref = db_async.AsyncReference(client=client, path='/missing')
+        assert loop.run_until_complete(ref.get()) is None
+
+    def test_get_with_etag(self, server, client, loop):
+        server.tree = {'foo': 'bar'}
+        ref = db_async.AsyncReference(client=client, path='/foo')
+        value, etag = loop.run_until_complete(ref.get(etag=True))
+        assert value == 'bar'
+        assert etag == MockDatabase._etag('bar')
+        assert server.requests[0][3]['x-firebase-etag'] == 'true'
+        with pytest.raises(ValueError):
+            loop.run_until_complete(ref.get(etag=True, shallow=True))
+
+    def test_get_if_changed(self, server, client, loop):
+        server.tree = {'foo': 'bar'}
+        ref = db_async.AsyncReference(client=client, path='/foo')
+        etag = MockDatabase._etag('bar')
+        assert loop.run_until_complete(ref.get_if_changed(etag)) == (False, None, None)
+        assert loop.run_until_complete(ref.get_if_changed('other')) == (True, 'bar', etag)
+        with pytest.raises(ValueError):
+            loop.run_until_complete(ref.get_if_changed(1))
+
+    def test_writes(self, server, client, loop):
+        ref = db_async.AsyncReference(client=client, path='/foo')
+        loop.run_until_complete(ref.set({'a': 1}))
+        assert server.tree == {'foo': {'a': 1}}
+        loop.run_until_complete(ref.update({'b': 2, 'c/d': 3}))
+        assert server.tree == {'foo': {'a': 1, 'b': 2, 'c': {'d': 3}}}
+        child = loop.run_until_complete(ref.push({'e': 4}))
+        assert isinstance(child, db_async.AsyncReference)
+        assert child.path == '/foo/pushid1'
+        assert server.tree['foo']['pushid1'] == {'e': 4}
+        loop.run_until_complete(ref.child('a').delete())
+        assert 'a' not in server.tree['foo']
+
+        methods = [(req[0], req[2].get('print')) for req in server.requests]
+        assert methods == [
+            ('PUT', ['silent']), ('PATCH', ['silent']), ('POST', None), ('DELETE', None)]
+        assert server.requests[0][3]['content-type'] == 'application/json'
+
+    @pytest.mark.parametrize('method, value', [
+        ('set', None), ('push', None), ('update', None), ('update', {}), ('update', [1]),
+        ('update', {None: 1})])
+    def test_invalid_writes(self, client, loop, method, value):
+        ref = db_async.AsyncReference(client=client, path='/foo')
+        with pytest.raises(ValueError):
+            loop.run_until_complete(getattr(ref, method)(value))
+
+    def test_set_if_unchanged(self, server, client, loop):
+        server.tree = {'foo': 'bar'}
+        ref = db_async.AsyncReference(client=client, path='/foo')
+        etag = MockDatabase._etag('bar')
+        result = loop.run_until_complete(ref.set_if_unchanged('wrong', 'baz'))
+        assert result == (False, 'bar', etag)
+        success, value, new_etag = loop.run_until_complete(ref.set_if_unchanged(etag, 'baz'))
+        assert (success, value) == (True, 'baz')
+        assert new_etag == MockDatabase._etag('baz')
+        assert server.tree == {'foo': 'baz'}
+
+    def test_transaction(self, server, client, loop):
+        server.tree = {'count': 0}
+        ref = db_async.AsyncReference(client=client, path='/count')
+        stats = db.TransactionStats()
+        result = loop.run_until_complete(
+            ref.transaction(lambda x: (x or 0) + 1, initial_backoff=0, stats=stats))
+        assert result == 1
+        assert server.tree == {'count': 1}
+        assert stats.attempts == 1
+        assert stats.conflicts == 0
+
+    def test_transaction_contention(self, server, client, loop):
+        server.tree = {'count': 0}
+        ref = db_async.AsyncReference(client=client, path='/count')
+
+        def increment(value):
+            # Return an awaitable, which completes on a later iteration of the event loop.
+            future = loop.create_future()
+            loop.call_soon(future.set_result, value + 1)
+            return future
+
+        stats = [db.TransactionStats() for _ in range(10)]
+        coros = [ref.transaction(increment, initial_backoff=0.001, stats=s) for s in stats]
+        loop.run_until_complete(asyncio.gather(*coros))
+        assert server.tree == {'count': 10}
+        assert sum(s.attempts for s in stats) == 10 + sum(s.conflicts for s in stats)
+
+    def test_transaction_abort(self, server, client, loop):
+        server.tree = {'count': 0}
+        ref = db_async.AsyncReference(client=client, path='/count')
+
+        def update(value):
+            server.tree['count'] = value + 100
+            return value + 1
+
+        with pytest.raises(db.TransactionError):
+            loop.run_until_complete(ref.transaction(update, max_retries=3, initial_backoff=0))
+        assert server.tree == {'count': 300}
+
+    @pytest.mark.parametrize('func', [None, 0, 'foo', dict()])
+    def test_transaction_invalid_function(self, client, loop, func):
+        ref = db_async.AsyncReference(client=client, path='/count')
+        with pytest.raises(ValueError):
+            loop.run_until_complete(ref.transaction(func))
+
+    def test_query(self, server, client, loop):
+        server.tree = {'users': {'a': {'age': 3}, 'b': {'age': 1}, 'c': {'age': 2}}}
+        ref = db_async.AsyncReference(client=client, path='/users')
+        query = ref.order_by_child('age').limit_to_first(3)
+        assert isinstance(query, db_async.AsyncQuery)
+        result = loop.run_until_complete(query.get())
+        assert isinstance(result, collections.OrderedDict)
+        assert list(result.keys()) == ['b', 'c', 'a']
+        assert server.requests[0][2] == {'orderBy': ['"age"'], 'limitToFirst': ['3']}
+
+        result = loop.run_until_complete(ref.order_by_key().get())
+        assert list(result.keys()) == ['a', 'b', 'c']
+        assert server.requests[1][2] == {'orderBy': ['"$key"']}
+        assert isinstance(ref.order_by_value(), db_async.AsyncQuery)
+        with pytest.raises(ValueError):
+            ref.order_by_child('$key')
+
+    def test_query_stream(self, server, client, loop):
+        server.tree = {'users': {'a': {'age': 3}, 'b': {'age': 1}, 'c': {'age': 2}}}
+        ref = db_async.AsyncReference(client=client, path='/users')
+        stream = ref.order_by_child('age').limit_to_first(3).stream()
+        assert isinstance(stream, db_async.ChildStream)
+        assert stream.__aiter__() is stream
+        assert not server.requests
+        result = _collect(loop, stream)
+        assert result == [('b', {'age': 1}), ('c', {'age': 2}), ('a', {'age': 3})]
+        assert server.requests[0][2] == {'orderBy': ['"age"'], 'limitToFirst': ['3']}
+        with pytest.raises(StopAsyncIteration):
+            loop.run_until_complete(stream.__anext__())
+
+    def test_query_stream_chunks(self, server, client, loop):
+        server.bodies['/users.json'] = [b'{"b": 2, "a": [1', b'2, 3], "c"', b': 1', b'0}']
+        ref = db_async.AsyncReference(client=client, path='/users')
+        result = _collect(loop, ref.order_by_key().stream())
+        assert result == [('a', [12, 3]), ('b', 2), ('c', 10)]
+
+    def test_query_stream_priority(self, server, client, loop):
+        server.tree = {'users': {'b': 1, 'a': 2}}
+        ref = db_async.AsyncReference(client=client, path='/users')
+        query = db_async.AsyncQuery(order_by='$priority', client=client, pathurl='/users.json')
+        assert _collect(loop, query.stream()) == [('b', 1), ('a', 2)]
+        assert _collect(loop, ref.order_by_key().stream()) == [('a', 2), ('b', 1)]
+
+    def test_query_stream_server_timeout(self, server, client, loop):
+        server.tree = {'users': {'a': 1}}
+        ref = db_async.AsyncReference(client=client, path='/users')
+        _collect(loop, ref.order_by_key().stream())
+        client.server_timeout = 5
+        _collect(loop, ref.order_by_key().stream())
+        _collect(loop, ref.order_by_key().stream(server_timeout=0.5))
+        assert [req[2].get('timeout') for req in server.requests] == [
+            None, ['5000ms'], ['500ms']]
+        with pytest.raises(ValueError):
+            ref.order_by_key().stream(server_timeout=0)
+
+    def test_query_stream_invalid_response(self, server, client, loop):
+        server.bodies['/users.json'] = [b'{"a": 1, "b" 2}']
+        stream = db_async.AsyncReference(client=client, path='/users').order_by_key().stream()
+        with pytest.raises(db.ApiCallError) as excinfo:
+            _collect(loop, stream)
+        assert isinstance(excinfo.value.detail, ValueError)
+        with pytest.raises(StopAsyncIteration):
+            loop.run_until_complete(stream.__anext__())
+
+    def test_query_stream_error(self, server, client, loop):
+        server.errors['/users.json'] = (400, 'json error message')
+        stream = db_async.AsyncReference(client=client, path='/users').order_by_key().stream()
+        with pytest.raises(db.ApiCallError) as excinfo:
+            loop.run_until_complete(stream.__anext__())
+        assert 'Reason: json error message' in str(excinfo.value)
+
+    def test_query_stream_close(self, server, client, loop):
+        server.tree = {'users': {'a': 1, 'b': 2}}
+        stream = db_async.AsyncReference(client=client, path='/users').order_by_key().stream()
+        assert loop.run_until_complete(stream.__anext__()) == ('a', 1)
+        loop.run_until_complete(stream.close())
+        with pytest.raises(StopAsyncIteration):
+            loop.run_until_complete(stream.__anext__())
+
+    def test_listen(self, server, client, loop):
+        server.tree = {'foo': {'bar': 1}}
+        ref = db_async.AsyncReference(client=client, path='/foo')
+        stream = ref.listen()
+        assert stream.__aiter__() is stream
+        event = loop.run_until_complete(stream.__anext__())
+        assert isinstance(event, db.Event)
+        assert event.event_type == 'put'
+        assert event.path == '/'
+        assert event.data == {'bar': 1}
+
+        # The mock server closes the stream after each event, and the stream reconnects.
+        server.tree = {'foo': {'bar': 2}}
+        event = loop.run_until_complete(stream.__anext__())
+        assert event.data == {'bar': 2}
+        assert len(server.requests) == 2
+        assert server.requests[0][3]['accept'] == 'text/event-stream'
+
+        loop.run_until_complete(stream.close())
+        with pytest.raises(StopAsyncIteration):
+            loop.run_until_complete(stream.__anext__())
+
+    def test_listen_error(self, server, client, loop):
+        server.errors['/foo.json'] = (400, 'json error message')
+        stream = db_async.AsyncReference(client=client, path='/foo').listen()
+        with pytest.raises(db.ApiCallError) as excinfo:
+            loop.run_until_complete(stream.__anext__())
+        assert 'Reason: json error message' in str(excinfo.value)
+
+    def test_error(self, server, client, loop):
+        server.errors['/foo.json'] = (400, 'json error message')
+        ref = db_async.AsyncReference(client=client, path='/foo')
+        with pytest.raises(db.ApiCallError) as excinfo:
+            loop.run_until_complete(ref.get())
+        assert 'Reason: json error message' in str(excinfo.value)
+        assert excinfo.value.detail.status == 400
+        assert len(server.requests) == 1
+
+    def test_retry(self, server, client, loop, monkeypatch):
+        monkeypatch.setattr(db_async, '_RETRY_BACKOFF_FACTOR', 0)
+        server.errors['/foo.json'] = (500, 'internal error')
+        ref = db_async.AsyncReference(client=client, path='/foo')
+        with pytest.raises(db.ApiCallError) as excinfo:
+            loop.run_until_complete(ref.set(1))
+        assert 'Reason: internal error' in str(excinfo.value)
+        assert len(server.requests) == 1 + db_async._MAX_RETRIES
+
+    def test_connection_error(self, loop):
+        client = db_async._AsyncClient(
+            testutils.MockGoogleCredential(), 'http://localhost:1', None, None)
+        ref = db_async.AsyncReference(client=client, path='/foo')
+        with pytest.raises(db.ApiCallError):
+            loop.run_until_complete(ref.get())
+        client.close()
+
+    def test_session_per_loop(self, server, client, loop):
+        server.tree = {'foo': 1}
+        ref = db_async.AsyncReference(client=client, path='/foo')
+        assert loop.run_until_complete(ref.get()) == 1
+        session = client._sessions[loop]
+        other_loop = asyncio.new_event_loop()
+        try:
+            asyncio.set_event_loop(other_loop)
+            assert other_loop.run_until_complete(ref.get()) == 1
+            other_session = client._sessions[other_loop]
+            assert other_session is not session
+            asyncio.set_event_loop(loop)
+            assert loop.run_until_complete(ref.get()) == 1
+            assert client._sessions[loop] is session
+            client.close()
+            assert session.closed
+            assert other_session.closed
+        finally:
+            asyncio.set_event_loop(loop)
+            other_loop.close()
+
+    def test_auth_override(self, server, loop):
+        client = db_async._AsyncClient(
+            testutils.MockGoogleCredential(), server.url,
+            'auth_variable_override={"uid":"user1"}', None)
+        ref = db_async.AsyncReference(client=client, path='/foo')
+        loop.run_until_complete(ref.get(shallow=True))
+        assert server.requests[0][2] == {
+            'shallow': ['true'], 'auth_variable_override': ['{"uid":"user1"}']}
+        client.close()
+
+    def test_server_limits(self, server, client, loop):
+        server.tree = {'foo': {'bar': 1}}
+        client.server_timeout = 5
+        client.write_size_limit = 'small'
+        ref = db_async.AsyncReference(client=client, path='/foo')
+        assert loop.run_until_complete(ref.get()) == {'bar': 1}
+        assert loop.run_until_complete(ref.get(server_timeout=0.5)) == {'bar': 1}
+        assert loop.run_until_complete(ref.order_by_key().get(server_timeout=1)) == {'bar': 1}
+        loop.run_until_complete(ref.set({'a': 1}))
+        loop.run_until_complete(ref.update({'b': 2}, write_size_limit='tiny'))
+        loop.run_until_complete(ref.delete(write_size_limit='unlimited'))
+        queries = [(req[2].get('timeout'), req[2].get('writeSizeLimit'))
+                   for req in server.requests]
+        assert queries == [
+            (['5000ms'], None), (['500ms'], None), (['1000ms'], None),
+            (None, ['small']), (None, ['tiny']), (None, ['unlimited'])]
+        with pytest.raises(ValueError):
+            loop.run_until_complete(ref.get(server_timeout=0))
+        with pytest.raises(ValueError):
+            loop.run_until_complete(ref.delete(write_size_limit='huge'))
+        assert len(server.requests) == 6
+
+
+class TestReference(object):
+    """Test cases for db_async.reference()."""
+
+    def teardown_method(self):
+        testutils.cleanup_apps()
+
+    def test_reference(self):
+        firebase_admin.initialize_app(testutils.MockCredential(), {
+            'databaseURL': 'https://test.firebaseio.com',
+            'httpTimeout': 30,
+            'databaseAuthVariableOverride': {'uid': 'user1'},
+        })
+        ref = db_async.reference('/foo')
+        assert isinstance(ref, db_async.AsyncReference)
+        assert ref.path == '/foo'
+        client = ref._client
+        assert client.base_url == 'https://test.firebaseio.com'
+        assert client.timeout == 30
+        assert client.auth_override == 'auth_variable_override={"uid":"user1"}'
+        assert db_async.reference()._client is client
+        other = db_async.reference(url='https://other.firebaseio.com')._client
+        assert other is not client
+        assert other.base_url == 'https://other.firebaseio.com'
+        assert db.reference()._client is not client
+
+    @pytest.mark.parametrize('url', [None, '', 'http://test.firebaseio.com', 'https://google.com'])
+    def test_invalid_url(self, url):
+        firebase_admin.initialize_app(testutils.MockCredential(), {'databaseURL': url})
+        with pytest.raises(ValueError):
+            db_async.reference()
+
+    def test_app_delete(self, server, loop):
+        app = firebase_admin.initialize_app(testutils.MockCredential(), {
+            'databaseURL': 'https://test.firebaseio.com',
+        })
+        ref = db_async.reference()
+        ref._client.base_url = server.url
+        assert loop.run_until_complete(ref.get()) is None
+        session = ref._client._sessions[loop]
+        assert not session.closed
+        firebase_admin.delete_app(app)
+        assert session.closed
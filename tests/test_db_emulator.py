@@ -0,0 +1,237 @@
+# Copyright 2018 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Tests for firebase_admin.db_emulator, via the db module."""
+import collections
+import threading
+import time
+
+import pytest
+import requests
+
+import firebase_admin
+from firebase_admin import db
+from firebase_admin import db_emulator
+from firebase_admin import _db_client
+from tests import testutils
+
+
+@pytest.fixture(scope='module')
+def emulator():
+    # Closing a listener waits for the next message on its stream.
+    keep_alive = db_emulator._KEEP_ALIVE_SECONDS
+    db_emulator._KEEP_ALIVE_SECONDS = 0.1
+    instance = db_emulator.Emulator()
+    instance.start()
+    yield instance
+    instance.stop()
+    db_emulator._KEEP_ALIVE_SECONDS = keep_alive
+
+
+@pytest.fixture
+def app(emulator):
+    emulator.set('/', None)
+    app = firebase_admin.initialize_app(testutils.MockCredential(), {
+        'databaseURL': emulator.url,
+    })
+    yield app
+    testutils.cleanup_apps()
+
+
+def wait_for(events, count, timeout_seconds=5):
+    must_end = time.time() + timeout_seconds
+    while time.time() < must_end:
+        if len(events) >= count:
+            return
+        time.sleep(0.01)
+    raise pytest.fail('Timed out while waiting for events')
+
+
+class TestEmulator(object):
+    """Test cases for the Emulator class."""
+
+    def test_url(self, emulator):
+        assert emulator.url.startswith('http://127.0.0.1:')
+        assert _db_client.DatabaseService._validate_url(emulator.url) == emulator.url
+
+    def test_not_running(self):
+        emulator = db_emulator.Emulator()
+        with pytest.raises(ValueError):
+            emulator.url # pylint: disable=pointless-statement
+        emulator.stop()
+
+    def test_context_manager(self):
+        with db_emulator.Emulator(data={'foo': 'bar'}) as emulator:
+            assert requests.get(emulator.url + '/foo.json').json() == 'bar'
+            assert emulator.request_count == 1
+        with pytest.raises(ValueError):
+            emulator.url # pylint: disable=pointless-statement
+
+    @pytest.mark.parametrize('host', ['0.0.0.0', 'example.com', ''])
+    def test_invalid_host(self, host):
+        with pytest.raises(ValueError):
+            db_emulator.Emulator(host=host)
+
+    def test_get_set(self, emulator):
+        emulator.set('/', {'a': {'b': 1}, 'c': [1, 2]})
+        assert emulator.get() == {'a': {'b': 1}, 'c': [1, 2]}
+        assert emulator.get('/a/b') == 1
+        emulator.set('/a/b', None)
+        assert emulator.get() == {'c': [1, 2]}
+
+    def test_emulator_credential(self, app):
+        ref = db.reference()
+        assert isinstance(ref._client.credential, _db_client._EmulatorCredential)
+        assert ref._client.credential.valid
+        assert ref._client.credential.token == 'owner'
+        del app
+
+
+class TestReferenceWithEmulator(object):
+    """Test cases for db.Reference against the emulator."""
+
+    def test_set_get(self, app):
+        ref = db.reference('/users/alice')
+        ref.set({'name': 'Alice', 'age': 30, 'tags': ['a', 'b']})
+        assert ref.get() == {'name': 'Alice', 'age': 30, 'tags': ['a', 'b']}
+        assert ref.child('age').get() == 30
+        assert ref.parent.get(shallow=True) == {'alice': True}
+        assert db.reference('/missing').get() is None
+        del app
+
+    def test_update_delete(self, app):
+        ref = db.reference('/users')
+        ref.set({'alice': {'age': 30}, 'bob': {'age': 25}})
+        ref.update({'alice/age': 31, 'carol': {'age': 35}})
+        assert ref.get() == {'alice': {'age': 31}, 'bob': {'age': 25}, 'carol': {'age': 35}}
+        ref.child('bob').delete()
+        assert sorted(ref.get()) == ['alice', 'carol']
+        ref.child('alice/age').delete()
+        assert ref.get() == {'carol': {'age': 35}}
+        del app
+
+    def test_invalid_update(self, app):
+        ref = db.reference('/users')
+        with pytest.raises(db.ApiCallError) as excinfo:
+            ref.update({'alice': {'age': 30}, 'alice/age': 31})
+        assert 'ancestor' in str(excinfo.value)
+        del app
+
+    def test_push(self, app):
+        ref = db.reference('/messages')
+        children = [ref.push({'text': str(i)}) for i in range(20)]
+        keys = [child.key for child in children]
+        assert all(len(key) == 20 for key in keys)
+        assert keys == sorted(keys)
+        assert len(set(keys)) == 20
+        assert ref.child(keys[3]).get() == {'text': '3'}
+        del app
+
+    def test_server_timestamp(self, app):
+        ref = db.reference('/updated')
+        before = int(time.time() * 1000)
+        ref.set({'.sv': 'timestamp'})
+        assert before <= ref.get() <= int(time.time() * 1000)
+        del app
+
+    def test_etags(self, app):
+        ref = db.reference('/counter')
+        ref.set(1)
+        value, etag = ref.get(etag=True)
+        assert value == 1
+        assert ref.get_if_changed(etag) == (False, None, None)
+        assert ref.set_if_unchanged('wrong', 2) == (False, 1, etag)
+        success, value, new_etag = ref.set_if_unchanged(etag, 2)
+        assert success and value == 2 and new_etag != etag
+        assert ref.get_if_changed(etag) == (True, 2, new_etag)
+        del app
+
+    def test_transaction(self, app):
+        ref = db.reference('/counter')
+        ref.set(0)
+        def increment():
+            for _ in range(10):
+                ref.transaction(lambda current: (current or 0) + 1)
+        threads = [threading.Thread(target=increment) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        assert ref.get() == 40
+        del app
+
+    def test_query(self, app):
+        ref = db.reference('/scores')
+        ref.set({'alice': 30, 'bob': 10, 'carol': 20, 'dave': 40})
+        assert ref.order_by_value().limit_to_first(2).get() == collections.OrderedDict(
+            [('bob', 10), ('carol', 20)])
+        assert list(ref.order_by_value().limit_to_last(2).get()) == ['alice', 'dave']
+        assert list(ref.order_by_value().start_at(20).end_at(30).get()) == ['carol', 'alice']
+        assert list(ref.order_by_key().start_at('bob').limit_to_first(2).get()) == [
+            'bob', 'carol']
+        assert list(ref.order_by_value().equal_to(40).get()) == ['dave']
+        del app
+
+    def test_query_by_child(self, app):
+        ref = db.reference('/users')
+        ref.set({'alice': {'age': 30}, 'bob': {'age': 25}, 'carol': {}})
+        assert list(ref.order_by_child('age').get()) == ['bob', 'alice']
+        assert list(ref.order_by_child('age').start_at(26).get()) == ['alice']
+        del app
+
+    def test_invalid_query(self, app, emulator):
+        resp = requests.get(emulator.url + '/users.json?limitToFirst=1')
+        assert resp.status_code == 400
+        assert 'orderBy' in resp.json()['error']
+        del app
+
+    def test_listen(self, app):
+        ref = db.reference('/room')
+        ref.set({'a': 1})
+        events = []
+        registration = ref.listen(events.append)
+        try:
+            wait_for(events, 1)
+            ref.child('b').set(2)
+            ref.update({'a': None, 'c/d': 3})
+            db.reference('/').update({'room/e': 5, 'other': 1})
+            db.reference('/').set({'room': 'replaced'})
+            db.reference('/other').set(2)
+            wait_for(events, 5)
+        finally:
+            registration.close()
+        received = [(event.event_type, event.path, event.data) for event in events]
+        assert received == [
+            ('put', '/', {'a': 1}),
+            ('put', '/b', 2),
+            ('patch', '/', {'a': None, 'c/d': 3}),
+            ('patch', '/', {'e': 5}),
+            ('put', '/', 'replaced'),
+        ]
+        del app
+
+    def test_listener_closed(self, app, emulator):
+        ref = db.reference('/room')
+        events = []
+        registration = ref.listen(events.append)
+        wait_for(events, 1)
+        assert emulator.listener_count >= 1
+        registration.close()
+        # The emulator notices the closed connection on the next event.
+        must_end = time.time() + 5
+        while emulator.listener_count and time.time() < must_end:
+            ref.set(time.time())
+            time.sleep(0.01)
+        assert emulator.listener_count == 0
+        del app
@@ -15,6 +15,8 @@
 """Tests for firebase_admin._sseclient."""
 import json
 
+import pytest
+from pytest_localserver import plugin
 import requests
 import six
 
@@ -22,6 +24,17 @@ from firebase_admin import _sseclient
 from tests import testutils
 
 
+# Fixture for mocking a HTTP server
+httpserver = plugin.httpserver
+
+
+@pytest.fixture
+def keepalive_server():
+    server = testutils.KeepAliveServer()
+    yield server
+    server.stop()
+
+
 class MockSSEClientAdapter(testutils.MockAdapter):
 
     def __init__(self, payload, recorder):
@@ -119,6 +132,173 @@ class TestSSEClient(object):
         assert event_payload["path"] == "/baz"
         assert len(recorder) == 1
 
+    def test_keep_alive_event(self):
+        payload = 'event: keep-alive\ndata: null\n\n'
+        payload += 'event: put\ndata: {"path":"/","data":"testevent"}\n\n'
+        sseclient = self.init_sse(payload)
+        assert next(sseclient) is None
+        event = next(sseclient)
+        assert json.loads(event.data)["data"] == "testevent"
+
+
+    def test_non_chunked_stream(self, keepalive_server):
+        # Each event must be delivered as soon as it arrives, without waiting for more data.
+        keepalive_server.serve_parts([
+            'event: put\ndata: {"path":"/foo","data":1}\n\n',
+            'event: put\ndata: {"path":"/bar","data":2}\n\n',
+        ], {'Content-Type': 'text/event-stream'})
+        sseclient = _sseclient.SSEClient(keepalive_server.url, requests.Session(), retry=1)
+        assert json.loads(next(sseclient).data)['path'] == '/foo'
+        assert keepalive_server.parts_sent == 1
+        keepalive_server.next_part.set()
+        assert json.loads(next(sseclient).data)['path'] == '/bar'
+        sseclient.close()
+
+    def test_close(self, keepalive_server):
+        keepalive_server.serve_content(
+            'event: put\ndata: {"path":"/foo","data":1}\n\n', 200,
+            {'Content-Type': 'text/event-stream'})
+        sseclient = _sseclient.SSEClient(keepalive_server.url, requests.Session(), retry=1)
+        assert json.loads(next(sseclient).data)['path'] == '/foo'
+        # As when another thread closes the client while this one is reading from it.
+        sseclient.close()
+        assert list(sseclient) == []
+        assert len(keepalive_server.requests) == 1
+
+
+class TestEventBuffer(object):
+    """Test cases for the _EventBuffer"""
+
+    def test_no_event(self):
+        buf = _sseclient._EventBuffer()
+        assert buf.next_event() is None
+        buf.append(b'event: put\ndata: {}\n')
+        assert buf.next_event() is None
+
+    def test_multiple_events_in_chunk(self):
+        buf = _sseclient._EventBuffer()
+        buf.append(b'event: put\ndata: 1\n\nevent: patch\ndata: 2\r\revent: put\ndata: 3\r\n\r\n')
+        assert buf.next_event() == 'event: put\ndata: 1'
+        assert buf.next_event() == 'event: patch\ndata: 2'
+        assert buf.next_event() == 'event: put\ndata: 3'
+        assert buf.next_event() is None
+
+    @pytest.mark.parametrize('separator', [b'\n\n', b'\r\r', b'\r\n\r\n'])
+    def test_separator_split_across_chunks(self, separator):
+        payload = b'event: put\ndata: {"path":"/","data":"testevent"}' + separator
+        for split in range(1, len(payload)):
+            buf = _sseclient._EventBuffer()
+            buf.append(payload[:split])
+            first = buf.next_event()
+            buf.append(payload[split:])
+            event = first if first is not None else buf.next_event()
+            assert event == 'event: put\ndata: {"path":"/","data":"testevent"}'
+            assert buf.next_event() is None
+
+    def test_multibyte_character_split_across_chunks(self):
+        payload = u'data: {"path":"/","data":"\u00e9\u4e2d"}\n\n'.encode('utf-8')
+        buf = _sseclient._EventBuffer()
+        for i in range(len(payload)):
+            buf.append(payload[i:i+1])
+            if i < len(payload) - 1:
+                assert buf.next_event() is None
+        assert buf.next_event() == u'data: {"path":"/","data":"\u00e9\u4e2d"}'
+
+    def test_clear(self):
+        buf = _sseclient._EventBuffer()
+        buf.append(b'event: put\ndata: partial')
+        buf.clear()
+        buf.append(b'event: put\ndata: 1\n\n')
+        assert buf.next_event() == 'event: put\ndata: 1'
+
+
+@pytest.mark.skipif(six.PY2, reason='SSEStream requires Python 3')
+class TestSSEStream(object):
+    """Test cases for the non-blocking SSEStream"""
+
+    payload = ('event: put\ndata: {"path":"/foo","data":"testevent1"}\n\n'
+               'event: keep-alive\ndata: null\n\n'
+               'event: put\nid: 1\nretry: 10\ndata: {"path":"/bar","data":"testevent2"}\n\n')
+
+    def read_all(self, stream):
+        events = stream.read_events()
+        while not stream.needs_reconnect:
+            events.extend(stream.read_events())
+        return events
+
+    def test_read_events(self, keepalive_server):
+        keepalive_server.serve_content(self.payload, 200, {'Content-Type': 'text/event-stream'})
+        stream = _sseclient.SSEStream(keepalive_server.url, requests.Session())
+        stream.connect()
+        assert stream.fileno() >= 0
+        events = self.read_all(stream)
+        stream.close()
+        assert [json.loads(e.data)['path'] for e in events] == ['/foo', '/bar']
+        assert stream.retry == 10
+        assert stream.last_id == '1'
+        assert keepalive_server.requests[0].headers['Accept-Encoding'] == 'identity'
+        assert keepalive_server.requests[0].headers['Cache-Control'] == 'no-cache'
+
+    def test_reconnect(self, keepalive_server):
+        keepalive_server.serve_content(self.payload, 200, {'Content-Type': 'text/event-stream'})
+        stream = _sseclient.SSEStream(keepalive_server.url, requests.Session())
+        stream.connect()
+        self.read_all(stream)
+        # The whole response may arrive along with the headers, in which case the stream is
+        # ready to reconnect again right away.
+        stream.connect()
+        events = self.read_all(stream)
+        stream.close()
+        assert len(events) == 2
+        assert len(keepalive_server.requests) == 2
+        assert keepalive_server.requests[1].headers['Last-Event-ID'] == '1'
+
+    def test_credential_expired(self, keepalive_server):
+        payload = 'event: auth_revoked\ndata: credential is no longer valid\n\n' + self.payload
+        keepalive_server.serve_content(payload, 200, {'Content-Type': 'text/event-stream'})
+        stream = _sseclient.SSEStream(keepalive_server.url, requests.Session())
+        stream.connect()
+        assert self.read_all(stream) == []
+        stream.close()
+
+    def test_connect_error(self, keepalive_server):
+        keepalive_server.serve_content('{}', 500)
+        stream = _sseclient.SSEStream(keepalive_server.url, requests.Session())
+        with pytest.raises(requests.exceptions.HTTPError):
+            stream.connect()
+
+    def test_connection_close_not_supported(self, httpserver):
+        # The server closes the connection after the response, so its socket is not available.
+        httpserver.serve_content(self.payload, 200, {'Content-Type': 'text/event-stream'})
+        stream = _sseclient.SSEStream(httpserver.url, requests.Session())
+        with pytest.raises(_sseclient.UnsupportedStreamError):
+            stream.connect()
+        assert stream.resp is None
+
+
+class TestChunkedDecoder(object):
+    """Test cases for the _ChunkedDecoder"""
+
+    body = b'5\r\nhello\r\n7;ext=1\r\n, world\r\n0\r\n\r\n'
+
+    def test_decode(self):
+        decoder = _sseclient._ChunkedDecoder()
+        assert decoder.feed(self.body) == b'hello, world'
+        assert decoder.done
+
+    def test_decode_byte_by_byte(self):
+        decoder = _sseclient._ChunkedDecoder()
+        output = b''
+        for i in range(len(self.body)):
+            output += decoder.feed(self.body[i:i+1])
+        assert output == b'hello, world'
+        assert decoder.done
+
+    def test_invalid_chunk_size(self):
+        decoder = _sseclient._ChunkedDecoder()
+        with pytest.raises(ValueError):
+            decoder.feed(b'xyz\r\n')
+
 
 class TestEvent(object):
     """Test cases for server-side events"""
@@ -22,6 +22,7 @@ import pytest
 import firebase_admin
 from firebase_admin import auth
 from firebase_admin import _auth_utils
+from firebase_admin import _concurrency
 from firebase_admin import _user_import
 from firebase_admin import _user_mgt
 from tests import testutils
@@ -56,14 +57,32 @@ def user_mgt_app():
     firebase_admin.delete_app(app)
 
 def _instrument_user_manager(app, status, payload):
+    """Mounts a mock adapter on the user manager of the given app.
+
+    The payload is either a response body string, or a handler function that computes the
+    response from the JSON body of each request.
+    """
     auth_service = auth._get_auth_service(app)
     user_manager = auth_service.user_manager
     recorder = []
-    user_manager._client.session.mount(
-        auth._AuthService.ID_TOOLKIT_URL,
-        testutils.MockAdapter(payload, status, recorder))
+    if callable(payload):
+        adapter = testutils.MockJsonAdapter(payload, status, recorder)
+    else:
+        adapter = testutils.MockAdapter(payload, status, recorder)
+    user_manager._client.session.mount(auth._AuthService.ID_TOOLKIT_URL, adapter)
     return user_manager, recorder
 
+def _batch_delete_handler(failing_uids=()):
+    return testutils.batch_error_handler('localIds', 'errors', failing_uids)
+
+def _batch_create_handler(failing_uids=()):
+    return testutils.batch_error_handler(
+        'users', 'error', failing_uids, get_id=lambda user: user['localId'])
+
+def _batch_sizes(recorder, items_key):
+    """Returns the sorted numbers of items sent in the recorded batch requests."""
+    return sorted(len(json.loads(r.body.decode())[items_key]) for r in recorder)
+
 def _check_user_record(user, expected_uid='testuser'):
     assert isinstance(user, auth.UserRecord)
     assert user.uid == expected_uid
@@ -237,6 +256,106 @@ class TestGetUser(object):
         assert '{"error":"test"}' in str(excinfo.value)
 
 
+class TestGetUsers(object):
+
+    users = [
+        {'localId': 'user{0}'.format(i), 'email': 'user{0}@example.com'.format(i),
+         'phoneNumber': '+1555000{0:04d}'.format(i)}
+        for i in range(250)
+    ]
+
+    def _find_users(self, body):
+        """Selects the users an accounts:lookup request asks for."""
+        emails = [email.lower() for email in body.get('email', [])]
+        return [
+            user for user in self.users
+            if user['localId'] in body.get('localId', [])
+            or user.get('email') in emails
+            or user.get('phoneNumber') in body.get('phoneNumber', [])]
+
+    @pytest.mark.parametrize('arg', [None, 'foo', auth.UidIdentifier('foo'), ['foo'], [None]])
+    def test_invalid_identifiers(self, arg, user_mgt_app):
+        with pytest.raises(ValueError):
+            auth.get_users(arg, app=user_mgt_app)
+
+    @pytest.mark.parametrize('arg', INVALID_STRINGS + ['a'*129])
+    def test_invalid_uid_identifier(self, arg):
+        with pytest.raises(ValueError):
+            auth.UidIdentifier(arg)
+
+    @pytest.mark.parametrize('arg', INVALID_STRINGS + ['not-an-email'])
+    def test_invalid_email_identifier(self, arg):
+        with pytest.raises(ValueError):
+            auth.EmailIdentifier(arg)
+
+    @pytest.mark.parametrize('arg', INVALID_STRINGS + ['not-a-phone'])
+    def test_invalid_phone_identifier(self, arg):
+        with pytest.raises(ValueError):
+            auth.PhoneIdentifier(arg)
+
+    @pytest.mark.parametrize('arg', INVALID_INTS + [0])
+    def test_invalid_concurrency(self, arg, user_mgt_app):
+        with pytest.raises(ValueError):
+            auth.get_users([auth.UidIdentifier('user1')], concurrency=arg, app=user_mgt_app)
+
+    def test_get_users_empty(self, user_mgt_app):
+        _, recorder = _instrument_user_manager(
+            user_mgt_app, 200, testutils.batch_handler('users', self._find_users))
+        result = auth.get_users([], app=user_mgt_app)
+        assert result.users == []
+        assert result.not_found == []
+        assert len(recorder) == 0
+
+    def test_get_users_mixed(self, user_mgt_app):
+        _, recorder = _instrument_user_manager(
+            user_mgt_app, 200, testutils.batch_handler('users', self._find_users))
+        missing = [
+            auth.UidIdentifier('missing'),
+            auth.EmailIdentifier('missing@example.com'),
+            auth.PhoneIdentifier('+15559999999'),
+        ]
+        identifiers = [
+            auth.UidIdentifier('user1'),
+            auth.EmailIdentifier('USER2@example.com'),
+            missing[0],
+            auth.PhoneIdentifier('+15550000003'),
+            missing[1],
+            auth.EmailIdentifier('user1@example.com'),
+            missing[2],
+        ]
+        result = auth.get_users(identifiers, app=user_mgt_app)
+        assert [user.uid for user in result.users] == ['user1', 'user2', 'user3']
+        assert all(isinstance(user, auth.UserRecord) for user in result.users)
+        assert result.not_found == missing
+        assert len(recorder) == 1
+        assert recorder[0].url == '{0}mock-project-id/accounts:lookup'.format(
+            auth._AuthService.ID_TOOLKIT_URL)
+        assert json.loads(recorder[0].body.decode()) == {
+            'localId': ['user1', 'missing'],
+            'email': ['USER2@example.com', 'missing@example.com', 'user1@example.com'],
+            'phoneNumber': ['+15550000003', '+15559999999'],
+        }
+
+    @pytest.mark.parametrize('concurrency', [1, 3])
+    def test_get_users_batched(self, concurrency, user_mgt_app):
+        _, recorder = _instrument_user_manager(
+            user_mgt_app, 200, testutils.batch_handler('users', self._find_users))
+        identifiers = [auth.UidIdentifier('user{0}'.format(i)) for i in range(260)]
+        result = auth.get_users(identifiers, concurrency=concurrency, app=user_mgt_app)
+        assert [user.uid for user in result.users] == ['user{0}'.format(i) for i in range(250)]
+        assert [identifier.uid for identifier in result.not_found] == [
+            'user{0}'.format(i) for i in range(250, 260)]
+        assert len(recorder) == 3
+        assert _batch_sizes(recorder, 'localId') == [60, 100, 100]
+
+    def test_get_users_http_error(self, user_mgt_app):
+        _instrument_user_manager(user_mgt_app, 500, '{"error":"test"}')
+        with pytest.raises(auth.AuthError) as excinfo:
+            auth.get_users([auth.UidIdentifier('user1')], app=user_mgt_app)
+        assert excinfo.value.code == _user_mgt.INTERNAL_ERROR
+        assert '{"error":"test"}' in str(excinfo.value)
+
+
 class TestCreateUser(object):
 
     @pytest.mark.parametrize('arg', INVALID_STRINGS[1:] + ['a'*129])
@@ -487,6 +606,105 @@ class TestDeleteUser(object):
         assert '{"error":"test"}' in str(excinfo.value)
 
 
+class _FakeClock(object):
+    """A stand-in for the time module, whose sleep() advances the clock without blocking."""
+
+    def __init__(self):
+        self.now = 0
+        self.sleeps = []
+
+    def time(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+
+class TestDeleteUsers(object):
+
+    @pytest.mark.parametrize('arg', [None, 'foo', 1, dict(), ['a'*129], [None], ['']])
+    def test_invalid_uids(self, arg, user_mgt_app):
+        with pytest.raises(ValueError):
+            auth.delete_users(arg, app=user_mgt_app)
+
+    @pytest.mark.parametrize('arg', INVALID_INTS + [0])
+    def test_invalid_concurrency(self, arg, user_mgt_app):
+        with pytest.raises(ValueError):
+            auth.delete_users(['user1'], concurrency=arg, app=user_mgt_app)
+
+    @pytest.mark.parametrize('arg', ['foo', '1', 0, -1, True, list(), float('inf'), float('nan')])
+    def test_invalid_max_rate(self, arg, user_mgt_app):
+        with pytest.raises(ValueError):
+            auth.delete_users(['user1'], max_rate=arg, app=user_mgt_app)
+
+    def test_rate_limiter(self):
+        clock = _FakeClock()
+        # The clock only advances when set, as if each acquire() was called from its own thread.
+        limiter = _concurrency.RateLimiter(4, clock=clock.time, sleep=clock.sleeps.append)
+        for _ in range(3):
+            limiter.acquire()
+        assert clock.sleeps == [0.25, 0.5]
+        clock.now = 100
+        limiter.acquire()
+        limiter.acquire()
+        assert clock.sleeps == [0.25, 0.5, 0.25]
+
+    def test_delete_users_max_rate(self, user_mgt_app, monkeypatch):
+        clock = _FakeClock()
+        monkeypatch.setattr(_concurrency, 'time', clock)
+        uids = ['user{0}'.format(i) for i in range(3500)]
+        _, recorder = _instrument_user_manager(user_mgt_app, 200, _batch_delete_handler())
+        result = auth.delete_users(uids, concurrency=1, max_rate=0.5, app=user_mgt_app)
+        assert result.success_count == 3500
+        assert len(recorder) == 4
+        assert clock.sleeps == [2.0, 2.0, 2.0]
+
+    def test_delete_users_empty(self, user_mgt_app):
+        _, recorder = _instrument_user_manager(user_mgt_app, 200, _batch_delete_handler())
+        result = auth.delete_users([], app=user_mgt_app)
+        assert result.success_count == 0
+        assert result.failure_count == 0
+        assert result.errors == []
+        assert len(recorder) == 0
+
+    def test_delete_users(self, user_mgt_app):
+        _, recorder = _instrument_user_manager(
+            user_mgt_app, 200, _batch_delete_handler(['user2']))
+        result = auth.delete_users(['user1', 'user2', 'user3'], force=False, app=user_mgt_app)
+        assert isinstance(result, auth.DeleteUsersResult)
+        assert result.success_count == 2
+        assert result.failure_count == 1
+        assert [(err.index, err.reason) for err in result.errors] == [(1, 'failed: user2')]
+        assert len(recorder) == 1
+        assert recorder[0].url == '{0}mock-project-id/accounts:batchDelete'.format(
+            auth._AuthService.ID_TOOLKIT_URL)
+        assert json.loads(recorder[0].body.decode()) == {
+            'localIds': ['user1', 'user2', 'user3'], 'force': False}
+
+    @pytest.mark.parametrize('concurrency', [1, 4])
+    def test_delete_users_batched(self, concurrency, user_mgt_app):
+        uids = ['user{0}'.format(i) for i in range(2500)]
+        _, recorder = _instrument_user_manager(
+            user_mgt_app, 200, _batch_delete_handler(['user5', 'user1005', 'user2499']))
+        result = auth.delete_users(uids, concurrency=concurrency, app=user_mgt_app)
+        assert result.success_count == 2497
+        assert result.failure_count == 3
+        assert [err.index for err in result.errors] == [5, 1005, 2499]
+        assert [err.reason for err in result.errors] == [
+            'failed: user5', 'failed: user1005', 'failed: user2499']
+        assert len(recorder) == 3
+        assert _batch_sizes(recorder, 'localIds') == [500, 1000, 1000]
+        assert all(json.loads(r.body.decode())['force'] is True for r in recorder)
+
+    def test_delete_users_error(self, user_mgt_app):
+        _instrument_user_manager(user_mgt_app, 500, '{"error":"test"}')
+        with pytest.raises(auth.AuthError) as excinfo:
+            auth.delete_users(['user1'], app=user_mgt_app)
+        assert excinfo.value.code == _user_mgt.USER_DELETE_ERROR
+        assert '{"error":"test"}' in str(excinfo.value)
+
+
 class TestListUsers(object):
 
     @pytest.mark.parametrize('arg', [None, 'foo', list(), dict(), 0, -1, 1001, False])
@@ -598,6 +816,76 @@ class TestListUsers(object):
         assert len(users) == 3
         self._check_rpc_calls(recorder)
 
+    def test_list_users_records_reused(self, user_mgt_app):
+        response = {'users': [{'localId': 'user1'}, {'localId': 'user2'}]}
+        _instrument_user_manager(user_mgt_app, 200, json.dumps(response))
+        page = auth.list_users(app=user_mgt_app)
+        users = page.users
+        assert users == page.users
+        assert users is not page.users
+        assert list(page.iterate_all()) == users
+
+    def test_list_users_skips_empty_pages(self, user_mgt_app):
+        response = {'users': [{'localId': 'user1'}], 'nextPageToken': 'token'}
+        _instrument_user_manager(user_mgt_app, 200, json.dumps(response))
+        iterator = auth.list_users(app=user_mgt_app).iterate_all()
+        assert next(iterator).uid == 'user1'
+
+        user_manager = auth._get_auth_service(user_mgt_app).user_manager
+        recorder = []
+        user_manager._client.session.mount(
+            auth._AuthService.ID_TOOLKIT_URL,
+            testutils.MockMultiRequestAdapter(
+                [json.dumps({'nextPageToken': 'token2'}),
+                 json.dumps({'users': [{'localId': 'user2'}]})],
+                [200, 200], recorder))
+        assert next(iterator).uid == 'user2'
+        with pytest.raises(StopIteration):
+            next(iterator)
+        assert len(recorder) == 2
+
+    @staticmethod
+    def _paged_download(page_count, calls, error_token=None):
+        def download(page_token, max_results):
+            index = int(page_token or 0)
+            calls.append(index)
+            if index == error_token:
+                raise auth.AuthError(_user_mgt.USER_DOWNLOAD_ERROR, 'test error')
+            response = {'users': [{'localId': 'user{0}-{1}'.format(index, i)} for i in range(3)]}
+            if index + 1 < page_count:
+                response['nextPageToken'] = str(index + 1)
+            return response
+        return download
+
+    @pytest.mark.parametrize('prefetch', [1, 2, 10])
+    def test_list_users_prefetch(self, prefetch):
+        calls = []
+        page = auth.ListUsersPage(self._paged_download(5, calls), None, 3)
+        iterator = page.iterate_all(prefetch=prefetch)
+        iterator._pending[-1].result()
+        assert calls == list(range(min(prefetch, 4) + 1))
+
+        users = [user.uid for user in iterator]
+        assert users == ['user{0}-{1}'.format(p, i) for p in range(5) for i in range(3)]
+        assert calls == list(range(5))
+
+    def test_list_users_prefetch_error(self):
+        calls = []
+        page = auth.ListUsersPage(self._paged_download(5, calls, error_token=2), None, 3)
+        iterator = page.iterate_all(prefetch=2)
+        users = [next(iterator).uid for _ in range(6)]
+        assert users[-1] == 'user1-2'
+        with pytest.raises(auth.AuthError) as excinfo:
+            next(iterator)
+        assert str(excinfo.value) == 'test error'
+
+    @pytest.mark.parametrize('arg', [None, 'foo', -1, 1.5, True, list()])
+    def test_list_users_invalid_prefetch(self, user_mgt_app, arg):
+        _instrument_user_manager(user_mgt_app, 200, MOCK_LIST_USERS_RESPONSE)
+        page = auth.list_users(app=user_mgt_app)
+        with pytest.raises(ValueError):
+            page.iterate_all(prefetch=arg)
+
     def test_list_users_no_users_response(self, user_mgt_app):
         response = {'users': []}
         _instrument_user_manager(user_mgt_app, 200, json.dumps(response))
@@ -970,6 +1258,80 @@ class TestImportUsers(object):
         assert request == expected
 
 
+class TestImportUsersStream(object):
+
+    @pytest.mark.parametrize('arg', [None, 0, 1, True])
+    def test_invalid_users(self, user_mgt_app, arg):
+        with pytest.raises(ValueError):
+            auth.import_users_stream(arg, app=user_mgt_app)
+
+    @pytest.mark.parametrize('arg', INVALID_INTS + [0])
+    def test_invalid_concurrency(self, arg, user_mgt_app):
+        with pytest.raises(ValueError):
+            auth.import_users_stream([], concurrency=arg, app=user_mgt_app)
+
+    def test_import_users_empty(self, user_mgt_app):
+        _, recorder = _instrument_user_manager(user_mgt_app, 200, _batch_create_handler())
+        result = auth.import_users_stream(iter([]), app=user_mgt_app)
+        assert result.success_count == 0
+        assert result.failure_count == 0
+        assert len(recorder) == 0
+
+    @pytest.mark.parametrize('concurrency', [1, 4])
+    def test_import_users_stream(self, concurrency, user_mgt_app):
+        _, recorder = _instrument_user_manager(
+            user_mgt_app, 200, _batch_create_handler(['user3', 'user1000', 'user2400']))
+        consumed = []
+        def generate():
+            for i in range(2401):
+                consumed.append(i)
+                yield auth.ImportUserRecord(uid='user{0}'.format(i))
+        result = auth.import_users_stream(generate(), concurrency=concurrency, app=user_mgt_app)
+        assert len(consumed) == 2401
+        assert result.success_count == 2398
+        assert result.failure_count == 3
+        assert [err.index for err in result.errors] == [3, 1000, 2400]
+        assert [err.reason for err in result.errors] == [
+            'failed: user3', 'failed: user1000', 'failed: user2400']
+        assert _batch_sizes(recorder, 'users') == [401, 1000, 1000]
+        batches = [json.loads(r.body.decode())['users'] for r in recorder]
+        assert min(batches, key=len)[0]['localId'] == 'user2000'
+
+    def test_import_users_stream_with_hash(self, user_mgt_app):
+        _, recorder = _instrument_user_manager(user_mgt_app, 200, _batch_create_handler())
+        users = (auth.ImportUserRecord(uid='user{0}'.format(i), password_hash=b'password')
+                 for i in range(1500))
+        hash_alg = auth.UserImportHash.hmac_sha256(b'key')
+        result = auth.import_users_stream(users, hash_alg=hash_alg, app=user_mgt_app)
+        assert result.success_count == 1500
+        assert len(recorder) == 2
+        for request in recorder:
+            body = json.loads(request.body.decode())
+            assert body['hashAlgorithm'] == 'HMAC_SHA256'
+            assert body['signerKey'] == _user_import.b64_encode(b'key')
+
+    def test_import_users_stream_missing_required_hash(self, user_mgt_app):
+        _instrument_user_manager(user_mgt_app, 200, _batch_create_handler())
+        users = [auth.ImportUserRecord(uid='user1', password_hash=b'password')]
+        with pytest.raises(ValueError):
+            auth.import_users_stream(users, app=user_mgt_app)
+
+    def test_import_users_stream_invalid_user(self, user_mgt_app):
+        _, recorder = _instrument_user_manager(user_mgt_app, 200, _batch_create_handler())
+        users = [auth.ImportUserRecord(uid='user{0}'.format(i)) for i in range(1000)] + ['foo']
+        with pytest.raises(ValueError):
+            auth.import_users_stream(users, concurrency=1, app=user_mgt_app)
+        assert len(recorder) == 1
+
+    def test_import_users_stream_error(self, user_mgt_app):
+        _instrument_user_manager(user_mgt_app, 500, '{"error":"test"}')
+        users = [auth.ImportUserRecord(uid='user1')]
+        with pytest.raises(auth.AuthError) as excinfo:
+            auth.import_users_stream(users, app=user_mgt_app)
+        assert excinfo.value.code == _user_mgt.USER_IMPORT_ERROR
+        assert '{"error":"test"}' in str(excinfo.value)
+
+
 class TestRevokeRefreshTokkens(object):
 
     def test_revoke_refresh_tokens(self, user_mgt_app):
@@ -13,13 +13,17 @@
 # limitations under the License.
 
 """Common utility classes and functions for testing."""
+import json
 import os
+import threading
 
 from google.auth import credentials
 from google.auth import transport
 from requests import adapters
 from requests import models
 import six
+from six.moves import BaseHTTPServer
+from six.moves import socketserver
 
 import firebase_admin
 
@@ -162,3 +166,136 @@ class MockAdapter(MockMultiRequestAdapter):
     @property
     def data(self):
         return self._responses[0]
+
+
+class MockJsonAdapter(adapters.HTTPAdapter):
+    """A mock HTTP adapter that computes a JSON response from the JSON body of each request.
+
+    The handler is called with the parsed body of each incoming request, and returns the value to
+    be serialized into the body of the response.
+    """
+    def __init__(self, handler, status, recorder):
+        adapters.HTTPAdapter.__init__(self)
+        self._handler = handler
+        self._status = status
+        self._recorder = recorder
+
+    def send(self, request, **kwargs):
+        request._extra_kwargs = kwargs
+        self._recorder.append(request)
+        resp = models.Response()
+        resp.url = request.url
+        resp.status_code = self._status
+        payload = self._handler(json.loads(request.body.decode()))
+        resp.raw = six.BytesIO(json.dumps(payload).encode())
+        return resp
+
+
+def batch_handler(response_key, select):
+    """Returns a ``MockJsonAdapter`` handler that serves a batch endpoint of the Auth API.
+
+    ``select`` is called with the parsed body of each request, and returns the entries to send
+    back under ``response_key``. Like the backend, the handler leaves the key out of the
+    response when there are no entries.
+    """
+    def handler(body):
+        entries = select(body)
+        return {response_key: entries} if entries else {}
+    return handler
+
+
+def batch_error_handler(items_key, errors_key, failing_ids=(), get_id=lambda item: item):
+    """Returns a ``batch_handler()`` that fails the items with the given IDs.
+
+    Each failing item of the ``items_key`` list in a request is reported under ``errors_key``,
+    with its index in the request and a message that names its ID.
+    """
+    def select(body):
+        return [{'index': index, 'message': 'failed: {0}'.format(get_id(item))}
+                for index, item in enumerate(body[items_key]) if get_id(item) in failing_ids]
+    return batch_handler(errors_key, select)
+
+
+class KeepAliveServer(object):
+    """A local HTTP/1.1 server that keeps connections open after each response.
+
+    Responses are sent with chunked transfer encoding, like the event streams of the Realtime
+    Database. Unlike the ``httpserver`` fixture, the server does not send a
+    ``Connection: close`` header. The handler of each received request is recorded in
+    ``requests``, which provides its ``path`` and ``headers``.
+
+    Alternatively, ``serve_parts()`` sends a body without chunked transfer encoding, one part at
+    a time, and closes the connection after the last part.
+    """
+
+    def __init__(self):
+        owner = self
+
+        class Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def do_GET(self): # pylint: disable=invalid-name
+                owner.requests.append(self)
+                if owner.parts is not None:
+                    self._send_parts()
+                    return
+                body = owner.content.encode('utf-8')
+                self.send_response(owner.code)
+                for key, value in owner.headers.items():
+                    self.send_header(key, value)
+                self.send_header('Transfer-Encoding', 'chunked')
+                self.end_headers()
+                if body:
+                    self.wfile.write('{0:x}\r\n'.format(len(body)).encode('ascii'))
+                    self.wfile.write(body + b'\r\n')
+                self.wfile.write(b'0\r\n\r\n')
+                self.wfile.flush()
+
+            def _send_parts(self):
+                self.send_response(200)
+                for key, value in owner.headers.items():
+                    self.send_header(key, value)
+                self.send_header('Connection', 'close')
+                self.end_headers()
+                for index, part in enumerate(owner.parts):
+                    if index:
+                        owner.next_part.wait(5)
+                        owner.next_part.clear()
+                    self.wfile.write(part.encode('utf-8'))
+                    self.wfile.flush()
+                    owner.parts_sent += 1
+                self.close_connection = True
+
+            def log_message(self, *args): # pylint: disable=arguments-differ
+                pass
+
+        class Server(socketserver.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+            daemon_threads = True
+
+        self.content, self.code, self.headers = '', 204, {}
+        self.parts, self.parts_sent = None, 0
+        self.next_part = threading.Event()
+        self.requests = []
+        self._server = Server(('127.0.0.1', 0), Handler)
+        self._thread = threading.Thread(target=self._server.serve_forever)
+        self._thread.daemon = True
+        self._thread.start()
+
+    @property
+    def url(self):
+        return 'http://127.0.0.1:{0}'.format(self._server.server_address[1])
+
+    def serve_content(self, content, code=200, headers=None):
+        self.content, self.code, self.headers = content, code, headers or {}
+
+    def serve_parts(self, parts, headers=None):
+        """Serves a body made of the given strings, without chunked transfer encoding.
+
+        Each part after the first is sent once ``next_part`` is set, or after 5 seconds. The number
+        of parts sent so far is recorded in ``parts_sent``.
+        """
+        self.parts, self.headers = parts, headers or {}
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()